@@ -11,9 +11,12 @@ from ..utils.statistic import pod, far, kss, hr
 
 
 class FY4AAGRICLM4KM(ProductionBase):
+    # file names of the product, the start and end times are the 10th and 11th "_" fields
+    file_name_pattern = "FY4A-_AGRI--_N_DISK_1047E_L2-_CLM-_MULT_NOM_[0-9._]{29}_4000M_V0001.NC"
 
     def __init__(self, fname: str = None, **kwargs):
-        super(FY4AAGRICLM4KM, self).__init__()
+        super(FY4AAGRICLM4KM, self).__init__(dtype=kwargs.get('dtype', None),
+                                             rows=kwargs.get('rows', None))
         try:
             self.fname = fname
             self.fdir = os.path.dirname(fname)
@@ -25,17 +28,12 @@ class FY4AAGRICLM4KM(ProductionBase):
         except Exception as e:
             print(e)
 
-    @property
-    def file_name_pattern(self):
-        return "FY4A-_AGRI--_N_DISK_1047E_L2-_CLM-_MULT_NOM_[0-9._]{29}_4000M_V0001.NC"
-
     def get_clm(self):
         try:
-            f = h5py.File(self.fname, 'r')
-            data = f['CLM'][...]
+            with self._h5_file() as f:
+                data = self._read(f['CLM'])
             data = np.ma.masked_values(data, 126)
             data[data == 127] = 4
-            f.close()
             return data
         except Exception as e:
             print(e)
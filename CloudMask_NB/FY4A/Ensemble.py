@@ -0,0 +1,205 @@
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .FDIFKM import FY4AAGRIL1FDIDISK4KM
+from .Fusion import fusion_engines
+from .LUTBundle import get_classifier_classes
+from .LUTRegistry import lut_registry
+from .Scene import Scene
+
+# the operational ensemble, in the order its classifiers are fused
+default_classifiers = ['TStd', 'Btd_11_85', 'T_11', 'Btd_375_11_Night', 'Tmax_T',
+                       'GeoColorRGB', 'Emiss375Day', 'Emiss375Night']
+# daytime reflectance classifiers, off by default
+day_classifiers = ['Ref063Min3x3Day', 'RefRatioDay', 'Ref138Day', 'NdsiDay', 'Ref063Day', 'RefStdDay']
+
+
+def get_classifier_registry() -> OrderedDict:
+    """Short name -> class of all naive Bayes classifiers, in definition order."""
+    return OrderedDict((cls.short_name, cls) for cls in get_classifier_classes())
+
+
+def get_classifier_class(name: str):
+    """Classifier class by its short name ('T_11') or class name ('T11')."""
+    registry = get_classifier_registry()
+    if name in registry:
+        return registry[name]
+    for cls in registry.values():
+        if cls.__name__ == name:
+            return cls
+    raise KeyError('unknown classifier %s, available: %s' % (name, ', '.join(registry)))
+
+
+class NBEnsemble(object):
+    """A configurable set of naive Bayes classifiers fused into one cloud mask.
+
+    Each classifier declares the Scene fields it reads (``feature_inputs`` and
+    ``valid_mask_inputs``), so the ensemble knows all the inputs of a run up
+    front: they are read once, shared by the classifiers, and only the inputs
+    of the enabled classifiers are loaded.
+
+    Examples:
+        >>> ensemble = NBEnsemble(default_classifiers + ['RefRatioDay'], fusion_engine='log')
+        >>> ensemble = NBEnsemble.from_config('ensemble.json')
+        >>> dig_p = ensemble.classify(Scene(l1_file_path, geo_file_path))
+    """
+
+    def __init__(self, classifiers: list = None, fusion_engine: str = 'product', prior: str = 'T_11',
+                 registry=None, workers: int = 1):
+        super(NBEnsemble, self).__init__()
+        # threads running the classifiers of a scene, 1 runs them in the calling thread
+        self.workers = max(int(workers), 1)
+        if classifiers is None:
+            classifiers = default_classifiers
+        self.classifier_classes = []
+        for classifier in classifiers:
+            cls = get_classifier_class(classifier) if isinstance(classifier, str) else classifier
+            if cls in self.classifier_classes:
+                raise ValueError('classifier %s given twice' % cls.short_name)
+            self.classifier_classes.append(cls)
+        if fusion_engine not in fusion_engines:
+            raise ValueError('unknown fusion engine %s, available: %s' % (fusion_engine, ', '.join(fusion_engines)))
+        self.fusion_engine = fusion_engine
+        # the prior cloud probability per surface type comes from this classifier's LUT
+        self.prior_class = get_classifier_class(prior) if isinstance(prior, str) else prior
+        self.registry = lut_registry if registry is None else registry
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """Ensemble of a configuration, a dict or the path of a JSON file.
+
+        Keys are 'classifiers' (names, the default ensemble if absent), 'day'
+        (add the daytime classifiers), 'fusion', 'prior' and 'workers'.
+        """
+        if isinstance(config, str):
+            with open(config, 'r') as f:
+                config = json.load(f)
+        classifiers = list(config.get('classifiers', default_classifiers))
+        if config.get('day', False):
+            classifiers += [name for name in day_classifiers if name not in classifiers]
+        kwargs.setdefault('fusion_engine', config.get('fusion', 'product'))
+        kwargs.setdefault('prior', config.get('prior', 'T_11'))
+        kwargs.setdefault('workers', config.get('workers', 1))
+        return cls(classifiers, **kwargs)
+
+    def to_config(self) -> dict:
+        """Configuration of the ensemble, see from_config."""
+        return {'classifiers': self.names, 'fusion': self.fusion_engine,
+                'prior': self.prior_class.short_name, 'workers': self.workers}
+
+    @property
+    def names(self) -> list:
+        return [cls.short_name for cls in self.classifier_classes]
+
+    def required_inputs(self) -> list:
+        """Scene fields read by the ensemble, each listed once."""
+        names = ['sft', 'space_mask']
+        for cls in self.classifier_classes:
+            names.extend(name for name in cls.required_inputs() if name not in names)
+        return names
+
+    @property
+    def halo(self) -> int:
+        """Rows of context a block of rows needs to be classified like the whole disk."""
+        return max([Scene.halo(self.required_inputs())] + [cls.halo for cls in self.classifier_classes])
+
+    def get_classifiers(self, month: int) -> list:
+        """Classifier instances of a month, shared through the LUT registry."""
+        return [self.registry.get(cls, month) for cls in self.classifier_classes]
+
+    def run(self, scene, keep_ratios: bool = False, executor: ThreadPoolExecutor = None):
+        """Fuse the classifiers on a scene.
+
+        The inputs are read first, then with ``workers`` > 1 (or an executor)
+        the classifiers prepare their feature and valid mask and infer their
+        ratio concurrently; the inputs are shared and only read, and most of
+        the work is in NumPy calls that release the GIL. Results are fused by
+        the calling thread as they complete, in ensemble order so that the
+        fused ratio does not depend on the completion order.
+
+        Args:
+            scene (Scene): the scene, its required inputs are read first.
+            keep_ratios (bool): keep the ratio of every classifier in the fusion.
+            executor (ThreadPoolExecutor): pool to run on, shared between scenes;
+                a pool of ``workers`` threads is made for the run by default.
+
+        Returns:
+            fusion (NBFusion): the fused ratios.
+        """
+        scene.prefetch(self.required_inputs())
+        sft = scene.sft
+        space_mask = scene.space_mask
+        fusion = fusion_engines[self.fusion_engine](space_mask.shape, space_mask, keep_ratios=keep_ratios)
+        classifiers = self.get_classifiers(scene.month)
+
+        def infer(classifier):
+            x, valid_mask = classifier.prepare(scene)
+            return fusion.infer_classifier(classifier, x, sft, valid_mask, space_mask)
+
+        if executor is None and self.workers == 1:
+            # in order, so the ratio can go straight into the product as it is inferred
+            for classifier in classifiers:
+                x, valid_mask = classifier.prepare(scene)
+                fusion.add_classifier(classifier, x, sft, valid_mask, space_mask)
+            return fusion
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='nb-classifier')
+        try:
+            futures = {executor.submit(infer, classifier): i for i, classifier in enumerate(classifiers)}
+            done = {}
+            next_idx = 0
+            for future in as_completed(futures):
+                done[futures[future]] = future.result()
+                # fuse every result whose predecessors are fused, then drop it
+                while next_idx in done:
+                    fusion.add_inferred(done.pop(next_idx), classifiers[next_idx].short_name)
+                    next_idx += 1
+        finally:
+            if own_executor:
+                executor.shutdown(wait=True)
+        return fusion
+
+    def prior_yes(self, month: int):
+        return self.registry.get(self.prior_class, month).lut_ds['prior_yes'].data
+
+    def classify(self, scene):
+        """Cloud mask classes of a scene, see NBFusion.digitize.
+
+        A compact scene is classified on its earth vectors and the classes are
+        scattered back to the disk, space pixels set to 126.
+        """
+        fusion = self.run(scene)
+        dig_p = fusion.classify(self.prior_yes(scene.month), scene.sft)
+        if getattr(scene, 'compact', False):
+            dig_p = scene.expand(dig_p, 126)
+        return dig_p
+
+    def classify_blocks(self, l1_file_path: str, geo_file_path: str, block_rows: int, **kwargs):
+        """Cloud mask classes of a disk, a block of rows at a time.
+
+        Each block is read with ``halo`` rows of context above and below, as
+        HDF5 hyperslabs, so window statistics at its edges and hence the
+        classes are the same as on the whole disk; memory is bound by the block
+        size instead of the disk size.
+
+        Args:
+            l1_file_path (str): FY4A AGRI L1 file.
+            geo_file_path (str): its GEO file.
+            block_rows (int): rows classified per block.
+            **kwargs: passed on to Scene, e.g. dtype.
+
+        Yields:
+            rows (slice): rows of the disk of the block.
+            dig_p (numpy.ndarray): cloud mask classes of the block.
+        """
+        n_rows = FY4AAGRIL1FDIDISK4KM(l1_file_path).get_shape()[0]
+        halo = self.halo
+        for start in range(0, n_rows, block_rows):
+            stop = min(start + block_rows, n_rows)
+            read_rows = slice(max(start - halo, 0), min(stop + halo, n_rows))
+            scene = Scene(l1_file_path, geo_file_path, rows=read_rows, **kwargs)
+            dig_p = self.classify(scene)
+            scene.clear()
+            yield slice(start, stop), dig_p[start - read_rows.start:stop - read_rows.start]
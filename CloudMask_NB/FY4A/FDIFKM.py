@@ -26,6 +26,8 @@ class FY4AAGRIL1FDIDISKFakeChannel(FY4AAGRIL1FDIDISKChannel):
 
 
 class FY4AAGRIL1FDIDISK4KM(ProductionBase):
+    # file names of the product, the start and end times are the 10th and 11th "_" fields
+    file_name_pattern = "FY4A-_AGRI--_N_DISK_1047E_L1-_FDI-_MULT_NOM_[0-9._]{29}_4000M_V0001.HDF"
     channel_table: dict = {
         'ref_047': FY4AAGRIL1FDIDISKChannel(short_name='ref_047',
                                             center_wave_length='0.47um',
@@ -91,7 +93,8 @@ class FY4AAGRIL1FDIDISK4KM(ProductionBase):
     }
 
     def __init__(self, fname: str = None, **kwargs):
-        super(FY4AAGRIL1FDIDISK4KM, self).__init__()
+        super(FY4AAGRIL1FDIDISK4KM, self).__init__(dtype=kwargs.get('dtype', None),
+                                                   rows=kwargs.get('rows', None))
         try:
             self.fname = fname
             self.fdir = os.path.dirname(fname)
@@ -103,10 +106,6 @@ class FY4AAGRIL1FDIDISK4KM(ProductionBase):
         except Exception as e:
             print(e)
 
-    @property
-    def file_name_pattern(self):
-        return "FY4A-_AGRI--_N_DISK_1047E_L1-_FDI-_MULT_NOM_[0-9._]{29}_4000M_V0001.HDF"
-
     def get_channel(self, name: str, **kwargs) -> FY4AAGRIL1FDIDISKChannel:
         return self.channel_table[name]
 
@@ -115,9 +114,8 @@ class FY4AAGRIL1FDIDISK4KM(ProductionBase):
 
     def get_data_by_name(self, name: str, **kwargs) -> np.ma.masked_array:
         try:
-            f = h5py.File(self.fname, 'r')
-            data = self._decorate_ds_data(f[name])
-            f.close()
+            with self._h5_file() as f:
+                data = self._decorate_ds_data(f[name])
             return data
         except Exception as e:
             print(e)
@@ -127,33 +125,91 @@ class FY4AAGRIL1FDIDISK4KM(ProductionBase):
         pass
 
     def get_band_by_channel(self, name: str, **kwargs) -> np.ma.masked_array:
-        band_array = None
+        bands = self.get_bands([name])
+        return bands.get(name, None)
+
+    def get_bands(self, names: list, **kwargs) -> dict:
+        """Decode several channels with a single open of the L1 file.
+
+        Physical channels shared by fake channels (bt_372_low and bt_1080 for
+        ems_372) are decoded only once.
+
+        Args:
+            names (list): channel short names, see ``channel_table``.
+
+        Returns:
+            bands (dict): channel short name -> calibrated masked array.
+        """
+        bands = {}
+        decoded = {}
         try:
-            f = h5py.File(self.fname, 'r')
-            channel_cursor = self.channel_table[name]
-            if isinstance(channel_cursor, FY4AAGRIL1FDIDISKFakeChannel):
-                if channel_cursor.short_name == 'ems_372':
-                    data_372 = self.get_band_by_channel('bt_372_low')
-                    data_1080 = self.get_band_by_channel('bt_1080')
-                    c2 = 14388
-                    ems_372 = (np.exp(c2 / (3.9 * data_1080)) - 1) / (np.exp(c2 / (3.9 * data_372)) - 1)
-                    band_array = ems_372
-            else:
-                # idx data set name
-                idx_ds_name = channel_cursor.data_ds_name
-                idx_data = self._decorate_ds_data(f[idx_ds_name])
-                # temporal filter
-                idx_data.mask[idx_data.data>60000] = True
-                # cal data set name
-                cal_ds_name = channel_cursor.cal_ds_name
-                cal_data = self._decorate_ds_data(f[cal_ds_name])
-                idx_data[~idx_data.mask] = cal_data[idx_data[~idx_data.mask].astype(np.int)]
-                f.close()
-                band_array = idx_data
-            return band_array
+            with self:
+                for name in names:
+                    bands[name] = self._decode_channel(name, decoded)
         except Exception as e:
             print(e, self.fname)
             traceback.print_exc()
+        return bands
+
+    def get_shape(self) -> tuple:
+        """Shape of the full disk images, whatever the rows of the reader."""
+        with self._h5_file() as f:
+            return f[self.channel_table['bt_1080'].data_ds_name].shape
+
+    def _decode_channel(self, name: str, decoded: dict) -> np.ma.masked_array:
+        if name in decoded:
+            return decoded[name]
+        channel_cursor = self.channel_table[name]
+        band_array = None
+        if isinstance(channel_cursor, FY4AAGRIL1FDIDISKFakeChannel):
+            if channel_cursor.short_name == 'ems_372':
+                data_372 = self._decode_channel('bt_372_low', decoded)
+                data_1080 = self._decode_channel('bt_1080', decoded)
+                c2 = 14388
+                ems_372 = (np.exp(c2 / (3.9 * data_1080)) - 1) / (np.exp(c2 / (3.9 * data_372)) - 1)
+                band_array = ems_372
+        else:
+            f = self._h5
+            # idx data set name
+            idx_ds_name = channel_cursor.data_ds_name
+            # cal data set name
+            cal_ds_name = channel_cursor.cal_ds_name
+            band_array = self._calibrate_ds_data(f[idx_ds_name], f[cal_ds_name])
+        decoded[name] = band_array
+        return band_array
+
+    def _calibrate_ds_data(self, ds: h5py.Dataset, cal_ds: h5py.Dataset,
+                           dtype=None) -> np.ma.masked_array:
+        """Look the DN of a NOM data set up in its CAL table.
+
+        The raw DN are read as stored (uint16) and calibrated with one ``np.take``
+        into a preallocated output. Fill values, DN above 60000 and DN outside
+        the table are masked; masked pixels keep their DN as data. The output
+        has the float type of the reader unless ``dtype`` is given.
+        """
+        slope = ds.attrs.get('Slope', 0)
+        inter = ds.attrs.get('Intercept', 0)
+        fill = ds.attrs.get('FillValue', 65535)
+        dn = self._read(ds)
+        if np.any(slope != 1) or np.any(inter != 0):
+            dn = slope * dn + inter
+        cal_data = self._decorate_ds_data(cal_ds)
+        table = np.ma.getdata(cal_data)
+        # temporal filter, DN outside the table are invalid as well
+        mask = dn > min(60000, table.shape[0] - 1)
+        if np.any(fill <= min(60000, table.shape[0] - 1)):
+            mask |= dn == fill
+        if np.issubdtype(dn.dtype, np.floating):
+            idx = dn.astype(np.intp)
+        else:
+            idx = dn
+        out = np.empty(dn.shape, dtype or self.dtype)
+        np.take(table, idx, out=out, mode='clip')
+        table_mask = np.ma.getmask(cal_data)
+        if table_mask is not np.ma.nomask and table_mask.any():
+            mask |= np.take(table_mask, idx, mode='clip')
+        np.copyto(out, dn, where=mask, casting='unsafe')
+        return np.ma.masked_array(out, mask)
 
     def get_band(self, name: str) -> np.ndarray:
         pass
@@ -164,9 +220,10 @@ class FY4AAGRIL1FDIDISK4KM(ProductionBase):
     def plot(self, **kwargs):
         plot_type = kwargs.get('flag', 'vis')
         if plot_type == 'vis':
-            r = self.get_band_by_channel('ref_047')
-            g = self.get_band_by_channel('ref_065')
-            b = self.get_band_by_channel('ref_083')
+            bands = self.get_bands(['ref_047', 'ref_065', 'ref_083'])
+            r = bands['ref_047']
+            g = bands['ref_065']
+            b = bands['ref_083']
             img = np.dstack((r, g, b))
             title = kwargs.get('title', 'visual color\n' + os.path.basename(self.fname))
             fig, ax = plt.subplots(1, 1)
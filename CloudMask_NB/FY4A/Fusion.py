@@ -0,0 +1,244 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class NBFusion(object):
+    """Naive Bayes fusion of the class conditional ratios of several classifiers.
+
+    Each ratio is multiplied into one running product as soon as its classifier
+    is done, so the memory held by the fusion does not grow with the number of
+    classifiers. The ratios themselves are only kept when ``keep_ratios`` is set.
+
+    Examples:
+        >>> fusion = NBFusion(space_mask.shape, space_mask)
+        >>> fusion.add(t11.infer(x, sft, valid_mask, space_mask), t11.short_name)
+        >>> fusion.add_classifier(tstd, x_std, sft, valid_mask_std, space_mask)
+        >>> dig_p = fusion.classify(t11.lut_ds['prior_yes'].data, sft)
+    """
+
+    def __init__(self, shape: tuple, space_mask: np.ndarray = None,
+                 keep_ratios: bool = False, dtype=np.float64):
+        super(NBFusion, self).__init__()
+        self.space_mask = space_mask
+        self.keep_ratios = keep_ratios
+        self.names = []
+        self._ratios = OrderedDict()
+        self._allocate(shape, dtype)
+
+    def _allocate(self, shape: tuple, dtype):
+        # float64 by default, a product of eight ratios can overflow float32
+        self.product = np.ones(shape, dtype)
+
+    def add(self, ratio: np.ndarray, name: str = None):
+        """Multiply the ratio of one classifier into the running product in place."""
+        if name is None:
+            name = 'classifier_%d' % len(self.names)
+        if name in self.names:
+            raise ValueError('ratio of %s already fused' % name)
+        np.multiply(self.product, np.ma.getdata(ratio), out=self.product)
+        self.names.append(name)
+        if self.keep_ratios:
+            self._ratios[name] = ratio
+        return self
+
+    def add_classifier(self, classifier, x: np.ndarray, sft: np.ndarray, valid_mask: np.ndarray,
+                       space_mask: np.ndarray = None):
+        """Infer the ratio of a classifier and fuse it under the classifier's short name.
+
+        The classifier multiplies its ratio into the product as it infers it,
+        the full disk ratio is not read a second time.
+        """
+        name = classifier.short_name
+        if name in self.names:
+            raise ValueError('ratio of %s already fused' % name)
+        if space_mask is None:
+            space_mask = self.space_mask
+        ratio = classifier.infer(x, sft, valid_mask, space_mask, product=self.product)
+        self.names.append(name)
+        if self.keep_ratios:
+            self._ratios[name] = ratio
+        return self
+
+    def infer_classifier(self, classifier, x: np.ndarray, sft: np.ndarray, valid_mask: np.ndarray,
+                         space_mask: np.ndarray = None) -> tuple:
+        """What a classifier contributes, for :meth:`add_inferred`.
+
+        The fusion is not touched, so classifiers can be inferred in worker
+        threads and fused by a single thread as they complete.
+        """
+        if space_mask is None:
+            space_mask = self.space_mask
+        return classifier.infer(x, sft, valid_mask, space_mask),
+
+    def add_inferred(self, inferred: tuple, name: str):
+        """Fuse the result of :meth:`infer_classifier`."""
+        return self.add(inferred[0], name)
+
+    def contribution(self, name: str) -> np.ndarray:
+        """Ratio a classifier contributed, only available with ``keep_ratios``."""
+        if name not in self.names:
+            raise KeyError(name)
+        if name not in self._ratios:
+            raise KeyError('ratio of %s not kept, fuse with keep_ratios=True' % name)
+        return self._ratios[name]
+
+    @property
+    def contributions(self) -> OrderedDict:
+        return OrderedDict(self._ratios)
+
+    def posterior(self, prior_yes: np.ndarray, sft: np.ndarray) -> np.ma.masked_array:
+        """Cloud probability p = 1 / (1 + r / prior_yes - r) of the fused ratio r.
+
+        Args:
+            prior_yes (numpy.ndarray): prior cloud probability per surface type.
+            sft (numpy.ndarray): cspp surface type, start from 1, 0 for no type.
+
+        Returns:
+            p (numpy.ma.masked_array): probability, masked on space.
+        """
+        valid = sft > 0
+        r = self.product[valid]
+        # copy of the space mask, filling p must not unmask the caller's mask
+        mask = False if self.space_mask is None else np.array(self.space_mask, bool)
+        p = np.ma.masked_array(np.zeros(self.product.shape, np.float64), mask)
+        p[valid] = 1.0 / (1.0 + r / prior_yes[sft[valid] - 1] - r)
+        return p
+
+    @staticmethod
+    def digitize(p: np.ma.masked_array, space_mask: np.ndarray) -> np.ndarray:
+        """Cloud mask classes of a probability: 0 cloudy, 1 probably cloudy,
+        2 probably clear, 3 clear, 126 space and 4 undetermined."""
+        dig_p = np.full(space_mask.shape, 4, np.uint8)
+        dig_p[p >= 0.9] = 0
+        dig_p[np.logical_and(p >= 0.5, p < 0.9)] = 1
+        dig_p[np.logical_and(p > 0.1, p < 0.5)] = 2
+        dig_p[p <= 0.1] = 3
+        dig_p[np.asarray(space_mask, bool)] = 126
+        return dig_p
+
+    def classify(self, prior_yes: np.ndarray, sft: np.ndarray) -> np.ndarray:
+        """Cloud mask classes of the fused ratio, see :meth:`digitize`."""
+        space_mask = self.space_mask
+        if space_mask is None:
+            space_mask = np.zeros(self.product.shape, bool)
+        return self.digitize(self.posterior(prior_yes, sft), space_mask)
+
+    def __len__(self):
+        return len(self.names)
+
+
+class NBLogFusion(NBFusion):
+    """Naive Bayes fusion in the log domain.
+
+    The classifiers' LUTs are used as log ratios (``NBClassifier.log_ratio``)
+    and the log ratio of the valid pixels of each classifier is added in place
+    into one running sum, no full disk ratio array is made per classifier. With
+    L the sum and prior the prior cloud probability of the surface type,
+
+        p = 1 / (1 + r / prior - r) = 1 / (1 + exp(L + log((1 - prior) / prior)))
+
+    so the classes are thresholds on z = L + log((1 - prior) / prior) and no
+    product of ratios, which overflows or underflows for extreme ratios, is
+    ever formed.
+    """
+
+    # p >= 0.9, p >= 0.5 and p > 0.1 as z <= -log(9), z <= 0 and z < log(9)
+    z_edges = np.array([-np.log(9.0), 0.0, np.nextafter(np.log(9.0), -np.inf)])
+
+    def __init__(self, shape: tuple, space_mask: np.ndarray = None,
+                 keep_ratios: bool = False, dtype=np.float64):
+        super(NBLogFusion, self).__init__(shape, space_mask, keep_ratios, dtype)
+
+    def _allocate(self, shape: tuple, dtype):
+        self.log_sum = np.zeros(shape, dtype)
+
+    def add(self, ratio: np.ndarray, name: str = None):
+        """Add the log of a full ratio array of one classifier."""
+        with np.errstate(divide='ignore'):
+            log_ratio = np.log(np.ma.getdata(ratio), dtype=self.log_sum.dtype)
+        return self.add_log(log_ratio, name)
+
+    def add_log(self, log_ratio: np.ndarray, name: str = None, valid_mask: np.ndarray = None):
+        """Add a log ratio in place, given for the ``valid_mask`` pixels only if set."""
+        if name is None:
+            name = 'classifier_%d' % len(self.names)
+        if name in self.names:
+            raise ValueError('ratio of %s already fused' % name)
+        if valid_mask is None:
+            self.log_sum += log_ratio
+        else:
+            self.log_sum[valid_mask] += log_ratio
+        self.names.append(name)
+        if self.keep_ratios:
+            self._ratios[name] = (valid_mask, log_ratio)
+        return self
+
+    def add_classifier(self, classifier, x: np.ndarray, sft: np.ndarray, valid_mask: np.ndarray,
+                       space_mask: np.ndarray = None):
+        return self.add_inferred(self.infer_classifier(classifier, x, sft, valid_mask, space_mask),
+                                 classifier.short_name)
+
+    def infer_classifier(self, classifier, x: np.ndarray, sft: np.ndarray, valid_mask: np.ndarray,
+                         space_mask: np.ndarray = None) -> tuple:
+        """Log ratio of the valid pixels looked up in the classifier's LUT."""
+        return classifier.infer_log_ratio(x, sft, valid_mask), valid_mask
+
+    def add_inferred(self, inferred: tuple, name: str):
+        log_ratio, valid_mask = inferred
+        return self.add_log(log_ratio, name, valid_mask)
+
+    def contribution(self, name: str) -> np.ndarray:
+        """Ratio a classifier contributed, 1 outside its valid pixels."""
+        if name not in self.names:
+            raise KeyError(name)
+        if name not in self._ratios:
+            raise KeyError('ratio of %s not kept, fuse with keep_ratios=True' % name)
+        valid_mask, log_ratio = self._ratios[name]
+        if valid_mask is None:
+            return np.exp(log_ratio)
+        ratio = np.ones(self.log_sum.shape, self.log_sum.dtype)
+        ratio[valid_mask] = np.exp(log_ratio)
+        return ratio
+
+    @property
+    def contributions(self) -> OrderedDict:
+        return OrderedDict((name, self.contribution(name)) for name in self._ratios)
+
+    def _log_odds(self, prior_yes: np.ndarray, sft: np.ndarray, valid: np.ndarray) -> np.ndarray:
+        # z = L + log((1 - prior) / prior) of the pixels with a surface type
+        log_odds_no = np.log((1.0 - prior_yes) / prior_yes)
+        z = self.log_sum[valid]
+        z += log_odds_no[sft[valid] - 1]
+        return z
+
+    def posterior(self, prior_yes: np.ndarray, sft: np.ndarray) -> np.ma.masked_array:
+        valid = sft > 0
+        z = self._log_odds(prior_yes, sft, valid)
+        with np.errstate(over='ignore'):
+            np.exp(z, out=z)
+        z += 1.0
+        np.reciprocal(z, out=z)
+        mask = False if self.space_mask is None else np.array(self.space_mask, bool)
+        p = np.ma.masked_array(np.zeros(self.log_sum.shape, np.float64), mask)
+        p[valid] = z
+        return p
+
+    def classify(self, prior_yes: np.ndarray, sft: np.ndarray) -> np.ndarray:
+        """Cloud mask classes straight from the log odds, the posterior is never formed."""
+        valid = sft > 0
+        z = self._log_odds(prior_yes, sft, valid)
+        classes = np.searchsorted(self.z_edges, z).astype(np.uint8)
+        classes[np.isnan(z)] = 4
+        # pixels without surface type have p = 0 like in NBFusion
+        dig_p = np.full(self.log_sum.shape, 3, np.uint8)
+        dig_p[valid] = classes
+        if self.space_mask is not None:
+            dig_p[np.asarray(self.space_mask, bool)] = 126
+        return dig_p
+
+
+fusion_engines = {
+    'product': NBFusion,
+    'log': NBLogFusion,
+}
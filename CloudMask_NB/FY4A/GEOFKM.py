@@ -10,8 +10,11 @@ from ..utils.cspp import infer_airmass
 
 
 class FY4AAGRIL1GEODISK4KM(ProductionBase):
+    # file names of the product, the start and end times are the 10th and 11th "_" fields
+    file_name_pattern = "FY4A-_AGRI--_N_DISK_1047E_L1-_GEO-_MULT_NOM_[0-9._]{29}_4000M_V0001.HDF"
     def __init__(self, fname: str = None, **kwargs):
-        super(FY4AAGRIL1GEODISK4KM, self).__init__()
+        super(FY4AAGRIL1GEODISK4KM, self).__init__(dtype=kwargs.get('dtype', None),
+                                                   rows=kwargs.get('rows', None))
         try:
             self.fname = fname
             self.fdir = os.path.dirname(fname)
@@ -25,25 +28,31 @@ class FY4AAGRIL1GEODISK4KM(ProductionBase):
         except Exception as e:
             print(e)
 
-    @property
-    def file_name_pattern(self):
-        return "FY4A-_AGRI--_N_DISK_1047E_L1-_GEO-_MULT_NOM_[0-9._]{29}_4000M_V0001.HDF"
-
     def get_sun_zenith(self):
         try:
-            f = h5py.File(self.fname, 'r')
-            data = self._decorate_ds_data(f['NOMSunZenith'])
-            f.close()
+            with self._h5_file() as f:
+                data = self._decorate_ds_data(f['NOMSunZenith'])
             return data
         except Exception as e:
             print(e)
             traceback.print_exc()
 
+    def get_sun_zenith_center(self):
+        """Sun zenith of the disk center pixel, whatever the rows of the reader."""
+        try:
+            with self._h5_file() as f:
+                ds = f['NOMSunZenith']
+                h, w = ds.shape
+                data = self._decorate_ds_data(ds, index=np.s_[h // 2:h // 2 + 1, w // 2:w // 2 + 1])
+            return data[0, 0]
+        except Exception as e:
+            print(e)
+            traceback.print_exc()
+
     def get_sun_glint(self):
         try:
-            f = h5py.File(self.fname, 'r')
-            data = self._decorate_ds_data(f['NOMSunGlintAngle'])
-            f.close()
+            with self._h5_file() as f:
+                data = self._decorate_ds_data(f['NOMSunGlintAngle'])
             return data
         except Exception as e:
             print(e)
@@ -51,9 +60,8 @@ class FY4AAGRIL1GEODISK4KM(ProductionBase):
 
     def get_sun_azimuth(self):
         try:
-            f = h5py.File(self.fname, 'r')
-            data = self._decorate_ds_data(f['NOMSunAzimuth'])
-            f.close()
+            with self._h5_file() as f:
+                data = self._decorate_ds_data(f['NOMSunAzimuth'])
             return data
         except Exception as e:
             print(e)
@@ -61,9 +69,8 @@ class FY4AAGRIL1GEODISK4KM(ProductionBase):
 
     def get_satellite_zenith(self):
         try:
-            f = h5py.File(self.fname, 'r')
-            data = self._decorate_ds_data(f['NOMSatelliteZenith'])
-            f.close()
+            with self._h5_file() as f:
+                data = self._decorate_ds_data(f['NOMSatelliteZenith'])
             return data
         except Exception as e:
             print(e)
@@ -71,16 +78,16 @@ class FY4AAGRIL1GEODISK4KM(ProductionBase):
 
     def get_satellite_azimuth(self):
         try:
-            f = h5py.File(self.fname, 'r')
-            data = self._decorate_ds_data(f['NOMSatelliteAzimuth'])
-            f.close()
+            with self._h5_file() as f:
+                data = self._decorate_ds_data(f['NOMSatelliteAzimuth'])
             return data
         except Exception as e:
             print(e)
             traceback.print_exc()
 
     def infer_air_mass(self):
-        son_zen = self.get_satellite_zenith()
-        sol_zen = self.get_sun_zenith()
+        with self:
+            son_zen = self.get_satellite_zenith()
+            sol_zen = self.get_sun_zenith()
         air_mass = infer_airmass(son_zen, sol_zen)
         return air_mass
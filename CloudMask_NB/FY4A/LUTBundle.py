@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+import xarray as xr
+
+from . import NavieBayes
+
+bundle_file_name = 'NB_LUT_M%.2d.bundle'
+
+
+def get_lut_bundle_path(month: int) -> str:
+    data_root_dir = os.getenv('METEPY_DATA_PATH', 'assets')
+    return str(os.path.join(data_root_dir, 'LUT', bundle_file_name % month))
+
+
+def get_classifier_classes() -> list:
+    """All naive Bayes classifiers with a LUT, in definition order."""
+    classes = []
+    pending = list(NavieBayes.NBClassifier.__subclasses__())
+    while pending:
+        cls = pending.pop(0)
+        if getattr(cls, 'lut_file_name', None):
+            classes.append(cls)
+        pending.extend(cls.__subclasses__())
+    return classes
+
+
+def get_lut_stamp(lut_file_path: str) -> dict:
+    """Path, mtime and size of a NetCDF LUT, a bundle is up to date while they are unchanged."""
+    path = os.path.abspath(lut_file_path)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return {'path': path, 'mtime_ns': None, 'size': None}
+    return {'path': path, 'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+
+class LUTVariable(object):
+    """A LUT variable of a bundle, ``data`` is a read-only view into the bundle."""
+
+    def __init__(self, data: np.ndarray):
+        super(LUTVariable, self).__init__()
+        self.data = data
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.data, dtype)
+
+    def __repr__(self):
+        return '<LUTVariable %s %s>' % (self.data.dtype, self.data.shape)
+
+
+class LUTTable(object):
+    """LUT of one classifier, indexed like the xarray data set it was compiled from.
+
+    Examples:
+        >>> table['bin_start'].data
+        >>> table.bins.data
+    """
+
+    def __init__(self, name: str, variables: dict):
+        super(LUTTable, self).__init__()
+        self.name = name
+        self.variables = variables
+
+    def __getitem__(self, key: str) -> LUTVariable:
+        return self.variables[key]
+
+    def __getattr__(self, key: str) -> LUTVariable:
+        try:
+            return self.__dict__['variables'][key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __contains__(self, key: str):
+        return key in self.variables
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return '<LUTTable %s: %s>' % (self.name, ', '.join(self.variables))
+
+
+class LUTBundle(object):
+    """All classifier LUTs of a month in one memory mapped file.
+
+    The file holds a JSON header (classifier -> variable -> dtype, shape and
+    offset) followed by the contiguous arrays, each aligned to 64 bytes. It is
+    compiled once from the ``*_M%.2d_handfix.nc`` files with :meth:`compile`;
+    loading it maps the file and builds views, no NetCDF is parsed.
+
+    The header also records the mtime and size of each NetCDF LUT compiled
+    (or missing), a table whose NetCDF LUT changed since is stale and not used,
+    see :meth:`stale_names`.
+
+    Examples:
+        >>> LUTBundle.compile(1, lut_dir='data/LUT')
+        >>> bundle = LUTBundle(get_lut_bundle_path(1))
+        >>> t11 = T11(lut_bundle=bundle)
+    """
+    magic = b'NBLUTBDL'
+    version = 2
+    # version 1 bundles have no source stamps, they are always stale
+    supported_versions = (1, 2)
+    alignment = 64
+
+    def __init__(self, path: str):
+        super(LUTBundle, self).__init__()
+        self.path = path
+        self._buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(self._buffer[:8]) != self.magic:
+            raise ValueError('not a LUT bundle: %s' % path)
+        header_size = int(self._buffer[8:16].view('<u8')[0])
+        header = json.loads(bytes(self._buffer[16:16 + header_size]).decode('utf-8'))
+        if header['version'] not in self.supported_versions:
+            raise ValueError('unsupported LUT bundle version %s: %s' % (header['version'], path))
+        self.month = header['month']
+        self.sources = header.get('sources', None)  # classifier -> get_lut_stamp at compile time
+        self._data_start = self._aligned(16 + header_size)
+        self.tables = {}
+        for name, variables in header['tables'].items():
+            self.tables[name] = LUTTable(name, {
+                key: LUTVariable(self._view(**spec)) for key, spec in variables.items()
+            })
+
+    @classmethod
+    def _aligned(cls, nbytes: int) -> int:
+        return -(-nbytes // cls.alignment) * cls.alignment
+
+    def _view(self, dtype: str, shape: list, offset: int) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        nbytes = dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+        start = self._data_start + offset
+        return self._buffer[start:start + nbytes].view(dtype).reshape(shape)
+
+    @property
+    def names(self) -> list:
+        return list(self.tables)
+
+    def __getitem__(self, name: str) -> LUTTable:
+        return self.tables[name]
+
+    def __contains__(self, name: str):
+        return name in self.tables
+
+    def __len__(self):
+        return len(self.tables)
+
+    def is_current(self, name: str) -> bool:
+        """Whether the NetCDF LUT of classifier ``name`` is unchanged since the bundle was compiled."""
+        if self.sources is None or name not in self.sources:
+            return False
+        stamp = self.sources[name]
+        return get_lut_stamp(stamp['path']) == stamp
+
+    def stale_names(self) -> list:
+        """Classifiers whose NetCDF LUT was modified, added or removed since the bundle was compiled."""
+        if self.sources is None:
+            return self.names
+        return [name for name in self.sources if not self.is_current(name)]
+
+    @classmethod
+    def compile(cls, month: int, lut_dir: str = None, out_path: str = None, classes: list = None) -> str:
+        """Compile the NetCDF LUTs of ``month`` into a bundle.
+
+        Args:
+            month (int): month of the LUTs.
+            lut_dir (str): directory of the NetCDF LUTs, ``METEPY_DATA_PATH``/LUT by default.
+            out_path (str): bundle path, ``NB_LUT_M%.2d.bundle`` in ``lut_dir`` by default.
+            classes (list): classifier classes, all of them by default; a missing LUT is skipped.
+
+        Returns:
+            out_path (str): path of the written bundle.
+        """
+        if lut_dir is None:
+            lut_dir = os.path.dirname(get_lut_bundle_path(month))
+        if out_path is None:
+            out_path = os.path.join(lut_dir, bundle_file_name % month)
+        if classes is None:
+            classes = get_classifier_classes()
+        arrays = {}
+        sources = {}
+        for classifier_cls in classes:
+            lut_file_path = os.path.join(lut_dir, classifier_cls.lut_file_name % month)
+            # stamped before it is read, a LUT rewritten meanwhile makes the bundle stale
+            sources[classifier_cls.short_name] = get_lut_stamp(lut_file_path)
+            if not os.path.exists(lut_file_path):
+                print('LUT not found, skipped: %s' % lut_file_path)
+                continue
+            with xr.open_dataset(lut_file_path) as ds:
+                ds.load()
+                names = list(ds.data_vars) + [c for c in ds.coords if c not in ds.data_vars]
+                arrays[classifier_cls.short_name] = {
+                    key: np.ascontiguousarray(ds[key].data) for key in names
+                }
+        # offsets are relative to the data section, which starts at the first
+        # aligned byte after the header
+        tables = {}
+        offset = 0
+        for name, variables in arrays.items():
+            tables[name] = {}
+            for key, array in variables.items():
+                if array.dtype.hasobject:
+                    array = variables[key] = array.astype(str)
+                tables[name][key] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+                offset += cls._aligned(array.nbytes)
+        header = json.dumps({'version': cls.version, 'month': month, 'tables': tables,
+                             'sources': sources}).encode('utf-8')
+        data_start = cls._aligned(16 + len(header))
+        tmp_path = out_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(cls.magic)
+            f.write(np.uint64(len(header)).astype('<u8').tobytes())
+            f.write(header)
+            for name, variables in arrays.items():
+                for key, array in variables.items():
+                    f.seek(data_start + tables[name][key]['offset'])
+                    f.write(array.tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, out_path)
+        return out_path
+
+
+def load_lut_bundle(month: int, path: str = None) -> LUTBundle:
+    """The LUT bundle of a month, None if it was not compiled or any of its NetCDF LUTs changed since."""
+    if path is None:
+        path = get_lut_bundle_path(month)
+    if not os.path.exists(path):
+        return None
+    bundle = LUTBundle(path)
+    stale_names = bundle.stale_names()
+    if stale_names:
+        print('LUT bundle out of date, the NetCDF LUTs are used until it is compiled again: %s (%s)'
+              % (path, ', '.join(stale_names)))
+        return None
+    return bundle
+
+
+def main():
+    """Compile the naive Bayes LUTs of some months into bundles."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('months',
+                        type=int,
+                        nargs='+',
+                        help="months of the LUTs, 1 to 12.")
+    parser.add_argument('--lut_dir',
+                        type=str,
+                        default=None,
+                        help="directory of the NetCDF LUTs, METEPY_DATA_PATH/LUT by default.")
+    args = parser.parse_args()
+    for month in args.months:
+        print(LUTBundle.compile(month, lut_dir=args.lut_dir))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .LUTBundle import get_lut_bundle_path, load_lut_bundle, get_classifier_classes
+from ..utils.dtype import get_float_dtype
+
+
+class LUTRegistry(object):
+    """Process wide, thread safe store of the classifiers of recently used months.
+
+    A classifier is built once per (LUT directory, month, float type) and then
+    shared by every scene of that month, from the month's LUT bundle when there
+    is one and from its NetCDF file otherwise. Classifiers only read their LUT,
+    so the instances are safe to share between threads. At most ``max_months``
+    months are kept, the least recently used month is dropped first.
+
+    Examples:
+        >>> t11 = lut_registry.get(T11, month)
+        >>> lut_registry.preload(month % 12 + 1, wait=False)  # upcoming month
+    """
+
+    def __init__(self, max_months: int = 2):
+        super(LUTRegistry, self).__init__()
+        self.max_months = max_months
+        self.hits = 0
+        self.misses = 0
+        self._months = OrderedDict()  # (lut dir, month) -> month entry
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(month: int) -> tuple:
+        # METEPY_DATA_PATH is read at call time like get_lut_path does
+        return os.path.dirname(get_lut_bundle_path(month)), int(month)
+
+    def _month_entry(self, month: int) -> dict:
+        key = self.make_key(month)
+        with self._lock:
+            entry = self._months.get(key, None)
+            if entry is None:
+                entry = {'lock': threading.Lock(), 'loaded': False, 'bundle': None, 'classifiers': {}}
+                self._months[key] = entry
+                while len(self._months) > max(self.max_months, 1):
+                    self._months.popitem(last=False)
+            else:
+                self._months.move_to_end(key)
+        return entry
+
+    @staticmethod
+    def _load_bundle(entry: dict, month: int):
+        # called with the month lock held
+        if not entry['loaded']:
+            entry['bundle'] = load_lut_bundle(month)
+            entry['loaded'] = True
+        return entry['bundle']
+
+    def get(self, classifier_cls, month: int, dtype=None):
+        """Shared classifier instance of a month.
+
+        Args:
+            classifier_cls: NBClassifier subclass, e.g. T11.
+            month (int): month of the LUT.
+            dtype: float type of the classifier, the process wide policy by default.
+
+        Returns:
+            classifier (NBClassifier): instance built on first use.
+        """
+        dtype = np.dtype(dtype or get_float_dtype())
+        entry = self._month_entry(month)
+        # one lock per month: the LUTs of a month are read once even when
+        # several threads ask for them together
+        with entry['lock']:
+            self._load_bundle(entry, month)
+            classifier = entry['classifiers'].get((classifier_cls, dtype), None)
+            hit = classifier is not None
+            if not hit:
+                classifier = classifier_cls(lut_file_path=classifier_cls.get_lut_path(month),
+                                            lut_bundle=entry['bundle'], dtype=dtype)
+                entry['classifiers'][(classifier_cls, dtype)] = classifier
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return classifier
+
+    def preload(self, month: int, classes: list = None, dtype=None, wait: bool = True):
+        """Build the classifiers of a month ahead of its first scene.
+
+        Args:
+            month (int): month to load, typically the upcoming one.
+            classes (list): classifier classes, all those with a LUT for the month by default.
+            dtype: float type of the classifiers.
+            wait (bool): load in the calling thread, or in a background thread that is returned.
+        """
+        if not wait:
+            thread = threading.Thread(target=self.preload, args=(month, classes, dtype, True),
+                                      name='lut-preload-M%.2d' % month, daemon=True)
+            thread.start()
+            return thread
+        entry = self._month_entry(month)
+        with entry['lock']:
+            bundle = self._load_bundle(entry, month)
+        if classes is None:
+            classes = [cls for cls in get_classifier_classes()
+                       if (bundle is not None and cls.short_name in bundle)
+                       or os.path.exists(cls.get_lut_path(month))]
+        for classifier_cls in classes:
+            try:
+                self.get(classifier_cls, month, dtype)
+            except Exception as e:
+                print(e, classifier_cls.get_lut_path(month))
+        return None
+
+    def __contains__(self, month: int):
+        return self.make_key(month) in self._months
+
+    def __len__(self):
+        return len(self._months)
+
+    def clear(self):
+        with self._lock:
+            self._months.clear()
+
+
+lut_registry = LUTRegistry()
@@ -0,0 +1,228 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class MaskBit(object):
+    """A primitive mask of a scene, one bit of the MaskPlanes words, computed from scene fields."""
+
+    def __init__(self, name: str, bit: int, func, depends: tuple = ()):
+        super(MaskBit, self).__init__()
+        self.name = name
+        self.bit = bit
+        self.func = func
+        self.depends = tuple(depends)
+        self.__doc__ = func.__doc__
+
+    @property
+    def flag(self) -> int:
+        return 1 << self.bit
+
+
+# primitive masks by name, in bit order
+mask_bits = OrderedDict()
+word_dtype = np.uint32
+
+
+def mask_bit(*depends, name: str = None):
+    """Declare a primitive mask computed once per scene from the ``depends`` scene fields.
+
+    Examples:
+        >>> @mask_bit('dem', 'sft')
+        ... def mount(dem, sft):
+        ...     return np.logical_and(dem > 2000, sft != 6)
+    """
+
+    def decorate(func):
+        bit_name = name or func.__name__
+        if bit_name in mask_bits:
+            raise ValueError('mask bit %s already declared' % bit_name)
+        if len(mask_bits) >= np.iinfo(word_dtype).bits:
+            raise ValueError('no bit left for %s in a %s word' % (bit_name, np.dtype(word_dtype).name))
+        mask_bits[bit_name] = MaskBit(bit_name, len(mask_bits), func, depends)
+        return func
+
+    return decorate
+
+
+def get_flags(names: tuple) -> int:
+    """Bits of the primitive masks ``names`` OR'ed in one integer."""
+    flags = 0
+    for name in names:
+        try:
+            flags |= mask_bits[name].flag
+        except KeyError:
+            raise KeyError('unknown mask bit: %s' % name)
+    return flags
+
+
+def mask_depends(names: tuple) -> list:
+    """Scene fields the primitive masks ``names`` are computed from."""
+    fields = []
+    for name in names:
+        for field in mask_bits[name].depends:
+            if field not in fields:
+                fields.append(field)
+    return fields
+
+
+# geometry and NAV, every comparison is made on the data of masked fields
+
+@mask_bit('space_mask')
+def space(space_mask):
+    return space_mask
+
+
+@mask_bit('sft')
+def surface_type(sft):
+    """Pixels with a CSPP surface type."""
+    return sft > 0
+
+
+@mask_bit('dem', 'sft')
+def mount(dem, sft):
+    """Mountains, above 2000m and not antarctic."""
+    return np.logical_and(dem > 2000, sft != 6)
+
+
+@mask_bit('coastal_mask')
+def coastal(coastal_mask):
+    return coastal_mask
+
+
+@mask_bit('snow_mask')
+def snow(snow_mask):
+    return snow_mask
+
+
+@mask_bit('sun_zen')
+def day(sun_zen):
+    return np.ma.getdata(sun_zen <= 85.0)
+
+
+@mask_bit('sun_zen')
+def night(sun_zen):
+    # not ~day, a missing sun zenith is neither day nor night
+    return np.ma.getdata(sun_zen > 85.0)
+
+
+@mask_bit('sun_zen')
+def sun_zen_80(sun_zen):
+    """Sun zenith above 80, too low a sun for the 1.38um and 1.61um tests."""
+    return np.ma.getdata(sun_zen > 80.0)
+
+
+@mask_bit('sun_zen')
+def sun_zen_90(sun_zen):
+    """Sun zenith above 90, no solar contamination at 3.75um."""
+    return np.ma.getdata(sun_zen > 90)
+
+
+@mask_bit('scat_ang', 'sun_zen')
+def forward(scat_ang, sun_zen):
+    """Forward scattering, scattering angle below 80 in daylight."""
+    return np.ma.getdata(np.logical_and(np.ma.getdata(scat_ang) < 80, sun_zen < 95.0))
+
+
+@mask_bit('air_mass')
+def air_mass(air_mass):
+    return np.ma.getdata(air_mass > 5)
+
+
+@mask_bit('glint_mask')
+def glint(glint_mask):
+    return glint_mask
+
+
+# observations, a band is observed where it is not masked
+
+def _observed(band: str):
+    def observed(obs):
+        return ~np.ma.getmaskarray(obs)
+
+    observed.__doc__ = 'Pixels where %s is not masked.' % band
+    return observed
+
+
+for _band in ('bt_1080', 'bt_850', 'ems_372', 'ref_065_pct', 'ref_083_pct', 'ref_137_pct', 'ref_161_pct',
+              'ref_065_clear_pct'):
+    mask_bit(_band, name='%s_obs' % _band)(_observed(_band))
+
+
+@mask_bit('bt_1080')
+def bt_1080_cold(bt_1080):
+    return np.ma.getdata(bt_1080) < 220
+
+
+@mask_bit('bt_1080')
+def bt_1080_positive(bt_1080):
+    return np.ma.getdata(bt_1080 >= 0)
+
+
+@mask_bit('ref_137_pct')
+def ref_137_positive(ref_137):
+    return np.ma.getdata(ref_137 > 0)
+
+
+@mask_bit('bt_372_low')
+def bt_372_warm(bt_372_low):
+    return np.ma.getdata(bt_372_low >= 240)
+
+
+class MaskPlanes(object):
+    """Primitive masks of a scene packed as bit planes, one bit per mask in a word per pixel.
+
+    A mask is computed the first time a test needs it and OR'ed into the
+    words, once per scene whatever the number of classifiers using it. A
+    classifier's validity is then a single vectorized test of the words
+    against the bits it requires and the bits it forbids, see :meth:`test`.
+
+    Examples:
+        >>> planes = MaskPlanes(scene)
+        >>> valid_mask = planes.test(('bt_1080_obs', 'surface_type'), ('mount', 'coastal', 'space'))
+    """
+
+    def __init__(self, scene):
+        super(MaskPlanes, self).__init__()
+        self.scene = scene
+        self.words = None
+        self.flags = 0  # bits computed so far
+        self._lock = threading.Lock()
+
+    def ensure(self, names: tuple):
+        """Compute the primitive masks ``names`` not in the words yet."""
+        if get_flags(names) & ~self.flags == 0:
+            return self
+        with self._lock:
+            scratch = None
+            for name in names:
+                bit = mask_bits[name]
+                if self.flags & bit.flag:
+                    continue
+                mask = bit.func(*[self.scene.get(field) for field in bit.depends])
+                if self.words is None:
+                    self.words = np.zeros(np.shape(mask), word_dtype)
+                if scratch is None:
+                    scratch = np.empty(self.words.shape, word_dtype)
+                # one plane: bool -> 0/1 word, shifted to its bit and OR'ed in
+                np.copyto(scratch, mask)
+                np.left_shift(scratch, bit.bit, out=scratch)
+                np.bitwise_or(self.words, scratch, out=self.words)
+                self.flags |= bit.flag
+        return self
+
+    def test(self, required: tuple = (), forbidden: tuple = ()) -> np.ndarray:
+        """Pixels with all the ``required`` masks set and none of the ``forbidden`` ones."""
+        self.ensure(tuple(required) + tuple(forbidden))
+        required_flags = get_flags(required)
+        return np.bitwise_and(self.words, required_flags | get_flags(forbidden)) == required_flags
+
+    def get(self, name: str) -> np.ndarray:
+        """One primitive mask unpacked from the words."""
+        return self.test((name,))
+
+    def clear(self):
+        with self._lock:
+            self.words = None
+            self.flags = 0
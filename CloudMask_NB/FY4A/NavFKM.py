@@ -1,4 +1,8 @@
 import os
+import glob
+import json
+import threading
+from collections import OrderedDict
 
 import h5py
 import numpy as np
@@ -13,9 +17,23 @@ def get_nav_path(month: str):
 
 
 class FY4NavFile(object):
-    def __init__(self, fy4_nav_file_path: str):
+    """FY4A AGRI 4km navigation file.
+
+    Every field is read once and kept, derived products (cspp surface type,
+    coastal mask, boolean space mask) are computed once. The returned arrays
+    are shared by all callers and must not be modified in place. With
+    ``sidecar_dir`` the derived products are also saved there as ``.npy``
+    files and memory mapped by later instances, until the NAV file changes.
+    """
+
+    def __init__(self, fy4_nav_file_path: str, sidecar_dir: str = None):
         super(FY4NavFile, self).__init__()
         self.fy4_nav_file_path = fy4_nav_file_path
+        self.sidecar_dir = sidecar_dir
+        self._fields = {}
+        self._derived = {}
+        self._sidecar_valid = None
+        self._lock = threading.RLock()
         self.ET_Land_class = {
             'SHALLOW_OCEAN': 0,
             'LAND': 1,
@@ -47,14 +65,145 @@ class FY4NavFile(object):
             'Desert': 7,
         }
 
+    def _get_fields(self, names: list) -> list:
+        """Fields of the NAV file, those not read yet are read with one open."""
+        with self._lock:
+            missing = [name for name in names if name not in self._fields]
+            if missing:
+                with h5py.File(self.fy4_nav_file_path, 'r') as nav_f:
+                    for name in missing:
+                        self._fields[name] = nav_f[name][...]
+            return [self._fields[name] for name in names]
+
+    def _get_field(self, name: str) -> np.ndarray:
+        return self._get_fields([name])[0]
+
+    def _get_derived(self, name: str, func) -> np.ndarray:
+        with self._lock:
+            if name not in self._derived:
+                array = self._load_sidecar(name)
+                if array is None:
+                    array = func()
+                    self._save_sidecar(name, array)
+                self._derived[name] = array
+            return self._derived[name]
+
+    def _sidecar_path(self, name: str) -> str:
+        return os.path.join(self.sidecar_dir, '%s.%s' % (os.path.basename(self.fy4_nav_file_path), name))
+
+    def _nav_stamp(self) -> dict:
+        stat = os.stat(self.fy4_nav_file_path)
+        return {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+    def _load_sidecar(self, name: str):
+        if self.sidecar_dir is None:
+            return None
+        try:
+            if self._sidecar_valid is None:
+                # sidecar files are only trusted for the NAV file they were made from
+                with open(self._sidecar_path('json'), 'r') as f:
+                    self._sidecar_valid = json.load(f) == self._nav_stamp()
+            if not self._sidecar_valid:
+                return None
+            # copy on write, callers that write to the array do not touch the file
+            return np.load(self._sidecar_path(name + '.npy'), mmap_mode='c')
+        except (OSError, ValueError):
+            return None
+
+    def _save_sidecar(self, name: str, array: np.ndarray):
+        if self.sidecar_dir is None:
+            return
+        try:
+            os.makedirs(self.sidecar_dir, exist_ok=True)
+            if not self._sidecar_valid:
+                # a new or changed NAV file, files made from the old one are dropped
+                for path in glob.glob(glob.escape(self._sidecar_path('')) + '*.npy'):
+                    os.remove(path)
+                with open(self._sidecar_path('json'), 'w') as f:
+                    json.dump(self._nav_stamp(), f)
+                self._sidecar_valid = True
+            tmp_path = self._sidecar_path(name + '.tmp.npy')
+            np.save(tmp_path, array)
+            os.replace(tmp_path, self._sidecar_path(name + '.npy'))
+        except OSError as e:
+            print(e, self.sidecar_dir)
+
     def prepare_surface_type_to_cspp(self, space_mask=False) -> np.ndarray:
-        nav_f = h5py.File(self.fy4_nav_file_path, 'r')
-        lat = nav_f['pixel_latitude'][...]
-        lon = nav_f['pixel_longitude'][...]
-        land_mask = nav_f['pixel_land_mask'][...]
-        snow_mask = nav_f['pixel_snow_mask'][...]
-        desert_mask = nav_f['pixel_desert_mask'][
-            ...]  # two way :1. CSPP(emiss) 2. fy4
+        nb_sft = self._get_derived('sft', self._surface_type_to_cspp)
+        if space_mask:
+            # own copy of the mask, filling the masked array must not unmask the shared one
+            mask = self.get_space_mask(b=True).copy()
+            nb_sft = np.ma.masked_array(nb_sft, mask)
+        return nb_sft
+
+    def _surface_type_to_cspp(self) -> np.ndarray:
+        lat, land_mask, snow_mask, desert_mask = self._get_fields([
+            'pixel_latitude', 'pixel_land_mask', 'pixel_snow_mask',
+            'pixel_desert_mask'])  # two way :1. CSPP(emiss) 2. fy4
+        return self.classify_surface_type(lat, land_mask, snow_mask, desert_mask)
+
+    def _code_maps(self) -> tuple:
+        """Per field maps from a uint8 code to its share of the composite index.
+
+        land (9 classes: the 8 land codes and any other value), snow (other,
+        sea ice, snow) and desert (no, nir or bright desert) are folded with
+        the latitude band (NaN, <= -60, (-60, 0), >= 0) into one index
+        ``((land * 3 + snow) * 2 + desert) * 4 + band`` below 216.
+        """
+        land_map = np.full(256, 8 * 24, np.uint8)
+        land_map[:8] = np.arange(8) * 24
+        snow_map = np.zeros(256, np.uint8)
+        snow_map[self.ET_Snow_class['SEA_ICE']] = 1 * 8
+        snow_map[self.ET_Snow_class['SNOW']] = 2 * 8
+        desert_map = np.zeros(256, np.uint8)
+        desert_map[self.ET_Desert_class['NIR_DESERT']] = 1 * 4
+        desert_map[self.ET_Desert_class['BRIGHT_DESERT']] = 1 * 4
+        return land_map, snow_map, desert_map
+
+    def _cspp_sft_table(self) -> np.ndarray:
+        """Surface type of every composite index, made by the mask rules themselves."""
+        table = getattr(self, '_sft_table', None)
+        if table is None:
+            land = np.repeat(np.array([0, 1, 2, 3, 4, 5, 6, 7, -1], np.int8), 24)
+            snow = np.tile(np.repeat(np.array([1, 2, 3], np.int8), 8), 9)
+            desert = np.tile(np.repeat(np.array([0, 1], np.int8), 4), 27)
+            lat = np.tile(np.array([np.nan, -70.0, -30.0, 30.0], np.float32), 54)
+            table = self.classify_surface_type_by_masks(lat, land, snow, desert)
+            self._sft_table = table
+        return table
+
+    @staticmethod
+    def _to_code(array: np.ndarray) -> np.ndarray:
+        # uint8 view of one byte codes (-1 becomes 255, an "other" code),
+        # wider codes out of 0..255 are folded onto 255 as well
+        array = np.asarray(array)
+        if array.dtype.itemsize == 1:
+            return array.view(np.uint8)
+        return np.where((array >= 0) & (array < 255), array, 255).astype(np.uint8)
+
+    def classify_surface_type(self, lat: np.ndarray, land_mask: np.ndarray,
+                              snow_mask: np.ndarray, desert_mask: np.ndarray) -> np.ndarray:
+        """CSPP surface type (uint8, 0 to 7) with one composite lookup per pixel.
+
+        Same result as :meth:`classify_surface_type_by_masks`, the rules are
+        evaluated once per composite code instead of once per pixel.
+        """
+        land_map, snow_map, desert_map = self._code_maps()
+        code = land_map[self._to_code(land_mask)]
+        code += snow_map[self._to_code(snow_mask)]
+        code += desert_map[self._to_code(desert_mask)]
+        # latitude band: 0 for NaN, 1 for lat <= -60, 2 for -60 < lat < 0, 3 for lat >= 0
+        lat = np.asarray(lat)
+        code += (lat <= -60).view(np.uint8)
+        north = (lat > -60).view(np.uint8)
+        code += north
+        code += north
+        code += (lat >= 0).view(np.uint8)
+        return self._cspp_sft_table()[code]
+
+    def classify_surface_type_by_masks(self, lat: np.ndarray, land_mask: np.ndarray,
+                                       snow_mask: np.ndarray, desert_mask: np.ndarray) -> np.ndarray:
+        """CSPP surface type by one boolean mask per rule, the reference of the lookup."""
         nb_sft = np.zeros(land_mask.shape, np.uint8)
 
         # DeepOcean
@@ -97,39 +246,62 @@ class FY4NavFile(object):
             desert_mask == self.ET_Desert_class['NIR_DESERT'],
             desert_mask == self.ET_Desert_class['BRIGHT_DESERT'])
         nb_sft[desert_idx] = self.ET_SFT_class['Desert']
-        if space_mask:
-            mask = self.get_space_mask(b=True)
-            nb_sft = np.ma.masked_array(nb_sft, mask)
         return nb_sft
 
     def get_dem(self) -> np.ndarray:
-        nav_f = h5py.File(self.fy4_nav_file_path, 'r')
-        dem = nav_f['pixel_surface_elevation'][...]
-        return dem
+        return self._get_field('pixel_surface_elevation')
 
     def get_coastal(self) -> np.ndarray:
-        nav_f = h5py.File(self.fy4_nav_file_path, 'r')
-        coast = nav_f['pixel_coast_mask'][...]
-        return coast
+        return self._get_field('pixel_coast_mask')
+
+    def get_coastal_mask(self) -> np.ndarray:
+        return self._get_derived('coastal_mask', lambda: self.get_coastal() > 0)
 
     def get_space_mask(self, b=False) -> np.ndarray:
-        nav_f = h5py.File(self.fy4_nav_file_path, 'r')
-        space_mask = nav_f['pixel_space_mask'][...]
         if b:
-            space_mask = space_mask.astype(np.bool)
-        return space_mask
+            return self._get_derived(
+                'space_mask', lambda: self._get_field('pixel_space_mask').astype(np.bool_))
+        return self._get_field('pixel_space_mask')
+
+    def get_earth_index(self) -> np.ndarray:
+        """Flat int32 index of the pixels of the disk that are not space."""
+        return self._get_derived(
+            'earth_index', lambda: np.flatnonzero(~self.get_space_mask(b=True)).astype(np.int32))
 
     def get_latitude(self) -> np.ndarray:
-        nav_f = h5py.File(self.fy4_nav_file_path, 'r')
-        latitude = nav_f['pixel_latitude'][...]
-        return latitude
+        return self._get_field('pixel_latitude')
 
     def get_longitude(self) -> np.ndarray:
-        nav_f = h5py.File(self.fy4_nav_file_path, 'r')
-        longitude = nav_f['pixel_longitude'][...]
-        return longitude
+        return self._get_field('pixel_longitude')
 
     def get_snow_mask(self):
-        nav_f = h5py.File(self.fy4_nav_file_path, 'r')
-        snow = nav_f['pixel_snow_mask'][...]
-        return snow
+        return self._get_field('pixel_snow_mask')
+
+    def clear(self):
+        """Drop the fields and derived products kept in memory."""
+        with self._lock:
+            self._fields.clear()
+            self._derived.clear()
+
+
+_nav_files = OrderedDict()
+_nav_files_lock = threading.Lock()
+
+
+def get_nav_file(month: int, sidecar_dir: str = None, max_months: int = 2) -> FY4NavFile:
+    """Process wide FY4NavFile of a month, shared by all its scenes.
+
+    The NAV files of the ``max_months`` most recently used months are kept, a
+    NAV file changed on disk is read again.
+    """
+    nav_file_path = get_nav_path(month)
+    stamp = os.stat(nav_file_path).st_mtime if os.path.exists(nav_file_path) else None
+    with _nav_files_lock:
+        nav, nav_stamp = _nav_files.get(nav_file_path, (None, None))
+        if nav is None or nav_stamp != stamp or nav.sidecar_dir != sidecar_dir:
+            nav = FY4NavFile(nav_file_path, sidecar_dir=sidecar_dir)
+            _nav_files[nav_file_path] = (nav, stamp)
+        _nav_files.move_to_end(nav_file_path)
+        while len(_nav_files) > max(max_months, 1):
+            _nav_files.popitem(last=False)
+    return nav
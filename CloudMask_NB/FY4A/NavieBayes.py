@@ -6,6 +6,10 @@ import xarray as xr
 import tifffile as tiff
 
 from ..utils.conv import cal_nxn_indices
+from ..utils.cache import NeighborhoodCache
+from ..utils.dtype import get_float_dtype
+from ..utils import kernels
+from .MaskPlanes import mask_depends
 
 lut_root_dir = os.path.join(os.getenv('METEPY_DATA_PATH', 'data'), 'LUT')
 
@@ -13,22 +17,215 @@ class NBClassifier(object):
     lut_ds: xr.Dataset
     short_name: str
     lut_file_name: str
+    ratio_name: str = 'class_cond_ratio_reg'
+    dtype: np.dtype
+    # Scene fields passed in order to prepare_feature and prepare_valid_mask;
+    # 'cache' is the scene's NeighborhoodCache and 'feature' the prepared feature
+    feature_inputs: tuple = ()
+    valid_mask_inputs: tuple = ()
+    # the valid mask as primitive masks of the scene (see MaskPlanes): all the
+    # required bits set and none of the forbidden ones, same as prepare_valid_mask
+    required_bits: tuple = ()
+    forbidden_bits: tuple = ()
+    # rows of context a pixel needs, the half size of the largest window used (see nxn)
+    halo: int = 0
 
     def __init__(self, **kwargs):
         super(NBClassifier, self).__init__()
-        lut_file_path = kwargs.get('lut_file_path', os.path.join(lut_root_dir, self.lut_file_name))
-        self._load_lut(lut_file_path)
+        # float type of the ratio and probability arrays returned by infer
+        self.dtype = np.dtype(kwargs.get('dtype', None) or get_float_dtype())
+        # a compiled LUT bundle (see LUTBundle) shared by the classifiers of a month,
+        # its table is not used once the NetCDF LUT it was compiled from changed
+        lut_bundle = kwargs.get('lut_bundle', None)
+        if lut_bundle is not None and self.short_name in lut_bundle and lut_bundle.is_current(self.short_name):
+            self.lut_ds = lut_bundle[self.short_name]
+        else:
+            lut_file_path = kwargs.get('lut_file_path', os.path.join(lut_root_dir, self.lut_file_name))
+            self._load_lut(lut_file_path)
 
     def _load_lut(self, lut_file_path: str = None):
         if lut_file_path:
             self.lut_ds = xr.open_dataset(lut_file_path)
 
+    @property
+    def log_ratio(self) -> np.ndarray:
+        """Natural log of the class conditional ratio table, computed once per LUT."""
+        cached = getattr(self, '_log_ratio', None)
+        if cached is None or cached[0] is not self.lut_ds:
+            with np.errstate(divide='ignore'):
+                log_ratio = np.log(self.lut_ds[self.ratio_name].data.astype(np.float64))
+            cached = self._log_ratio = (self.lut_ds, log_ratio)
+        return cached[1]
+
+    @property
+    def nbins(self) -> int:
+        return self.lut_ds[self.ratio_name].shape[-1]
+
+    @property
+    def flat_ratio(self) -> np.ndarray:
+        """Class conditional ratio table flattened, in the float type of the classifier."""
+        cached = getattr(self, '_flat_ratio', None)
+        if cached is None or cached[0] is not self.lut_ds or cached[1].dtype != self.dtype:
+            flat_ratio = np.ascontiguousarray(self.lut_ds[self.ratio_name].data, self.dtype).reshape(-1)
+            cached = self._flat_ratio = (self.lut_ds, flat_ratio)
+        return cached[1]
+
+    def _lut_bins(self, x: np.ma.masked_array, sft: np.ndarray, index: np.ndarray) -> tuple:
+        # (sft, bin) of the pixels at flat ``index``, both start from 1
+        # fancy indexing of the flattened arrays, faster than np.take and boolean masks
+        sft_idx = np.ma.getdata(sft).reshape(-1)[index].astype(np.intp)
+        sft_idx -= 1  # sft start from 1, from here on the table row
+        bin_start = self.lut_ds['bin_start'].data[sft_idx]
+        delta_bin = self.lut_ds['delta_bin'].data[sft_idx]
+        x_v = np.ma.getdata(x).reshape(-1)[index]
+        bin_idx = x_v - bin_start
+        bin_idx /= delta_bin
+        x_mask = np.ma.getmask(x)
+        if x_mask is not np.ma.nomask:
+            # masked arithmetic keeps the feature value of a masked pixel, so does its bin
+            masked_v = x_mask.reshape(-1)[index]
+            if masked_v.any():
+                bin_idx[masked_v] = x_v[masked_v]
+        bin_idx_i = bin_idx.astype(np.int_)
+        np.clip(bin_idx_i, 1, self.nbins, out=bin_idx_i)
+        return sft_idx, bin_idx_i
+
+    def lut_index(self, x: np.ma.masked_array, sft: np.ndarray, valid_mask: np.ndarray) -> tuple:
+        """Index of the valid pixels into the ratio table, (sft, bin) both start from 0."""
+        sft_idx, bin_idx_i = self._lut_bins(x, sft, np.flatnonzero(np.ma.getdata(valid_mask)))
+        bin_idx_i -= 1  # bin_idx start from 1
+        return sft_idx, bin_idx_i
+
+    def infer_log_ratio(self, x: np.ma.masked_array, sft: np.ndarray, valid_mask: np.ndarray) -> np.ndarray:
+        """Log class conditional ratio of the valid pixels, a 1-D array."""
+        return self.log_ratio[self.lut_index(x, sft, valid_mask)]
+
+    def infer(self,
+              x: np.ma.masked_array,
+              sft: np.ndarray,
+              valid_mask: np.ndarray,
+              space_mask: np.ndarray = None,
+              prob=False,
+              out: np.ndarray = None,
+              product: np.ndarray = None):
+        """Class conditional ratio (and cloud probability) of the pixels.
+
+        The valid pixels are located once and gathered by their flat index,
+        their (sft, bin) index is fused into a flat index of the ratio table
+        and looked up in a single gather, then scattered into ``out``. With the
+        numba backend (see utils.kernels) binning, lookup, probability and
+        product are one compiled parallel loop over the pixels instead, with
+        the same result to the bit.
+
+        Args:
+            x (numpy.ma.masked_array): the feature, see prepare_feature.
+            sft (numpy.ndarray): CSPP surface type, from 1.
+            valid_mask (numpy.ndarray): pixels classified, see prepare_valid_mask.
+            space_mask (numpy.ndarray): masked pixels of the result, the mask of x by default.
+            prob (bool): also return the cloud probability.
+            out (numpy.ndarray): C contiguous buffer of the ratio, shape of x and
+                float type of the classifier; a new array by default.
+            product (numpy.ndarray): C contiguous running product of a fusion
+                (see NBFusion), the ratio is multiplied into it in place.
+
+        Returns:
+            r (numpy.ma.masked_array): the ratio, 1 where not valid.
+            p (numpy.ma.masked_array): the probability, 0 where not valid, if prob.
+        """
+        valid_mask = np.ma.getdata(valid_mask)
+        if out is None:
+            out = np.empty(valid_mask.shape, self.dtype)
+        elif not out.flags.c_contiguous:
+            raise ValueError('out must be a C contiguous array')
+        if product is not None and not product.flags.c_contiguous:
+            raise ValueError('product must be a C contiguous array')
+        p = np.zeros(valid_mask.shape, self.dtype) if prob else None
+        if kernels.get_backend() == 'numba':
+            kernels.infer_ratio(x, sft, valid_mask, np.ascontiguousarray(self.lut_ds['bin_start'].data),
+                                np.ascontiguousarray(self.lut_ds['delta_bin'].data), self.flat_ratio, out,
+                                np.ascontiguousarray(self.lut_ds['prior_yes'].data) if prob else None, p, product)
+        else:
+            self._infer_numpy(x, sft, valid_mask, out, p, product)
+        if space_mask is None:
+            space_mask = np.ma.getmask(x)
+        # valid pixels are never masked
+        mask = np.logical_and(space_mask, ~valid_mask)
+        r = np.ma.masked_array(out, mask)
+        if prob:
+            return r, np.ma.masked_array(p, mask.copy())
+        else:
+            return r
+
+    def _infer_numpy(self, x: np.ma.masked_array, sft: np.ndarray, valid_mask: np.ndarray, out: np.ndarray,
+                     p: np.ndarray = None, product: np.ndarray = None):
+        # the valid pixels are located once, then gathered and scattered by index
+        index = np.flatnonzero(valid_mask)
+        sft_idx, bin_idx_i = self._lut_bins(x, sft, index)
+        flat_idx = sft_idx * self.nbins
+        flat_idx += bin_idx_i
+        flat_idx -= 1  # bin_idx start from 1
+        r_v = self.flat_ratio[flat_idx]
+        out.fill(1)
+        out.reshape(-1)[index] = r_v
+        if p is not None:
+            prior_yes = self.lut_ds['prior_yes'].data[sft_idx]  # sft start from 1
+            p.reshape(-1)[index] = 1.0 / (1.0 + r_v / prior_yes - r_v)
+        if product is not None:
+            np.multiply(product, out, out=product)
+
+    @classmethod
+    def required_inputs(cls) -> list:
+        """Scene fields read by prepare_feature and prepare_valid_mask, see ``feature_inputs``."""
+        names = []
+        if cls.required_bits:
+            valid_mask_inputs = tuple(mask_depends(cls.required_bits + cls.forbidden_bits))
+        else:
+            valid_mask_inputs = cls.valid_mask_inputs
+        for name in cls.feature_inputs + valid_mask_inputs:
+            if name not in ('cache', 'feature') and name not in names:
+                names.append(name)
+        return names
+
+    def prepare(self, scene) -> tuple:
+        """Feature and valid mask of a scene (see Scene), wired from the declared inputs.
+
+        With ``required_bits`` the valid mask is one test of the scene's mask
+        planes, the primitive masks are shared by the classifiers of the scene.
+        """
+        x = self.prepare_feature(*[scene.cache if name == 'cache' else scene.get(name)
+                                   for name in self.feature_inputs])
+        if self.required_bits:
+            return x, scene.masks.test(self.required_bits, self.forbidden_bits)
+        valid_mask = self.prepare_valid_mask(*[scene.cache if name == 'cache' else x if name == 'feature'
+                                               else scene.get(name) for name in self.valid_mask_inputs])
+        return x, valid_mask
+
     def prepare_feature(self, **kwargs):
         raise NotImplementedError
 
     def prepare_valid_mask(self, **kwargs):
         raise NotImplementedError
 
+    @staticmethod
+    def nxn(band: str, array: np.ma.masked_array, n: int = 1, func=np.max,
+            cache: NeighborhoodCache = None) -> np.ma.masked_array:
+        """(2n+1)x(2n+1) window statistic of a band, shared through the scene cache if given."""
+        if cache is None:
+            return cal_nxn_indices(array, n, func)
+        return cache.get(band, array, n, func)
+
+    @staticmethod
+    def glint_mask(sun_glint: np.ndarray, bt_1080: np.ma.masked_array, bt_1080_std_3x3: np.ma.masked_array,
+                   ref_063: np.ma.masked_array, ref_063_std_3x3: np.ma.masked_array) -> np.ndarray:
+        """Sun glint: glint angle below 40 over a warm, uniform and bright scene, ref_063 in percent."""
+        glint = np.zeros(sun_glint.shape, np.uint8)
+        glint[sun_glint < 40] = 1
+        glint[bt_1080 < 273.15] = 0
+        glint[bt_1080_std_3x3 > 1.0] = 0
+        glint[ref_063_std_3x3 > 2.0] = 0
+        glint[ref_063 < 5.0] = 0
+        return glint.astype(np.bool_)
+
     def plot(self, sft_name='all'):
         fig, ax = plt.subplots(1, 1, figsize=(10, 10))
         color_list = np.asarray([
@@ -65,9 +262,6 @@ class NBClassifier(object):
 
         return fig
 
-    def infer(self, **kwargs):
-        raise NotImplementedError
-    
     @classmethod    
     def get_lut_path(cls, month: str):
         data_root_dir = os.getenv('METEPY_DATA_PATH', 'assets')
@@ -80,12 +274,17 @@ class Ref063Min3x3Day(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'Ref063Min3x3Day'
     lut_file_name: str = 'Ref_063_Min_3x3_Day_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('ref_065_pct', 'cache')
+    valid_mask_inputs: tuple = ('ref_065_pct', 'dem', 'sft', 'sun_zen', 'coastal_mask', 'space_mask')
+    required_bits: tuple = ('ref_065_pct_obs', 'day', 'surface_type')
+    forbidden_bits: tuple = ('mount', 'coastal', 'space')
+    halo: int = 1
 
     def __init__(self, **kwargs):
         super(Ref063Min3x3Day, self).__init__(**kwargs)
 
-    def prepare_feature(self, ref_063: np.ma.masked_array):
-        ref_063_min = cal_nxn_indices(ref_063, func=np.min)  # 2748 x 2748
+    def prepare_feature(self, ref_063: np.ma.masked_array, cache: NeighborhoodCache = None):
+        ref_063_min = self.nxn('ref_063', ref_063, func=np.min, cache=cache)  # 2748 x 2748
         feature = ref_063 - ref_063_min
         return feature
 
@@ -113,42 +312,22 @@ class Ref063Min3x3Day(NBClassifier):
         valid_mask = np.logical_and(valid_mask, sft > 0)
         return valid_mask
 
-    def infer(self,
-              x: np.ma.masked_array,
-              sft: np.ndarray,
-              valid_mask: np.ndarray,
-              space_mask: np.ndarray = None,
-              prob=False):
-        bin_start = self.lut_ds['bin_start'].data[sft[valid_mask] - 1]  # sft start from 1
-        delta_bin = self.lut_ds['delta_bin'].data[sft[valid_mask] - 1]  # sft start from 1
-        bin_idx = (x[valid_mask] - bin_start) / delta_bin
-        bin_idx_i = bin_idx.astype(np.int)
-        bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
-        r_da = self.lut_ds['class_cond_ratio_reg']
-        r_v = r_da.data[sft[valid_mask] - 1, bin_idx_i - 1]  # sft, bin_idx start from 1
-        if space_mask is None:
-            space_mask = x.mask
-        r = np.ma.masked_array(np.ones(x.shape), space_mask)
-        r[valid_mask] = r_v
-        if prob:
-            prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-            p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
-            return r, p
-        else:
-            return r
-
 
 class TStd(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'TStd'
     lut_file_name: str = 'T_Std_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('bt_1080', 'cache')
+    valid_mask_inputs: tuple = ('bt_1080', 'dem', 'sft', 'coastal_mask', 'space_mask')
+    required_bits: tuple = ('bt_1080_obs', 'bt_1080_positive', 'surface_type')
+    forbidden_bits: tuple = ('mount', 'coastal', 'space')
+    halo: int = 1
 
     def __init__(self, **kwargs):
         super(TStd, self).__init__(**kwargs)
 
-    def prepare_feature(self, bt_1080: np.ma.masked_array):
-        bt_1080_std = cal_nxn_indices(bt_1080, func=np.std)  # 2748 x 2748
+    def prepare_feature(self, bt_1080: np.ma.masked_array, cache: NeighborhoodCache = None):
+        bt_1080_std = self.nxn('bt_1080', bt_1080, func=np.std, cache=cache)  # 2748 x 2748
         feature = bt_1080_std
         return feature
 
@@ -179,36 +358,15 @@ class TStd(NBClassifier):
         valid_mask = np.logical_and(valid_mask, sft > 0)
         return valid_mask
 
-    def infer(self,
-              x: np.ma.masked_array,
-              sft: np.ndarray,
-              valid_mask: np.ndarray,
-              space_mask: np.ndarray = None,
-              prob=False):
-        bin_start = self.lut_ds['bin_start'].data[sft[valid_mask] - 1]  # sft start from 1
-        delta_bin = self.lut_ds['delta_bin'].data[sft[valid_mask] - 1]  # sft start from 1
-        bin_idx = (x[valid_mask] - bin_start) / delta_bin
-        bin_idx_i = bin_idx.astype(np.int)
-        bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
-        r_da = self.lut_ds['class_cond_ratio_reg']
-        r_v = r_da.data[sft[valid_mask] - 1, bin_idx_i - 1]  # sft, bin_idx start from 1
-        if space_mask is None:
-            space_mask = x.mask
-        r = np.ma.masked_array(np.ones(x.shape), space_mask)
-        r[valid_mask] = r_v
-        if prob:
-            prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-            p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
-            return r, p
-        else:
-            return r
-
 
 class Bt1185(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'Btd_11_85'
     lut_file_name: str = 'Btd_11_85_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('bt_1080', 'bt_850')
+    valid_mask_inputs: tuple = ('bt_1080', 'bt_850', 'sft', 'space_mask')
+    required_bits: tuple = ('bt_1080_obs', 'bt_850_obs', 'surface_type')
+    forbidden_bits: tuple = ('bt_1080_cold', 'space')
 
     def __init__(self, **kwargs):
         super(Bt1185, self).__init__(**kwargs)
@@ -239,36 +397,17 @@ class Bt1185(NBClassifier):
         valid_mask = np.logical_and(valid_mask, sft > 0)
         return valid_mask
 
-    def infer(self,
-              x: np.ma.masked_array,
-              sft: np.ndarray,
-              valid_mask: np.ndarray,
-              space_mask: np.ndarray = None,
-              prob=False):
-        bin_start = self.lut_ds['bin_start'].data[sft[valid_mask] - 1]  # sft start from 1
-        delta_bin = self.lut_ds['delta_bin'].data[sft[valid_mask] - 1]  # sft start from 1
-        bin_idx = (x[valid_mask] - bin_start) / delta_bin
-        bin_idx_i = bin_idx.astype(np.int)
-        bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
-        r_da = self.lut_ds['class_cond_ratio_reg']
-        r_v = r_da.data[sft[valid_mask] - 1, bin_idx_i - 1]  # sft, bin_idx start from 1
-        if space_mask is None:
-            space_mask = x.mask
-        r = np.ma.masked_array(np.ones(x.shape), space_mask)
-        r[valid_mask] = r_v
-        if prob:
-            prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-            p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
-            return r, p
-        else:
-            return r
-
 
 class RefRatioDay(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'RefRatioDay'
     lut_file_name: str = 'Ref_Ratio_Day_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('ref_065_pct', 'ref_083_pct')
+    valid_mask_inputs: tuple = ('ref_065_pct', 'ref_083_pct', 'dem', 'sft', 'sun_zen', 'sun_glint',
+                                'space_mask', 'bt_1080', 'cache')
+    required_bits: tuple = ('ref_065_pct_obs', 'ref_083_pct_obs', 'day', 'surface_type')
+    forbidden_bits: tuple = ('mount', 'glint', 'space')
+    halo: int = 1
 
     def __init__(self, **kwargs):
         super(RefRatioDay, self).__init__(**kwargs)
@@ -285,7 +424,8 @@ class RefRatioDay(NBClassifier):
                            sun_zen: np.ndarray,
                            sun_glint: np.ndarray,
                            space_mask: np.ndarray = None,
-                           bt_1080: np.ma.masked_array = None):
+                           bt_1080: np.ma.masked_array = None,
+                           cache: NeighborhoodCache = None):
         # obs_mask
         ref_063_mask = ~ref_063.mask
         ref_086_mask = ~ref_086.mask
@@ -297,15 +437,9 @@ class RefRatioDay(NBClassifier):
         # mount mask
         mount_mask = np.logical_and(dem > 2000, sft != 6)
         #  glint mask glint threshold 40
-        glint = np.zeros(sun_glint.shape, np.uint8)
-        glint[sun_glint < 40] = 1
-        glint[bt_1080 < 273.15] = 0
-        bt_1080_std_3x3 = cal_nxn_indices(bt_1080, 1, np.std)
-        glint[bt_1080_std_3x3 > 1.0] = 0
-        ref_063_std_3x3 = cal_nxn_indices(ref_063, 1, np.std)
-        glint[ref_063_std_3x3 > 2.0] = 0
-        glint[ref_063 < 5.0] = 0
-        glint_mask = glint.astype(np.bool)
+        bt_1080_std_3x3 = self.nxn('bt_1080', bt_1080, 1, np.std, cache)
+        ref_063_std_3x3 = self.nxn('ref_063', ref_063, 1, np.std, cache)
+        glint_mask = self.glint_mask(sun_glint, bt_1080, bt_1080_std_3x3, ref_063, ref_063_std_3x3)
         # day with obs
         valid_mask1 = np.logical_and(obs_mask, day_mask)
         # not mount and glint
@@ -317,36 +451,15 @@ class RefRatioDay(NBClassifier):
         valid_mask = np.logical_and(valid_mask, sft > 0)
         return valid_mask
 
-    def infer(self,
-              x: np.ma.masked_array,
-              sft: np.ndarray,
-              valid_mask: np.ndarray,
-              space_mask: np.ndarray = None,
-              prob=False):
-        bin_start = self.lut_ds['bin_start'].data[sft[valid_mask] - 1]  # sft start from 1
-        delta_bin = self.lut_ds['delta_bin'].data[sft[valid_mask] - 1]  # sft start from 1
-        bin_idx = (x[valid_mask] - bin_start) / delta_bin
-        bin_idx_i = bin_idx.astype(np.int)
-        bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
-        r_da = self.lut_ds['class_cond_ratio_reg']
-        r_v = r_da.data[sft[valid_mask] - 1, bin_idx_i - 1]  # sft, bin_idx start from 1
-        if space_mask is None:
-            space_mask = x.mask
-        r = np.ma.masked_array(np.ones(x.shape), space_mask)
-        r[valid_mask] = r_v
-        if prob:
-            prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-            p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
-            return r, p
-        else:
-            return r
-
 
 class Ref138Day(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'Ref138Day'
     lut_file_name: str = 'Ref_138_Day_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('ref_137_pct',)
+    valid_mask_inputs: tuple = ('ref_137_pct', 'dem', 'sft', 'sun_zen', 'scat_ang', 'air_mass', 'space_mask')
+    required_bits: tuple = ('ref_137_pct_obs', 'ref_137_positive', 'surface_type')
+    forbidden_bits: tuple = ('sun_zen_80', 'air_mass', 'mount', 'forward', 'space')
 
     def __init__(self, **kwargs):
         super(Ref138Day, self).__init__(**kwargs)
@@ -396,36 +509,17 @@ class Ref138Day(NBClassifier):
         valid_mask = np.logical_and(valid_mask, sft > 0)
         return valid_mask
 
-    def infer(self,
-              x: np.ma.masked_array,
-              sft: np.ndarray,
-              valid_mask: np.ndarray,
-              space_mask: np.ndarray = None,
-              prob=False):
-        bin_start = self.lut_ds['bin_start'].data[sft[valid_mask] - 1]  # sft start from 1
-        delta_bin = self.lut_ds['delta_bin'].data[sft[valid_mask] - 1]  # sft start from 1
-        bin_idx = (x[valid_mask] - bin_start) / delta_bin
-        bin_idx_i = bin_idx.astype(np.int)
-        bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
-        r_da = self.lut_ds['class_cond_ratio_reg']
-        r_v = r_da.data[sft[valid_mask] - 1, bin_idx_i - 1]  # sft, bin_idx start from 1
-        if space_mask is None:
-            space_mask = x.mask
-        r = np.ma.masked_array(np.ones(x.shape), space_mask)
-        r[valid_mask] = r_v
-        if prob:
-            prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-            p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
-            return r, p
-        else:
-            return r
-
 
 class NdsiDay(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'NdsiDay'
     lut_file_name: str = 'Ndsi_Day_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('ref_065_pct', 'ref_161_pct')
+    valid_mask_inputs: tuple = ('ref_065_pct', 'ref_161_pct', 'sft', 'sun_glint', 'sun_zen', 'scat_ang',
+                                'air_mass', 'space_mask', 'bt_1080', 'cache')
+    required_bits: tuple = ('ref_065_pct_obs', 'ref_161_pct_obs', 'surface_type')
+    forbidden_bits: tuple = ('sun_zen_80', 'air_mass', 'glint', 'forward', 'space')
+    halo: int = 1
 
     def __init__(self, **kwargs):
         super(NdsiDay, self).__init__(**kwargs)
@@ -447,7 +541,8 @@ class NdsiDay(NBClassifier):
                            scat_ang: np.ma.masked_array,
                            air_mass: np.ma.masked_array,
                            space_mask: np.ndarray = None,
-                           bt_1080: np.ma.masked_array = None):
+                           bt_1080: np.ma.masked_array = None,
+                           cache: NeighborhoodCache = None):
         # obs mask
         ref_063_mask = ~ref_063.mask
         ref_160_mask = ~ref_160.mask
@@ -460,15 +555,9 @@ class NdsiDay(NBClassifier):
         # obs value mask
         obs_v_mask = np.logical_and(ref_063_mask >= 0, ref_160_mask >= 0)
         #  glint mask glint threshold 40
-        glint = np.zeros(sun_glint.shape, np.uint8)
-        glint[sun_glint < 40] = 1
-        glint[bt_1080 < 273.15] = 0
-        bt_1080_std_3x3 = cal_nxn_indices(bt_1080, 1, np.std)
-        glint[bt_1080_std_3x3 > 1.0] = 0
-        ref_063_std_3x3 = cal_nxn_indices(ref_063, 1, np.std)
-        glint[ref_063_std_3x3 > 2.0] = 0
-        glint[ref_063 < 5.0] = 0
-        glint_mask = glint.astype(np.bool)
+        bt_1080_std_3x3 = self.nxn('bt_1080', bt_1080, 1, np.std, cache)
+        ref_063_std_3x3 = self.nxn('ref_063', ref_063, 1, np.std, cache)
+        glint_mask = self.glint_mask(sun_glint, bt_1080, bt_1080_std_3x3, ref_063, ref_063_std_3x3)
         # forward mask
         scat_ang = scat_ang.data
         forward_mask = np.logical_and(scat_ang < 80, sun_zen < 95.0)
@@ -486,36 +575,17 @@ class NdsiDay(NBClassifier):
         valid_mask = np.logical_and(valid_mask, sft > 0)
         return valid_mask
 
-    def infer(self,
-              x: np.ma.masked_array,
-              sft: np.ndarray,
-              valid_mask: np.ndarray,
-              space_mask: np.ndarray = None,
-              prob=False):
-        bin_start = self.lut_ds['bin_start'].data[sft[valid_mask] - 1]  # sft start from 1
-        delta_bin = self.lut_ds['delta_bin'].data[sft[valid_mask] - 1]  # sft start from 1
-        bin_idx = (x[valid_mask] - bin_start) / delta_bin
-        bin_idx_i = bin_idx.astype(np.int)
-        bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
-        r_da = self.lut_ds['class_cond_ratio_reg']
-        r_v = r_da.data[sft[valid_mask] - 1, bin_idx_i - 1]  # sft, bin_idx start from 1
-        if space_mask is None:
-            space_mask = x.mask
-        r = np.ma.masked_array(np.ones(x.shape), space_mask)
-        r[valid_mask] = r_v
-        if prob:
-            prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-            p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
-            return r, p
-        else:
-            return r
-
 
 class Ref063Day(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'Ref063Day'
     lut_file_name: str = 'Ref_063_Day_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('ref_065_pct', 'ref_065_clear_pct')
+    valid_mask_inputs: tuple = ('ref_065_pct', 'ref_065_clear_pct', 'dem', 'sft', 'sun_glint', 'sun_zen',
+                                'scat_ang', 'air_mass', 'snow_mask', 'space_mask', 'bt_1080', 'cache')
+    required_bits: tuple = ('ref_065_pct_obs', 'ref_065_clear_pct_obs', 'surface_type')
+    forbidden_bits: tuple = ('mount', 'glint', 'sun_zen_80', 'air_mass', 'snow', 'forward', 'space')
+    halo: int = 1
 
     def __init__(self, **kwargs):
         super(Ref063Day, self).__init__(**kwargs)
@@ -539,7 +609,8 @@ class Ref063Day(NBClassifier):
                            air_mass: np.ma.masked_array,
                            snow_mask: np.ndarray,
                            space_mask: np.ndarray = None,
-                           bt_1080: np.ma.masked_array = None
+                           bt_1080: np.ma.masked_array = None,
+                           cache: NeighborhoodCache = None
                            ):
         # obs mask
         ref_063_mask = ~ref_063.mask
@@ -553,15 +624,9 @@ class Ref063Day(NBClassifier):
         # mount mask
         mount_mask = np.logical_and(dem > 2000, sft != 6)
         #  glint mask glint threshold 40
-        glint = np.zeros(sun_glint.shape, np.uint8)
-        glint[sun_glint < 40] = 1
-        glint[bt_1080 < 273.15] = 0
-        bt_1080_std_3x3 = cal_nxn_indices(bt_1080, 1, np.std)
-        glint[bt_1080_std_3x3 > 1.0] = 0
-        ref_063_std_3x3 = cal_nxn_indices(ref_063, 1, np.std)
-        glint[ref_063_std_3x3 > 2.0] = 0
-        glint[ref_063 < 5.0] = 0
-        glint_mask = glint.astype(np.bool)
+        bt_1080_std_3x3 = self.nxn('bt_1080', bt_1080, 1, np.std, cache)
+        ref_063_std_3x3 = self.nxn('ref_063', ref_063, 1, np.std, cache)
+        glint_mask = self.glint_mask(sun_glint, bt_1080, bt_1080_std_3x3, ref_063, ref_063_std_3x3)
         # forward mask
         scat_ang = scat_ang.data
         forward_mask = np.logical_and(scat_ang < 80, sun_zen < 95.0)
@@ -583,36 +648,15 @@ class Ref063Day(NBClassifier):
 
         return valid_mask
 
-    def infer(self,
-              x: np.ma.masked_array,
-              sft: np.ndarray,
-              valid_mask: np.ndarray,
-              space_mask: np.ndarray = None,
-              prob=False):
-        bin_start = self.lut_ds['bin_start'].data[sft[valid_mask] - 1]  # sft start from 1
-        delta_bin = self.lut_ds['delta_bin'].data[sft[valid_mask] - 1]  # sft start from 1
-        bin_idx = (x[valid_mask] - bin_start) / delta_bin
-        bin_idx_i = bin_idx.astype(np.int)
-        bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
-        r_da = self.lut_ds['class_cond_ratio_reg']
-        r_v = r_da.data[sft[valid_mask] - 1, bin_idx_i - 1]  # sft, bin_idx start from 1
-        if space_mask is None:
-            space_mask = x.mask
-        r = np.ma.masked_array(np.ones(x.shape), space_mask)
-        r[valid_mask] = r_v
-        if prob:
-            prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-            p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
-            return r, p
-        else:
-            return r
-
 
 class T11(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'T_11'
     lut_file_name: str = 'T_11_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('bt_1080',)
+    valid_mask_inputs: tuple = ('bt_1080', 'sft', 'space_mask')
+    required_bits: tuple = ('bt_1080_obs', 'surface_type')
+    forbidden_bits: tuple = ('space',)
 
     def __init__(self, **kwargs):
         super(T11, self).__init__(**kwargs)
@@ -634,36 +678,16 @@ class T11(NBClassifier):
         valid_mask = np.logical_and(valid_mask, sft > 0)
         return valid_mask
 
-    def infer(self,
-              x: np.ma.masked_array,
-              sft: np.ndarray,
-              valid_mask: np.ndarray,
-              space_mask: np.ndarray = None,
-              prob=False):
-        bin_start = self.lut_ds['bin_start'].data[sft[valid_mask] - 1]  # sft start from 1
-        delta_bin = self.lut_ds['delta_bin'].data[sft[valid_mask] - 1]  # sft start from 1
-        bin_idx = (x[valid_mask] - bin_start) / delta_bin
-        bin_idx_i = bin_idx.astype(np.int)
-        bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
-        r_da = self.lut_ds['class_cond_ratio_reg']
-        r_v = r_da.data[sft[valid_mask] - 1, bin_idx_i - 1]  # sft, bin_idx start from 1
-        if space_mask is None:
-            space_mask = x.mask
-        r = np.ma.masked_array(np.ones(x.shape), space_mask)
-        r[valid_mask] = r_v
-        if prob:
-            prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-            p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
-            return r, p
-        else:
-            return r
-
 
 class TmaxT(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'Tmax_T'
     lut_file_name: str = 'Tmax_T_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('bt_1080', 'cache')
+    valid_mask_inputs: tuple = ('bt_1080', 'dem', 'sft', 'coastal_mask', 'space_mask')
+    required_bits: tuple = ('bt_1080_obs', 'surface_type')
+    forbidden_bits: tuple = ('mount', 'coastal', 'space')
+    halo: int = 1
 
     def __init__(self, **kwargs):
         super(TmaxT, self).__init__(**kwargs)
@@ -672,8 +696,8 @@ class TmaxT(NBClassifier):
         if lut_file_path:
             self.lut_ds = xr.open_dataset(lut_file_path)
 
-    def prepare_feature(self, bt_1080: np.ma.masked_array):
-        bt_1080_max = cal_nxn_indices(bt_1080, func=np.max)
+    def prepare_feature(self, bt_1080: np.ma.masked_array, cache: NeighborhoodCache = None):
+        bt_1080_max = self.nxn('bt_1080', bt_1080, func=np.max, cache=cache)
         feature = bt_1080_max - bt_1080
         return feature
 
@@ -696,36 +720,15 @@ class TmaxT(NBClassifier):
         valid_mask = np.logical_and(valid_mask, sft > 0)
         return valid_mask
 
-    def infer(self,
-              x: np.ma.masked_array,
-              sft: np.ndarray,
-              valid_mask: np.ndarray,
-              space_mask: np.ndarray = None,
-              prob=False):
-        bin_start = self.lut_ds['bin_start'].data[sft[valid_mask] - 1]  # sft start from 1
-        delta_bin = self.lut_ds['delta_bin'].data[sft[valid_mask] - 1]  # sft start from 1
-        bin_idx = (x[valid_mask] - bin_start) / delta_bin
-        bin_idx_i = bin_idx.astype(np.int)
-        bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
-        r_da = self.lut_ds['class_cond_ratio_reg']
-        r_v = r_da.data[sft[valid_mask] - 1, bin_idx_i - 1]  # sft, bin_idx start from 1
-        if space_mask is None:
-            space_mask = x.mask
-        r = np.ma.masked_array(np.ones(x.shape), space_mask)
-        r[valid_mask] = r_v
-        if prob:
-            prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-            p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
-            return r, p
-        else:
-            return r
-
 
 class Btd37511Night(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'Btd_375_11_Night'
     lut_file_name: str = 'Btd_375_11_Night_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('bt_372_low', 'bt_1080')
+    valid_mask_inputs: tuple = ('bt_372_low', 'bt_1080', 'sft', 'sun_zen', 'space_mask')
+    required_bits: tuple = ('bt_1080_obs', 'bt_372_warm', 'sun_zen_90', 'surface_type')
+    forbidden_bits: tuple = ()
 
     def __init__(self, **kwargs):
         super(Btd37511Night, self).__init__(**kwargs)
@@ -753,36 +756,16 @@ class Btd37511Night(NBClassifier):
         valid_mask = np.logical_and(valid_mask, sft > 0)
         return valid_mask
 
-    def infer(self,
-              x: np.ma.masked_array,
-              sft: np.ndarray,
-              valid_mask: np.ndarray,
-              space_mask: np.ndarray = None,
-              prob=False):
-        bin_start = self.lut_ds['bin_start'].data[sft[valid_mask] - 1]  # sft start from 1
-        delta_bin = self.lut_ds['delta_bin'].data[sft[valid_mask] - 1]  # sft start from 1
-        bin_idx = (x[valid_mask] - bin_start) / delta_bin
-        bin_idx_i = bin_idx.astype(np.int)
-        bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
-        r_da = self.lut_ds['class_cond_ratio_reg']
-        r_v = r_da.data[sft[valid_mask] - 1, bin_idx_i - 1]  # sft, bin_idx start from 1
-        if space_mask is None:
-            space_mask = x.mask
-        r = np.ma.masked_array(np.ones(x.shape), space_mask)
-        r[valid_mask] = r_v
-        if prob:
-            prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-            p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
-            return r, p
-        else:
-            return r
-
 
 class RefStd(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'RefStdDay'
     lut_file_name: str = 'Ref_Std_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('ref_065_pct', 'cache')
+    valid_mask_inputs: tuple = ('ref_065_pct', 'dem', 'sft', 'sun_zen', 'coastal_mask', 'space_mask')
+    required_bits: tuple = ('ref_065_pct_obs', 'day', 'surface_type')
+    forbidden_bits: tuple = ('mount', 'coastal', 'space')
+    halo: int = 1
 
     def __init__(self, **kwargs):
         super(RefStd, self).__init__(**kwargs)
@@ -791,8 +774,8 @@ class RefStd(NBClassifier):
         if lut_file_path:
             self.lut_ds = xr.open_dataset(lut_file_path)
 
-    def prepare_feature(self, ref_063: np.ma.masked_array):
-        feature = cal_nxn_indices(ref_063, func=np.std)
+    def prepare_feature(self, ref_063: np.ma.masked_array, cache: NeighborhoodCache = None):
+        feature = self.nxn('ref_063', ref_063, func=np.std, cache=cache)
         return feature
 
     def prepare_valid_mask(self,
@@ -819,36 +802,15 @@ class RefStd(NBClassifier):
         valid_mask = np.logical_and(valid_mask, sft > 0)
         return valid_mask
 
-    def infer(self,
-              x: np.ma.masked_array,
-              sft: np.ndarray,
-              valid_mask: np.ndarray,
-              space_mask: np.ndarray = None,
-              prob=False):
-        bin_start = self.lut_ds['bin_start'].data[sft[valid_mask] - 1]  # sft start from 1
-        delta_bin = self.lut_ds['delta_bin'].data[sft[valid_mask] - 1]  # sft start from 1
-        bin_idx = (x[valid_mask] - bin_start) / delta_bin
-        bin_idx_i = bin_idx.astype(np.int)
-        bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
-        r_da = self.lut_ds['class_cond_ratio_reg']
-        r_v = r_da.data[sft[valid_mask] - 1, bin_idx_i - 1]  # sft, bin_idx start from 1
-        if space_mask is None:
-            space_mask = x.mask
-        r = np.ma.masked_array(np.ones(x.shape), space_mask)
-        r[valid_mask] = r_v
-        if prob:
-            prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-            p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
-            return r, p
-        else:
-            return r
-
 
 class Emiss375Day(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'Emiss375Day'
     lut_file_name: str = 'Emiss_375_Day_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('ems_372',)
+    valid_mask_inputs: tuple = ('ems_372', 'sft', 'sun_zen', 'space_mask')
+    required_bits: tuple = ('ems_372_obs', 'day', 'surface_type')
+    forbidden_bits: tuple = ('space',)
 
     def __init__(self, **kwargs):
         super(Emiss375Day, self).__init__(**kwargs)
@@ -873,36 +835,15 @@ class Emiss375Day(NBClassifier):
         valid_mask = np.logical_and(valid_mask, sft > 0)
         return valid_mask
 
-    def infer(self,
-              x: np.ma.masked_array,
-              sft: np.ndarray,
-              valid_mask: np.ndarray,
-              space_mask: np.ndarray = None,
-              prob=False):
-        bin_start = self.lut_ds['bin_start'].data[sft[valid_mask] - 1]  # sft start from 1
-        delta_bin = self.lut_ds['delta_bin'].data[sft[valid_mask] - 1]  # sft start from 1
-        bin_idx = (x[valid_mask] - bin_start) / delta_bin
-        bin_idx_i = bin_idx.astype(np.int)
-        bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
-        r_da = self.lut_ds['class_cond_ratio_reg']
-        r_v = r_da.data[sft[valid_mask] - 1, bin_idx_i - 1]  # sft, bin_idx start from 1
-        if space_mask is None:
-            space_mask = x.mask
-        r = np.ma.masked_array(np.ones(x.shape), space_mask)
-        r[valid_mask] = r_v
-        if prob:
-            prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-            p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
-            return r, p
-        else:
-            return r
-
 
 class Emiss375Night(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'Emiss375Night'
     lut_file_name: str = 'Emiss_375_Night_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('ems_372',)
+    valid_mask_inputs: tuple = ('ems_372', 'sft', 'sun_zen', 'space_mask')
+    required_bits: tuple = ('ems_372_obs', 'night', 'surface_type')
+    forbidden_bits: tuple = ('space',)
 
     def __init__(self, **kwargs):
         super(Emiss375Night, self).__init__(**kwargs)
@@ -926,42 +867,24 @@ class Emiss375Night(NBClassifier):
         valid_mask = np.logical_and(valid_mask, sft > 0)
         return valid_mask
 
-    def infer(self,
-              x: np.ma.masked_array,
-              sft: np.ndarray,
-              valid_mask: np.ndarray,
-              space_mask: np.ndarray = None,
-              prob=False):
-        bin_start = self.lut_ds['bin_start'].data[sft[valid_mask] - 1]  # sft start from 1
-        delta_bin = self.lut_ds['delta_bin'].data[sft[valid_mask] - 1]  # sft start from 1
-        bin_idx = (x[valid_mask] - bin_start) / delta_bin
-        bin_idx_i = bin_idx.astype(np.int)
-        bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
-        r_da = self.lut_ds['class_cond_ratio_reg']
-        r_v = r_da.data[sft[valid_mask] - 1, bin_idx_i - 1]  # sft, bin_idx start from 1
-        if space_mask is None:
-            space_mask = x.mask
-        r = np.ma.masked_array(np.ones(x.shape), space_mask)
-        r[valid_mask] = r_v
-        if prob:
-            prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-            p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
-            return r, p
-        else:
-            return r
-
 
 class GeoColorRGB(NBClassifier):
     lut_ds: xr.Dataset
     short_name: str = 'GeoColorRGB'
     lut_file_name: str = 'GeoColorRGB_M%.2d_handfix.nc'
+    feature_inputs: tuple = ('geo_color',)
+    valid_mask_inputs: tuple = ('feature', 'sft', 'space_mask')
+    ratio_name: str = 'ratio'
 
     def __init__(self, **kwargs):
         super(GeoColorRGB, self).__init__(**kwargs)
 
     def prepare_feature(self, geo_color_tiff_path):
-        feature = tiff.imread(geo_color_tiff_path)
+        # the path of the GeoColor tif or the image itself
+        if isinstance(geo_color_tiff_path, str):
+            feature = tiff.imread(geo_color_tiff_path)
+        else:
+            feature = geo_color_tiff_path
         return feature
 
     def prepare_valid_mask(self,
@@ -971,23 +894,34 @@ class GeoColorRGB(NBClassifier):
         valid_mask = np.logical_and(~space_mask, sft > 0)
         return valid_mask
 
+    def lut_index(self, x: np.ndarray, sft: np.ndarray, valid_mask: np.ndarray) -> tuple:
+        c = x[valid_mask]
+        bins = self.lut_ds.bins.data[0, 0, 0, :]
+        r_idx = np.digitize(c[:, 0], bins)
+        g_idx = np.digitize(c[:, 1], bins)
+        b_idx = np.digitize(c[:, 2], bins)
+        return sft[valid_mask] - 1, r_idx - 1, g_idx - 1, b_idx - 1  # same indexing as infer
+
     def infer(self,
               x: np.ma.masked_array,
               sft: np.ndarray,
               valid_mask: np.ndarray,
               space_mask: np.ndarray = None,
-              prob=False):
+              prob=False,
+              product: np.ndarray = None):
         c = x[valid_mask]
         r_idx = np.digitize(c[:, 0], self.lut_ds.bins.data[0, 0, 0, :])
         g_idx = np.digitize(c[:, 1], self.lut_ds.bins.data[0, 0, 0, :])
         b_idx = np.digitize(c[:, 2], self.lut_ds.bins.data[0, 0, 0, :])
         r_da = self.lut_ds['ratio']
         r_v = r_da.data[sft[valid_mask] - 1, r_idx - 1, g_idx - 1, b_idx - 1]  # sft, bin_idx start from 1
-        r = np.ones(x.shape[:-1])
+        r = np.ones(x.shape[:-1], self.dtype)
         r[valid_mask] = r_v
+        if product is not None:
+            np.multiply(product, r, out=product)
         if prob:
             prior_yes = self.lut_ds['prior_yes'].data[sft[valid_mask] - 1]  # sft start from 1
-            p = np.zeros(x.shape[:-1])
+            p = np.zeros(x.shape[:-1], self.dtype)
             p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
             return r, p
         else:
@@ -1,23 +1,77 @@
 import datetime
+import contextlib
 
 import numpy as np
 import h5py
 
+from ..utils.dtype import get_float_dtype
+
 
 class ProductionBase(object):
     fname: str = None
     start_time_stamp: datetime.datetime
     end_time_stamp: datetime.datetime
+    dtype: np.dtype
 
-    def __init__(self):
+    def __init__(self, dtype=None, rows: slice = None):
         super(ProductionBase, self).__init__()
+        # float type of the decoded data, the process wide policy by default
+        self.dtype = np.dtype(dtype or get_float_dtype())
+        # rows of the disk to read, all by default
+        self.rows = rows
+        self._h5 = None
+        self._h5_depth = 0
+
+    def open(self):
+        """Keep the file open until the matching :meth:`close`, nested calls share one handle."""
+        if self._h5 is None:
+            self._h5 = h5py.File(self.fname, 'r')
+        self._h5_depth += 1
+        return self
+
+    def close(self):
+        self._h5_depth = max(self._h5_depth - 1, 0)
+        if self._h5_depth == 0 and self._h5 is not None:
+            self._h5.close()
+            self._h5 = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @contextlib.contextmanager
+    def _h5_file(self):
+        """The handle kept by :meth:`open`, or a handle opened for a single read."""
+        if self._h5 is not None:
+            yield self._h5
+        else:
+            f = h5py.File(self.fname, 'r')
+            try:
+                yield f
+            finally:
+                f.close()
+
+    def _read(self, ds: h5py.Dataset, index=None) -> np.ndarray:
+        """Data of a data set, ``index`` or the reader's rows of an image as a hyperslab read.
+
+        ``rows`` only applies to 2-D (image) data sets, tables are read whole.
+        """
+        if index is not None:
+            return ds[index]
+        if self.rows is None or ds.ndim < 2:
+            return ds[...]
+        return ds[self.rows]
 
-    def _decorate_ds_data(self, ds: h5py.Dataset, masked=True) -> np.ma.masked_array:
+    def _decorate_ds_data(self, ds: h5py.Dataset, masked=True, index=None) -> np.ma.masked_array:
         slope = ds.attrs.get('Slope', 0)
         inter = ds.attrs.get('Intercept', 0)
         fill = ds.attrs.get('FillValue', 65535)
-        array = ds[...]
-        array = slope * array + inter
+        array = self._read(ds, index)
+        # computed in the float type of the reader, not promoted by the attributes
+        array = np.multiply(array, slope, dtype=self.dtype)
+        array += np.asarray(inter, self.dtype)
         if masked:
             array = np.ma.masked_values(array, fill)
         else:
@@ -0,0 +1,508 @@
+import os
+import re
+import threading
+
+import h5py
+import numpy as np
+import tifffile as tiff
+
+from .FDIFKM import FY4AAGRIL1FDIDISK4KM
+from .GEOFKM import FY4AAGRIL1GEODISK4KM
+from .CLMFKM import FY4AAGRICLM4KM
+from .NavFKM import get_nav_file
+from .NavieBayes import NBClassifier
+from .MaskPlanes import MaskPlanes
+from ..utils.cache import NeighborhoodCache
+from ..utils.disk_cache import DiskArrayCache
+from ..utils.filters import get_filter_name
+from ..utils.cspp import infer_airmass, infer_great_circle, infer_relative_azimuth, infer_scat_angle
+
+
+class SceneField(object):
+    """A field of a :class:`Scene`, computed from its dependencies on first access."""
+
+    def __init__(self, func, depends: tuple = (), source: str = None):
+        super(SceneField, self).__init__()
+        self.func = func
+        self.depends = tuple(depends)
+        self.source = source
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance.get(self.name)
+
+
+def scene_field(*depends, source: str = None):
+    """Declare a method of Scene as a lazy field computed from the ``depends`` fields.
+
+    Examples:
+        >>> @scene_field('sat_zen', 'sun_zen')
+        ... def air_mass(self, sat_zen, sun_zen):
+        ...     return infer_airmass(sat_zen, sun_zen)
+    """
+
+    def decorate(func):
+        return SceneField(func, depends, source)
+
+    return decorate
+
+
+class CompactNeighborhoodCache(NeighborhoodCache):
+    """Window statistics of the earth vectors of a compact Scene.
+
+    A window needs the 2-D neighbors of a pixel, so the statistic of an earth
+    vector is computed on the whole disk field it was gathered from and then
+    gathered like the vector; classifiers calling ``nxn`` on a vector of a
+    compact scene get the same values as on the whole disk.
+    """
+
+    def __init__(self, scene, max_bytes: int = 2 * 1024 ** 3):
+        super(CompactNeighborhoodCache, self).__init__(max_bytes)
+        self.scene = scene
+
+    def get(self, band: str, array: np.ndarray, n: int = 1, func=np.max) -> np.ma.masked_array:
+        name = self.scene.field_of(array)
+        func_name = get_filter_name(func)
+        if name is None or n != 1 or func_name not in ('std', 'min', 'max', 'mean'):
+            raise ValueError('no %dx%d %s of %s in a compact scene, only 3x3 statistics of its fields'
+                             % (2 * n + 1, 2 * n + 1, func_name, band))
+        return self.scene.get('%s_%s3x3' % (name, func_name))
+
+
+class Scene(object):
+    """Lazy, memoized view of one FY4A AGRI scene: L1 bands, geometry, NAV and derived fields.
+
+    Nothing is read when the scene is made. A field is read or computed the
+    first time it is asked for, together with the fields it depends on, and
+    kept for the life of the scene; so a pipeline only pays for the inputs its
+    classifiers need. Fields are
+
+    - the L1 bands of ``channel_table``, e.g. 'bt_1080', and their reflectance
+      in percent as '<band>_pct', e.g. 'ref_065_pct';
+    - the GEO angles and the NAV fields, see the ``scene_field`` methods;
+    - derived fields: 'air_mass', 'scat_ang', 'glint_mask', 'ref_065_clear_pct'
+      and the 3x3 window statistics of any field as '<field>_std3x3' (min, max
+      and mean too).
+
+    The primitive masks the classifiers' valid masks are made of are packed
+    as bit planes in ``masks``, see MaskPlanes. With a ``disk_cache`` the
+    fields read from the L1, GEO and CLM files are decoded once and mapped
+    from the disk by the next scenes of the same files, see DiskArrayCache.
+
+    A ``compact`` scene holds 1-D vectors of the earth pixels only (see
+    ``FY4NavFile.get_earth_index``): every field is gathered once when read,
+    all the pixel wise work runs on the vectors and :meth:`expand` scatters a
+    result back to the disk. Window statistics are computed on the disk and
+    gathered.
+
+    Examples:
+        >>> scene = Scene(l1_file_path, geo_file_path)
+        >>> scene.prefetch(['bt_1080', 'bt_850', 'sft', 'space_mask'])  # one open of the L1 file
+        >>> scene.bt_1080, scene['air_mass']
+        >>> scene.requires(['air_mass'])
+        ['sat_zen', 'sun_zen', 'air_mass']
+    """
+    # sub satellite point of FY4A used for the scattering angle
+    sat_lat: float = 0
+    sat_lon: float = 104.7
+
+    # daily clear sky 0.65um reflectance composite on a lat/lon grid, by day of year
+    clear_sky_file_name = 'ref_065_clear_%.3d.h5'
+
+    window_pattern = re.compile(r'^(?P<field>.+)_(?P<func>std|min|max|mean)3x3$')
+    percent_suffix = '_pct'
+
+    def __init__(self, l1_file_path: str, geo_file_path: str = None, clm_file_path: str = None,
+                 nav_file=None, dtype=None, cache: NeighborhoodCache = None, rows: slice = None,
+                 compact: bool = False, disk_cache: DiskArrayCache = None):
+        super(Scene, self).__init__()
+        if compact and rows is not None:
+            raise ValueError('a compact scene covers the whole disk, rows can not be given')
+        self.compact = compact
+        self.dtype = dtype
+        # a block of rows of the disk, read as HDF5 hyperslabs; the whole disk by default
+        self.rows = rows
+        self.fy4_l1 = FY4AAGRIL1FDIDISK4KM(l1_file_path, dtype=dtype, rows=rows)
+        self.fy4_geo = None if geo_file_path is None else FY4AAGRIL1GEODISK4KM(geo_file_path, dtype=dtype,
+                                                                                rows=rows)
+        self.fy4_clm = None if clm_file_path is None else FY4AAGRICLM4KM(clm_file_path, dtype=dtype, rows=rows)
+        self.month = self.fy4_l1.start_time_stamp.month
+        self._nav = nav_file
+        # neighborhood statistics of this scene, shared with the classifiers
+        if cache is None:
+            cache = CompactNeighborhoodCache(self) if compact else NeighborhoodCache()
+        self.cache = cache
+        # decoded L1, GEO and CLM fields kept on disk between runs, if given
+        self.disk_cache = disk_cache
+        # primitive masks of the classifiers' valid masks, packed as bit planes
+        self.masks = MaskPlanes(self)
+        self._disk_scene = None  # whole disk fields of the window statistics of a compact scene
+        self.computed = []  # names of the fields read or computed, in order
+        self._values = {}
+        self._lock = threading.Lock()
+        self._field_locks = {}
+
+    @property
+    def nav(self):
+        """NAV file of the scene's month, shared by all scenes of the month."""
+        if self._nav is None:
+            self._nav = get_nav_file(self.month)
+        return self._nav
+
+    @property
+    def start_time_stamp(self):
+        return self.fy4_l1.start_time_stamp
+
+    def _nav_rows(self, array: np.ndarray) -> np.ndarray:
+        # the NAV fields are kept whole per month, a block takes a view of its rows
+        return array if self.rows is None else array[self.rows]
+
+    # compact scene
+
+    @property
+    def earth_index(self) -> np.ndarray:
+        """Flat index of the earth pixels of the disk."""
+        return self.nav.get_earth_index()
+
+    @property
+    def disk_shape(self) -> tuple:
+        return self.nav.get_space_mask(b=True).shape
+
+    def _gather(self, value):
+        # disk arrays (and images) of a compact scene become earth vectors
+        if not self.compact or not isinstance(value, np.ndarray) or value.ndim < 2:
+            return value
+        return value.reshape((-1,) + value.shape[2:])[self.earth_index]
+
+    def expand(self, values: np.ndarray, fill=0) -> np.ndarray:
+        """Scatter earth vector ``values`` back to the disk, ``fill`` on space."""
+        values = np.ma.getdata(values)
+        disk = np.full(self.disk_shape + values.shape[1:], fill, values.dtype)
+        disk.reshape((-1,) + values.shape[1:])[self.earth_index] = values
+        return disk
+
+    def _get_disk_scene(self):
+        with self._lock:
+            if self._disk_scene is None:
+                self._disk_scene = Scene(self.fy4_l1.fname,
+                                         None if self.fy4_geo is None else self.fy4_geo.fname,
+                                         None if self.fy4_clm is None else self.fy4_clm.fname,
+                                         nav_file=self.nav, dtype=self.dtype, disk_cache=self.disk_cache)
+            return self._disk_scene
+
+    def field_of(self, array) -> str:
+        """Name of the field holding ``array``, None if it is not a field of the scene."""
+        for name, value in list(self._values.items()):
+            if value is array:
+                return name
+        return None
+
+    # dependency tracking
+
+    @classmethod
+    def _field(cls, name: str):
+        field = getattr(cls, name, None)
+        return field if isinstance(field, SceneField) else None
+
+    @classmethod
+    def is_band(cls, name: str) -> bool:
+        return name in FY4AAGRIL1FDIDISK4KM.channel_table
+
+    @classmethod
+    def halo(cls, names: list) -> int:
+        """Rows of context around a block needed to compute ``names`` like on the whole disk."""
+        return max([1 if cls.window_pattern.match(name) else 0 for name in cls.requires(names)] + [0])
+
+    @classmethod
+    def depends(cls, name: str) -> tuple:
+        """Fields ``name`` is computed from, () for fields read from a file."""
+        field = cls._field(name)
+        if field is not None:
+            return field.depends
+        if cls.is_band(name):
+            return ()
+        match = cls.window_pattern.match(name)
+        if match is not None:
+            return match.group('field'),
+        if name.endswith(cls.percent_suffix) and cls.is_band(name[:-len(cls.percent_suffix)]):
+            return name[:-len(cls.percent_suffix)],
+        raise KeyError('unknown scene field: %s' % name)
+
+    @classmethod
+    def source(cls, name: str) -> str:
+        """File a field is read from, 'l1', 'geo', 'nav' or 'clm', None for derived fields."""
+        if cls.is_band(name):
+            return 'l1'
+        field = cls._field(name)
+        return None if field is None else field.source
+
+    @classmethod
+    def requires(cls, names: list) -> list:
+        """All the fields needed for ``names``, dependencies before the fields using them."""
+        order = []
+        visiting = set()
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError('circular scene field dependency: %s' % name)
+            visiting.add(name)
+            for depend in cls.depends(name):
+                visit(depend)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in names:
+            visit(name)
+        return order
+
+    # access
+
+    def get(self, name: str):
+        """Value of a field, read or computed with its dependencies on first access."""
+        value = self._values.get(name, None)
+        if value is not None or name in self._values:
+            return value
+        depends = self.depends(name)
+        with self._lock:
+            field_lock = self._field_locks.setdefault(name, threading.Lock())
+        # one lock per field: threads asking for the same field wait for a
+        # single computation, the dependencies are resolved outside of it
+        args = [self.get(depend) for depend in depends]
+        with field_lock:
+            if name not in self._values:
+                self._store(name, self._compute(name, args))
+        return self._values[name]
+
+    __getitem__ = get
+
+    def __getattr__(self, name: str):
+        # L1 bands and pattern fields as attributes, e.g. scene.bt_1080
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            self.depends(name)
+        except KeyError:
+            raise AttributeError(name)
+        return self.get(name)
+
+    # on disk cache of the fields read from files
+
+    def _reader(self, source: str):
+        return {'l1': self.fy4_l1, 'geo': self.fy4_geo, 'clm': self.fy4_clm}.get(source, None)
+
+    def _disk_key(self, name: str, reader) -> str:
+        # the decoded values depend on the float type and rows of the reader
+        rows = '' if self.rows is None else '.rows_%s_%s' % (self.rows.start, self.rows.stop)
+        return '%s%s.%s' % (name, rows, reader.dtype.name)
+
+    def is_disk_cached(self, name: str) -> bool:
+        """Whether a field read from a file is in the disk cache."""
+        reader = self._reader(self.source(name))
+        if self.disk_cache is None or reader is None:
+            return False
+        return self.disk_cache.contains(reader.fname, self._disk_key(name, reader))
+
+    def _load(self, name: str, loader):
+        reader = self._reader(self.source(name))
+        if self.disk_cache is None or reader is None:
+            return loader()
+        return self.disk_cache.get(reader.fname, self._disk_key(name, reader), loader)
+
+    def _compute(self, name: str, args: list):
+        field = self._field(name)
+        if field is not None:
+            return self._load(name, lambda: field.func(self, *args))
+        if self.is_band(name):
+            return self._load(name, lambda: self.fy4_l1.get_band_by_channel(name))
+        match = self.window_pattern.match(name)
+        if match is not None:
+            if self.compact:
+                return self._get_disk_scene().get(name)
+            return self.cache.get(match.group('field'), args[0], 1, match.group('func'))
+        return args[0] * 100
+
+    def _store(self, name: str, value):
+        self._values[name] = self._gather(value)
+        self.computed.append(name)
+
+    def prefetch(self, names: list):
+        """Load ``names`` and their dependencies, reading each file with a single open."""
+        order = [name for name in self.requires(names) if name not in self._values]
+        bands = [name for name in order if self.is_band(name) and not self.is_disk_cached(name)]
+        if bands:
+            # the disk bands the window statistics of a compact scene need are
+            # handed on before the bands are gathered, not read again
+            windows = [name for name in order if self.window_pattern.match(name)]
+            disk_names = self.requires(windows) if self.compact else []
+            for name, band in self.fy4_l1.get_bands(bands).items():
+                if self.disk_cache is not None:
+                    self.disk_cache.put(self.fy4_l1.fname, self._disk_key(name, self.fy4_l1), band)
+                if name in disk_names:
+                    disk_scene = self._get_disk_scene()
+                    with disk_scene._lock:
+                        if name not in disk_scene:
+                            disk_scene._store(name, band)
+                with self._lock:
+                    if name not in self._values:
+                        self._store(name, band)
+        readers = {'geo': self.fy4_geo, 'clm': self.fy4_clm}
+        for source, reader in readers.items():
+            names_of_source = [name for name in order if self.source(name) == source
+                               and not self.is_disk_cached(name)]
+            if names_of_source and reader is not None:
+                with reader:
+                    for name in names_of_source:
+                        self.get(name)
+        for name in order:
+            self.get(name)
+        return self
+
+    def __contains__(self, name: str):
+        return name in self._values
+
+    def clear(self):
+        """Drop all the fields and neighborhood statistics of the scene."""
+        with self._lock:
+            self._values.clear()
+            self._field_locks.clear()
+            disk_scene, self._disk_scene = self._disk_scene, None
+        if disk_scene is not None:
+            disk_scene.clear()
+        self.masks.clear()
+        self.cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.clear()
+
+    def _require(self, reader, name: str):
+        if reader is None:
+            raise ValueError('no %s file given for this scene' % name)
+        return reader
+
+    # GEO
+
+    @scene_field(source='geo')
+    def sun_zen(self):
+        return self._require(self.fy4_geo, 'GEO').get_sun_zenith()
+
+    @scene_field(source='geo')
+    def sun_azi(self):
+        return self._require(self.fy4_geo, 'GEO').get_sun_azimuth()
+
+    @scene_field(source='geo')
+    def sun_glint(self):
+        return self._require(self.fy4_geo, 'GEO').get_sun_glint()
+
+    @scene_field(source='geo')
+    def sat_zen(self):
+        return self._require(self.fy4_geo, 'GEO').get_satellite_zenith()
+
+    @scene_field(source='geo')
+    def sat_azi(self):
+        return self._require(self.fy4_geo, 'GEO').get_satellite_azimuth()
+
+    # NAV, the arrays are shared by the scenes of the month and must not be modified
+
+    @scene_field(source='nav')
+    def dem(self):
+        return self._nav_rows(self.nav.get_dem())
+
+    @scene_field(source='nav')
+    def sft(self):
+        return self._nav_rows(self.nav.prepare_surface_type_to_cspp())
+
+    @scene_field(source='nav')
+    def coastal_mask(self):
+        return self._nav_rows(self.nav.get_coastal_mask())
+
+    @scene_field(source='nav')
+    def space_mask(self):
+        return self._nav_rows(self.nav.get_space_mask(b=True))
+
+    @scene_field(source='nav')
+    def pix_lat(self):
+        return self._nav_rows(self.nav.get_latitude())
+
+    @scene_field(source='nav')
+    def pix_lon(self):
+        return self._nav_rows(self.nav.get_longitude())
+
+    @scene_field(source='nav')
+    def snow_mask(self):
+        return self._nav_rows(self.nav.get_snow_mask()) == 3
+
+    # CLM
+
+    @scene_field(source='clm')
+    def clm(self):
+        return self._require(self.fy4_clm, 'CLM').get_clm()
+
+    # GeoColor
+
+    @scene_field()
+    def geo_color_path(self):
+        return self.fy4_l1.fname.replace('FDI', 'CLR').replace('V0001.HDF', 'GeoColor.tif')
+
+    @scene_field('geo_color_path')
+    def geo_color(self, geo_color_path):
+        """GeoColor RGB image, only the scene's rows are paged in when the tif can be mapped."""
+        try:
+            image = tiff.memmap(geo_color_path, mode='r')
+        except ValueError:  # compressed or not contiguous
+            image = tiff.imread(geo_color_path)
+        return np.array(image if self.rows is None else image[self.rows])
+
+    # derived
+
+    @scene_field('sat_zen', 'sun_zen')
+    def air_mass(self, sat_zen, sun_zen):
+        return infer_airmass(sat_zen, sun_zen)
+
+    @scene_field(source='geo')
+    def sun_zen_center(self):
+        """Sun zenith at the disk center, the reference of the relative azimuth."""
+        return self._require(self.fy4_geo, 'GEO').get_sun_zenith_center()
+
+    @scene_field('pix_lat', 'pix_lon', 'sun_zen', 'sat_zen', 'sun_zen_center')
+    def scat_ang(self, pix_lat, pix_lon, sun_zen, sat_zen, sun_zen_center):
+        # infer_scat_angle_short with the disk center given, so that a block of
+        # rows gets the same angles as the whole disk
+        geo_x = infer_great_circle(pix_lat, pix_lon, self.sat_lat, self.sat_lon)
+        rel_azi = infer_relative_azimuth(geo_x, sun_zen, sun_zen_center)
+        return infer_scat_angle(sun_zen, sat_zen, rel_azi)
+
+    @scene_field('sun_glint', 'bt_1080', 'bt_1080_std3x3', 'ref_065_pct', 'ref_065_pct_std3x3')
+    def glint_mask(self, sun_glint, bt_1080, bt_1080_std_3x3, ref_063, ref_063_std_3x3):
+        return NBClassifier.glint_mask(sun_glint, bt_1080, bt_1080_std_3x3, ref_063, ref_063_std_3x3)
+
+    @scene_field('pix_lat', 'pix_lon')
+    def ref_065_clear_pct(self, pix_lat, pix_lon):
+        """Clear sky 0.65um reflectance in percent, resampled from the composite of the day."""
+        from pyresample import image, geometry
+        data_root_dir = os.getenv('METEPY_DATA_PATH', 'assets')
+        rc_file = os.path.join(data_root_dir, 'LUT',
+                               self.clear_sky_file_name % self.start_time_stamp.timetuple().tm_yday)
+        with h5py.File(rc_file, 'r') as rc_f:
+            ds = rc_f['ref_065_clear']
+            ref_065_clear_gll = np.ma.masked_values(ds[...], ds.attrs['fill_value'])
+            ref_065_clear_gll = ref_065_clear_gll * ds.attrs['scale_factor']
+            ref_lon = rc_f['lon'][...]
+            ref_lat = rc_f['lat'][...]
+        obj_swath_def = geometry.SwathDefinition(lons=pix_lon, lats=pix_lat)
+        ref_lon, ref_lat = np.meshgrid(ref_lon, ref_lat)
+        ref_swath_def = geometry.SwathDefinition(lons=ref_lon, lats=ref_lat)
+        ref_swath_con = image.ImageContainerNearest(ref_065_clear_gll, ref_swath_def,
+                                                    radius_of_influence=20000, fill_value=65535)
+        area_con = ref_swath_con.resample(obj_swath_def)
+        return area_con.image_data * 100
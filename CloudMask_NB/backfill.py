@@ -0,0 +1,143 @@
+"""Reprocessing of historical scenes on a pool of processes."""
+import os
+import json
+import time
+import multiprocessing
+from queue import Empty
+from concurrent.futures import ProcessPoolExecutor
+
+from CloudMask_NB.FY4A.Ensemble import NBEnsemble
+from CloudMask_NB.batch import SceneFiles, process_scenes
+
+manifest_name = 'manifest.jsonl'
+
+
+def shard_by_month(scenes: list, max_shard_scenes: int = None) -> list:
+    """Scenes grouped by (year, month), each month split in shards of at most ``max_shard_scenes``."""
+    months = {}
+    for scene in scenes:
+        months.setdefault((scene.start_time.year, scene.start_time.month), []).append(scene)
+    shards = []
+    for key in sorted(months):
+        month_scenes = months[key]
+        size = max_shard_scenes or len(month_scenes)
+        shards.extend(month_scenes[i:i + size] for i in range(0, len(month_scenes), size))
+    return shards
+
+
+def read_manifest(manifest_path: str) -> dict:
+    """L1 file name -> last record of the manifest, a torn last line is ignored."""
+    records = {}
+    if not os.path.exists(manifest_path):
+        return records
+    with open(manifest_path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['l1']] = record
+    return records
+
+
+def is_done(record: dict) -> bool:
+    return record is not None and record['ok'] and os.path.exists(record['out'])
+
+
+def _run_shard(scenes: list, out_dir: str, ensemble_config: dict, queue, kwargs: dict) -> int:
+    # worker process: one shard, hence one month of NAV fields and LUTs
+    ensemble = NBEnsemble.from_config(ensemble_config)
+
+    def report(result):
+        queue.put({'l1': os.path.basename(result.scene.l1), 'out': result.out, 'ok': result.ok,
+                   'seconds': round(result.seconds, 3), 'error': result.error})
+
+    process_scenes([SceneFiles(*scene) for scene in scenes], out_dir, ensemble, callback=report, **kwargs)
+    return len(scenes)
+
+
+class Backfill(object):
+    """Cloud masks of a long period, on a pool of processes.
+
+    Scenes are sharded by month and a shard runs in one worker process, so a
+    worker keeps the NAV fields and LUTs of a single month for all its
+    scenes. Each finished scene is recorded in a JSON lines manifest in the
+    output directory as soon as it is done; a rerun skips the scenes recorded
+    as done whose tif still exists, and retries the failed ones.
+
+    Examples:
+        >>> backfill = Backfill('/data/NBCLM', NBEnsemble(), processes=8)
+        >>> summary = backfill.run(find_scenes(['/data/FY4A/2020']))
+        >>> summary['scenes_per_minute']
+    """
+
+    def __init__(self, out_dir: str, ensemble: NBEnsemble = None, processes: int = None,
+                 max_shard_scenes: int = None, manifest_path: str = None, **kwargs):
+        super(Backfill, self).__init__()
+        self.out_dir = out_dir
+        self.ensemble = NBEnsemble() if ensemble is None else ensemble
+        self.processes = processes or os.cpu_count() or 1
+        self.max_shard_scenes = max_shard_scenes
+        self.manifest_path = manifest_path or os.path.join(out_dir, manifest_name)
+        # passed on to detect_cloud_mask, e.g. block_rows or compact
+        self.kwargs = kwargs
+
+    def pending(self, scenes: list) -> list:
+        """Scenes not done by an earlier run."""
+        records = read_manifest(self.manifest_path)
+        return [scene for scene in scenes if not is_done(records.get(os.path.basename(scene.l1), None))]
+
+    def run(self, scenes: list, callback=None) -> dict:
+        """Process the pending scenes.
+
+        Args:
+            scenes (list): SceneFiles, see find_scenes.
+            callback: called with the manifest record of each scene and the
+                throughput so far, in scenes per minute.
+
+        Returns:
+            summary (dict): counts of 'skipped', 'done' and 'failed' scenes,
+                'seconds' and 'scenes_per_minute' of the run.
+        """
+        os.makedirs(self.out_dir, exist_ok=True)
+        todo = self.pending(scenes)
+        summary = {'skipped': len(scenes) - len(todo), 'done': 0, 'failed': 0}
+        t0 = time.perf_counter()
+        shards = shard_by_month(todo, self.max_shard_scenes)
+        with multiprocessing.Manager() as manager, open(self.manifest_path, 'a') as manifest:
+            queue = manager.Queue()
+            with ProcessPoolExecutor(max_workers=max(min(self.processes, len(shards)), 1)) as executor:
+                futures = [executor.submit(_run_shard, [tuple(scene) for scene in shard], self.out_dir,
+                                           self.ensemble.to_config(), queue, self.kwargs)
+                           for shard in shards]
+                received = 0
+                while received < len(todo):
+                    try:
+                        record = queue.get(timeout=1)
+                    except Empty:
+                        if all(future.done() for future in futures):
+                            break  # a worker died, its scenes are not recorded
+                        continue
+                    received += 1
+                    # checkpoint: the record is on disk before the next one is taken
+                    manifest.write(json.dumps(record) + '\n')
+                    manifest.flush()
+                    os.fsync(manifest.fileno())
+                    summary['done' if record['ok'] else 'failed'] += 1
+                    if callback is not None:
+                        minutes = (time.perf_counter() - t0) / 60
+                        callback(record, (summary['done'] + summary['failed']) / max(minutes, 1e-9))
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(e)
+        summary['failed'] += len(todo) - received
+        summary['seconds'] = time.perf_counter() - t0
+        summary['scenes_per_minute'] = (summary['done'] + summary['failed']) / max(summary['seconds'] / 60, 1e-9)
+        return summary
+
+
+def print_record(record: dict, scenes_per_minute: float):
+    status = 'done' if record['ok'] else 'failed\n%s' % record['error']
+    print('%s %s in %.1fs, %.1f scenes/min' % (record['l1'], status, record['seconds'], scenes_per_minute))
@@ -0,0 +1,183 @@
+"""Cloud masks of many scenes in one process."""
+import os
+import re
+import glob
+import time
+import datetime
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from CloudMask_NB.FY4A.FDIFKM import FY4AAGRIL1FDIDISK4KM
+from CloudMask_NB.FY4A.GEOFKM import FY4AAGRIL1GEODISK4KM
+from CloudMask_NB.FY4A.NavFKM import get_nav_file
+from CloudMask_NB.FY4A.Ensemble import NBEnsemble
+from CloudMask_NB.cli import detect_cloud_mask
+
+# an L1 file, its GEO file (None if not found) and the start time of the scene
+SceneFiles = namedtuple('SceneFiles', ['l1', 'geo', 'start_time'])
+# outcome of a scene, error is the traceback of a failed scene
+SceneResult = namedtuple('SceneResult', ['scene', 'out', 'ok', 'seconds', 'error'])
+
+time_format = '%Y%m%d_%H%M'
+
+
+def get_time_key(file_path: str) -> str:
+    """'<start>_<end>' time fields of a FY4A file name, shared by the files of a scene."""
+    fields = os.path.basename(file_path).split('_')
+    return '%s_%s' % (fields[9], fields[10])
+
+
+def get_start_time(file_path: str) -> datetime.datetime:
+    return datetime.datetime.strptime(os.path.basename(file_path).split('_')[9], '%Y%m%d%H%M%S')
+
+
+def is_l1_file(file_path: str) -> bool:
+    return re.fullmatch(FY4AAGRIL1FDIDISK4KM.file_name_pattern, os.path.basename(file_path)) is not None
+
+
+def is_geo_file(file_path: str) -> bool:
+    return re.fullmatch(FY4AAGRIL1GEODISK4KM.file_name_pattern, os.path.basename(file_path)) is not None
+
+
+def get_geo_path(l1_file_path: str) -> str:
+    """GEO file next to an L1 file."""
+    return os.path.join(os.path.dirname(l1_file_path),
+                        os.path.basename(l1_file_path).replace('_L1-_FDI-_', '_L1-_GEO-_'))
+
+
+def get_output_path(l1_file_path: str, out_dir: str) -> str:
+    """Cloud mask tif of an L1 file, named like the FY4A CLM product with NBCLM."""
+    name = os.path.basename(l1_file_path).replace('_L1-_FDI-_', '_L2-_NBCLM-_')
+    return os.path.join(out_dir, os.path.splitext(name)[0] + '.tif')
+
+
+def expand_sources(sources: list) -> list:
+    """Files of a list of sources.
+
+    A source is a file, a directory (searched recursively), a glob pattern or
+    a text file listing one file per line ('.txt' or '.list').
+    """
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths.extend(glob.glob(os.path.join(source, '**', '*'), recursive=True))
+        elif os.path.isfile(source) and os.path.splitext(source)[1] in ('.txt', '.list'):
+            with open(source, 'r') as f:
+                paths.extend(line.strip() for line in f if line.strip())
+        elif glob.has_magic(source):
+            paths.extend(glob.glob(source, recursive=True))
+        else:
+            paths.append(source)
+    return paths
+
+
+def find_scenes(sources: list, start: datetime.datetime = None, end: datetime.datetime = None) -> list:
+    """Scenes of the L1 files of ``sources``, paired with their GEO file, in time order.
+
+    A GEO file is taken from the sources by the time fields of the file names,
+    or else looked for next to the L1 file.
+
+    Args:
+        sources (list): files, directories, glob patterns or file lists, see expand_sources.
+        start (datetime.datetime): first start time of a scene, inclusive.
+        end (datetime.datetime): last start time of a scene, exclusive.
+
+    Returns:
+        scenes (list): SceneFiles.
+    """
+    paths = expand_sources(sources)
+    geo_files = {get_time_key(path): path for path in paths if is_geo_file(path)}
+    scenes = {}
+    for path in paths:
+        if not is_l1_file(path):
+            continue
+        start_time = get_start_time(path)
+        if (start is not None and start_time < start) or (end is not None and start_time >= end):
+            continue
+        geo = geo_files.get(get_time_key(path), None)
+        if geo is None and os.path.exists(get_geo_path(path)):
+            geo = get_geo_path(path)
+        scenes.setdefault(get_time_key(path), SceneFiles(path, geo, start_time))
+    return [scenes[key] for key in sorted(scenes)]
+
+
+def warm_up(ensemble: NBEnsemble, month: int):
+    """Load the NAV fields and classifiers of a month before its first scene."""
+    nav = get_nav_file(month)
+    nav.get_space_mask(b=True)
+    nav.prepare_surface_type_to_cspp()
+    ensemble.registry.preload(month, ensemble.classifier_classes)
+
+
+def process_scene(scene: SceneFiles, out_dir: str, ensemble: NBEnsemble, **kwargs) -> SceneResult:
+    """Cloud mask of a scene, a failure is returned instead of raised.
+
+    The tif is written aside and renamed once complete: a failed run leaves
+    no partial product and keeps the product of an earlier run.
+    """
+    out = get_output_path(scene.l1, out_dir)
+    tmp_out = out + '.tmp'
+    t0 = time.perf_counter()
+    try:
+        if scene.geo is None:
+            raise FileNotFoundError('no GEO file for %s' % scene.l1)
+        detect_cloud_mask(scene.l1, scene.geo, tmp_out, ensemble=ensemble, **kwargs)
+        os.replace(tmp_out, out)
+        return SceneResult(scene, out, True, time.perf_counter() - t0, None)
+    except Exception:
+        if os.path.exists(tmp_out):
+            os.remove(tmp_out)
+        return SceneResult(scene, out, False, time.perf_counter() - t0, traceback.format_exc())
+
+
+def process_scenes(scenes: list, out_dir: str, ensemble: NBEnsemble = None, scene_workers: int = 1,
+                   callback=None, **kwargs) -> list:
+    """Cloud masks of many scenes, sharing the NAV files and classifiers.
+
+    The NAV fields and classifiers of a month are loaded once, before its
+    first scene, and kept for all the scenes of the month. Scenes run on a
+    pool of ``scene_workers`` threads, the NumPy work of a scene releases the
+    GIL; a failed scene is reported and does not stop the others.
+
+    Args:
+        scenes (list): SceneFiles, see find_scenes.
+        out_dir (str): directory of the cloud mask tifs.
+        ensemble (NBEnsemble): the operational ensemble by default.
+        scene_workers (int): scenes processed concurrently.
+        callback: called with the SceneResult of each scene as it is done.
+        **kwargs: passed on to detect_cloud_mask, e.g. block_rows or compact.
+
+    Returns:
+        results (list): SceneResult of every scene, in the order of ``scenes``.
+    """
+    if ensemble is None:
+        ensemble = NBEnsemble()
+    os.makedirs(out_dir, exist_ok=True)
+    results = []
+    with ThreadPoolExecutor(max_workers=max(int(scene_workers), 1), thread_name_prefix='nb-scene') as executor:
+        months = []
+        for scene in scenes:
+            if scene.start_time.month not in months:
+                months.append(scene.start_time.month)
+        for month in months:
+            month_scenes = [scene for scene in scenes if scene.start_time.month == month]
+            try:
+                warm_up(ensemble, month)
+            except Exception as e:
+                # the scenes report the error themselves
+                print(e, 'month %d' % month)
+            for result in executor.map(lambda scene: process_scene(scene, out_dir, ensemble, **kwargs),
+                                       month_scenes):
+                if callback is not None:
+                    callback(result)
+                results.append(result)
+    order = {scene.l1: i for i, scene in enumerate(scenes)}
+    return sorted(results, key=lambda result: order[result.scene.l1])
+
+
+def print_result(result: SceneResult):
+    if result.ok:
+        print('%s done in %.1fs -> %s' % (os.path.basename(result.scene.l1), result.seconds, result.out))
+    else:
+        print('%s failed in %.1fs\n%s' % (os.path.basename(result.scene.l1), result.seconds, result.error))
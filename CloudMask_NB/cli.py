@@ -2,123 +2,277 @@
 import os
 import sys
 import argparse
+import datetime
 
 import numpy as np
 import tifffile as tiff
 
-from CloudMask_NB.FY4A.NavFKM import FY4NavFile, get_nav_path
-from CloudMask_NB.FY4A.GEOFKM import FY4AAGRIL1GEODISK4KM
+from CloudMask_NB.FY4A.Scene import Scene
 from CloudMask_NB.FY4A.FDIFKM import FY4AAGRIL1FDIDISK4KM
-from CloudMask_NB.FY4A.CLMFKM import FY4AAGRICLM4KM
 
-from CloudMask_NB.FY4A.NavieBayes import T11, TStd, Bt1185, T11, Btd37511Night, \
-    TmaxT, Emiss375Day, Emiss375Night, GeoColorRGB
+from CloudMask_NB.FY4A.Ensemble import NBEnsemble, default_classifiers, day_classifiers, \
+    get_classifier_registry
+from CloudMask_NB.FY4A.Fusion import fusion_engines
 
 
 def detect_cloud_mask(agri_l1_file_path, agri_geo_file_path,
-                      agri_clm_tif_path):
-    fy4_l1 = FY4AAGRIL1FDIDISK4KM(agri_l1_file_path)
-    fy4_geo = FY4AAGRIL1GEODISK4KM(agri_geo_file_path)
-    month = fy4_l1.start_time_stamp.month
-    fy4_nav_file_path = get_nav_path(month)
-    fy4_nav = FY4NavFile(fy4_nav_file_path)
-
-    snow_mask = fy4_nav.get_snow_mask()
-    snow_mask = snow_mask == 3
-    pix_lat = fy4_nav.get_latitude()
-    pix_lon = fy4_nav.get_longitude()
-    dem = fy4_nav.get_dem()
-    sft = fy4_nav.prepare_surface_type_to_cspp()
-    coastal = fy4_nav.get_coastal()
-    coastal_mask = coastal > 0
-    space_mask = fy4_nav.get_space_mask(b=True)
-
-    sun_zen = fy4_geo.get_sun_zenith()
-
-    bt_372 = fy4_l1.get_band_by_channel('bt_372_low')
-    ems_372 = fy4_l1.get_band_by_channel('ems_372')
-    bt_850 = fy4_l1.get_band_by_channel('bt_850')
-    bt_1080 = fy4_l1.get_band_by_channel('bt_1080')
-
-    r = []
-    # 1 TStd
-    
-    tstd = TStd(lut_file_path=TStd.get_lut_path(month))
-    x = tstd.prepare_feature(bt_1080)
-    valid_mask = tstd.prepare_valid_mask(bt_1080, dem, sft, coastal_mask,
-                                         space_mask)
-    ratio, prob = tstd.infer(x, sft, valid_mask, space_mask, prob=True)
-    r.append(ratio)
-    # 2 Bt1185
-    bt1185 = Bt1185(lut_file_path=Bt1185.get_lut_path(month))
-    x = bt1185.prepare_feature(bt_1080, bt_850)
-    valid_mask = bt1185.prepare_valid_mask(bt_1080, bt_850, sft, space_mask)
-    ratio, prob = bt1185.infer(x, sft, valid_mask, space_mask, prob=True)
-    r.append(ratio)
-    # 3 T11
-    t11 = T11(lut_file_path=T11.get_lut_path(month))
-    x = t11.prepare_feature(bt_1080)
-    valid_mask = t11.prepare_valid_mask(bt_1080, sft, space_mask)
-    ratio, prob = t11.infer(x, sft, valid_mask, space_mask, prob=True)
-    r.append(ratio)
-    # 4 Btd37511Night
-    btd37511 = Btd37511Night(lut_file_path=Btd37511Night.get_lut_path(month))
-    x = btd37511.prepare_feature(bt_372, bt_1080)
-    valid_mask = btd37511.prepare_valid_mask(bt_372, bt_1080, sft, sun_zen,
-                                             space_mask)
-    ratio, prob = btd37511.infer(x, sft, valid_mask, space_mask, prob=True)
-    r.append(ratio)
-    # 5  Tmax-T
-    tmax_t = TmaxT(lut_file_path=TmaxT.get_lut_path(month))
-    x = tmax_t.prepare_feature(bt_1080)
-    valid_mask = tmax_t.prepare_valid_mask(bt_1080, dem, sft, coastal_mask,
-                                           space_mask)
-    ratio, prob = tmax_t.infer(x, sft, valid_mask, space_mask, prob=True)
-    r.append(ratio)
-    # 6  GeoColor
-    geo_color_tif_path = fy4_l1.fname.replace('FDI', 'CLR').replace(
-        'V0001.HDF', 'GeoColor.tif')
-    geo_color = GeoColorRGB(lut_file_path=GeoColorRGB.get_lut_path(month))
-    x = geo_color.prepare_feature(geo_color_tif_path)
-    valid_mask = geo_color.prepare_valid_mask(x, sft, space_mask)
-    ratio, prob = geo_color.infer(x, sft, valid_mask, space_mask, prob=True)
-    r.append(ratio)
-    # 7  Emiss4Day
-    emiss4day = Emiss375Day(lut_file_path=Emiss375Day.get_lut_path(month))
-    x = emiss4day.prepare_feature(ems_372)
-    valid_mask = emiss4day.prepare_valid_mask(ems_372, sft, sun_zen,
-                                              space_mask)
-    ratio, prob = emiss4day.infer(x, sft, valid_mask, space_mask, prob=True)
-    r.append(ratio)
-    # 8  Emiss4Night
-    emiss4night = Emiss375Night(lut_file_path=Emiss375Night.get_lut_path(month))
-    x = emiss4night.prepare_feature(ems_372)
-    valid_mask = emiss4night.prepare_valid_mask(ems_372, sft, sun_zen,
-                                                space_mask)
-    ratio, prob = emiss4night.infer(x, sft, valid_mask, space_mask, prob=True)
-    r.append(ratio)
-
-    # 融合
-    r_s = np.stack(r)
-    r_s_p = np.prod(r_s, 0)
-    prior_yes = t11.lut_ds['prior_yes'].data[sft[sft > 0] - 1]
-    p = np.ma.masked_array(np.zeros(x.shape), space_mask)
-    p[sft > 0] = 1.0 / (1.0 + r_s_p[sft > 0] / prior_yes - r_s_p[sft > 0])
-
-    space_mask_i = space_mask.astype(np.int)
-    dig_p = np.ones(space_mask.shape, np.uint8) * 4
-    dig_p[p >= 0.9] = 0
-    dig_p[np.logical_and(p >= 0.5, p < 0.9)] = 1
-    dig_p[np.logical_and(p > 0.1, p < 0.5)] = 2
-    dig_p[p <= 0.1] = 3
-    dig_p[space_mask_i == 1] = 126
+                      agri_clm_tif_path, fusion_engine='product',
+                      classifiers=None, ensemble=None, block_rows=None,
+                      compact=False):
+    """Cloud mask of a scene written as a tif.
+
+    Args:
+        classifiers (list): classifier names, the operational ensemble by default.
+        ensemble (NBEnsemble): a configured ensemble, overrides classifiers and fusion_engine.
+        block_rows (int): classify the disk this many rows at a time and write
+            each block as it is done, the same mask with less memory.
+        compact (bool): classify earth vectors instead of the disk, the same
+            mask with no work on space pixels.
+    """
+    if ensemble is None:
+        ensemble = NBEnsemble(classifiers, fusion_engine=fusion_engine)
+    if block_rows:
+        shape = FY4AAGRIL1FDIDISK4KM(agri_l1_file_path).get_shape()
+        dig_p = tiff.memmap(agri_clm_tif_path, shape=shape, dtype=np.uint8)
+        for rows, block in ensemble.classify_blocks(agri_l1_file_path, agri_geo_file_path, block_rows):
+            dig_p[rows] = block
+            dig_p.flush()
+        del dig_p
+        return 0
+    # fields are read on first use, NAV fields and products are shared by the
+    # scenes of a month; only the inputs of the enabled classifiers are loaded
+    scene = Scene(agri_l1_file_path, agri_geo_file_path, compact=compact)
+    # classifiers come from lut_registry, shared by all scenes of the month;
+    # each one is fused into one running product (or log sum) when done
+    dig_p = ensemble.classify(scene)
+    scene.clear()
     tiff.imwrite(agri_clm_tif_path, dig_p)
     return 0
 
 
-def main():
+def add_ensemble_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--fusion',
+                        type=str,
+                        default='product',
+                        choices=list(fusion_engines),
+                        help="fuse the classifiers as a product of ratios or a sum of log ratios.")
+    parser.add_argument('--classifiers',
+                        type=str,
+                        nargs='+',
+                        default=None,
+                        choices=list(get_classifier_registry()),
+                        metavar='NAME',
+                        help="classifiers of the ensemble, %s by default." % ' '.join(default_classifiers))
+    parser.add_argument('--day',
+                        action='store_true',
+                        help="add the daytime classifiers %s." % ' '.join(day_classifiers))
+    parser.add_argument('--workers',
+                        type=int,
+                        default=None,
+                        help="threads running the classifiers of a scene concurrently, "
+                             "1 or the configuration's by default.")
+    parser.add_argument('--block_rows',
+                        type=int,
+                        default=None,
+                        help="classify the disk this many rows at a time to bound memory.")
+    parser.add_argument('--compact',
+                        action='store_true',
+                        help="classify the earth pixels only, as 1-D vectors.")
+    parser.add_argument('--config',
+                        type=str,
+                        default=None,
+                        help="JSON ensemble configuration with keys classifiers, day, fusion, prior and workers.")
+
+
+def get_ensemble(args) -> NBEnsemble:
+    # --workers overrides the configuration's workers only when given
+    kwargs = {} if args.workers is None else {'workers': args.workers}
+    if args.config is not None:
+        return NBEnsemble.from_config(args.config, **kwargs)
+    return NBEnsemble.from_config({'classifiers': args.classifiers or default_classifiers,
+                                   'day': args.day, 'fusion': args.fusion}, **kwargs)
+
+
+def add_scene_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('sources',
+                        type=str,
+                        nargs='+',
+                        help="L1 and GEO files, directories, glob patterns or .txt file lists.")
+    parser.add_argument('--out',
+                        '-o',
+                        type=str,
+                        required=True,
+                        help="output directory of the cloud mask tifs.")
+    parser.add_argument('--start',
+                        type=str,
+                        default=None,
+                        help="first scene start time, 'YYYYmmdd_HHMM'.")
+    parser.add_argument('--end',
+                        type=str,
+                        default=None,
+                        help="end of the time range (exclusive), 'YYYYmmdd_HHMM'.")
+    add_ensemble_arguments(parser)
+
+
+def get_scenes(args) -> list:
+    from CloudMask_NB.batch import find_scenes, time_format
+    start = None if args.start is None else datetime.datetime.strptime(args.start, time_format)
+    end = None if args.end is None else datetime.datetime.strptime(args.end, time_format)
+    return find_scenes(args.sources, start, end)
+
+
+def batch_main(argv: list = None):
+    """Cloud masks of many scenes, ``CloudMask_NB batch``."""
+    from CloudMask_NB.batch import process_scenes, print_result
+    parser = argparse.ArgumentParser(prog='CloudMask_NB batch',
+                                     description="cloud masks of all the FY4A L1 scenes of the sources.")
+    add_scene_arguments(parser)
+    parser.add_argument('--scene_workers',
+                        type=int,
+                        default=1,
+                        help="scenes processed concurrently.")
+    args = parser.parse_args(argv)
+    results = process_scenes(get_scenes(args), args.out, get_ensemble(args), scene_workers=args.scene_workers,
+                             callback=print_result, block_rows=args.block_rows, compact=args.compact)
+    failed = [result for result in results if not result.ok]
+    print('%d scenes, %d failed' % (len(results), len(failed)))
+    return 1 if failed else 0
+
+
+def backfill_main(argv: list = None):
+    """Reprocessing of a long period on a pool of processes, ``CloudMask_NB backfill``."""
+    from CloudMask_NB.backfill import Backfill, print_record
+    parser = argparse.ArgumentParser(prog='CloudMask_NB backfill',
+                                     description="cloud masks of all the FY4A L1 scenes of the sources, "
+                                                 "one month per worker process, resumable.")
+    add_scene_arguments(parser)
+    parser.add_argument('--processes',
+                        type=int,
+                        default=None,
+                        help="worker processes, the number of CPUs by default.")
+    parser.add_argument('--max_shard_scenes',
+                        type=int,
+                        default=None,
+                        help="split a month in shards of at most this many scenes.")
+    parser.add_argument('--manifest',
+                        type=str,
+                        default=None,
+                        help="manifest of the done scenes, manifest.jsonl in the output directory by default.")
+    args = parser.parse_args(argv)
+    backfill = Backfill(args.out, get_ensemble(args), processes=args.processes,
+                        max_shard_scenes=args.max_shard_scenes, manifest_path=args.manifest,
+                        block_rows=args.block_rows, compact=args.compact)
+    summary = backfill.run(get_scenes(args), callback=print_record)
+    print('%(done)d done, %(failed)d failed, %(skipped)d skipped in %(seconds).0fs, '
+          '%(scenes_per_minute).1f scenes/min' % summary)
+    return 1 if summary['failed'] else 0
+
+
+def watch_main(argv: list = None):
+    """Cloud masks of the scenes arriving in a directory, ``CloudMask_NB watch``."""
+    from CloudMask_NB.watch import SceneWatcher, print_latency
+    parser = argparse.ArgumentParser(prog='CloudMask_NB watch',
+                                     description="watch a directory and classify each FY4A scene "
+                                                 "as soon as its L1 and GEO files arrived.")
+    parser.add_argument('in_dir',
+                        type=str,
+                        help="directory the L1 and GEO files arrive in, searched recursively.")
+    parser.add_argument('--out',
+                        '-o',
+                        type=str,
+                        required=True,
+                        help="output directory of the cloud mask tifs.")
+    parser.add_argument('--poll',
+                        type=float,
+                        default=2.0,
+                        help="seconds between two scans of the directory.")
+    parser.add_argument('--settle',
+                        type=float,
+                        default=1.0,
+                        help="seconds a file must be left unmodified before it is read.")
+    parser.add_argument('--scene_workers',
+                        type=int,
+                        default=1,
+                        help="scenes processed concurrently.")
+    add_ensemble_arguments(parser)
+    args = parser.parse_args(argv)
+    watcher = SceneWatcher(args.in_dir, args.out, get_ensemble(args), poll_interval=args.poll,
+                           settle=args.settle, scene_workers=args.scene_workers, callback=print_latency,
+                           block_rows=args.block_rows, compact=args.compact)
+    try:
+        watcher.run_forever()
+    except KeyboardInterrupt:
+        watcher.stop()
+    return 0
+
+
+def train_main(argv: list = None):
+    """LUTs of the 1-D classifiers from labelled scenes, ``CloudMask_NB train``."""
+    from CloudMask_NB.train import NBTrainer, read_train_list, print_scene
+    from CloudMask_NB.utils.disk_cache import DiskArrayCache
+    parser = argparse.ArgumentParser(prog='CloudMask_NB train',
+                                     description="histograms of the classifier features over the scenes of a "
+                                                 "training list labelled by CLM files, each scene read once "
+                                                 "for all surface types, written as LUTs.")
+    parser.add_argument('train_csv',
+                        type=str,
+                        help="CSV of the training scenes with l1, geo and clm columns.")
+    parser.add_argument('--out',
+                        '-o',
+                        type=str,
+                        required=True,
+                        help="output directory of the LUTs.")
+    parser.add_argument('--classifiers',
+                        type=str,
+                        nargs='+',
+                        default=None,
+                        choices=[name for name in get_classifier_registry() if name != 'GeoColorRGB'],
+                        metavar='NAME',
+                        help="classifiers to train, all the 1-D ones by default.")
+    parser.add_argument('--rows',
+                        type=int,
+                        nargs=2,
+                        default=(None, None),
+                        metavar=('START', 'STOP'),
+                        help="train on the rows START:STOP of the list only.")
+    parser.add_argument('--month',
+                        type=int,
+                        default=None,
+                        help="month of the LUTs to start from, that of the first scene by default.")
+    parser.add_argument('--data_ranges',
+                        action='store_true',
+                        help="bin each surface type between the extremes of its labelled pixels, "
+                             "found by a first sweep, instead of the bins of the current LUTs.")
+    parser.add_argument('--disk_cache',
+                        type=str,
+                        default=None,
+                        help="directory of an on disk cache of the decoded scenes.")
+    args = parser.parse_args(argv)
+    scenes = read_train_list(args.train_csv, *args.rows)
+    classifiers = args.classifiers or [name for name in get_classifier_registry() if name != 'GeoColorRGB']
+    disk_cache = None if args.disk_cache is None else DiskArrayCache(args.disk_cache)
+    ranges = None
+    if args.data_ranges:
+        ranges = NBTrainer(classifiers, month=args.month, disk_cache=disk_cache).fit(scenes).observed_ranges()
+    trainer = NBTrainer(classifiers, month=args.month, ranges=ranges, disk_cache=disk_cache)
+    trainer.fit(scenes, callback=print_scene)
+    os.makedirs(args.out, exist_ok=True)
+    for name in trainer.names:
+        trainer.to_lut(name).to_netcdf(os.path.join(args.out, trainer.get_lut_file_name(name)))
+    print('%d LUTs trained on %d scenes' % (len(trainer.names), trainer.n_scenes))
+    return 0
+
+
+subcommands = {'batch': batch_main, 'backfill': backfill_main, 'watch': watch_main, 'train': train_main}
+
+
+def main(argv: list = None):
     """Console script for metesatpy."""
-    parser = argparse.ArgumentParser()
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] and argv[0] in subcommands:
+        return subcommands[argv[0]](argv[1:])
+    parser = argparse.ArgumentParser(epilog="subcommands: %s, see CloudMask_NB <subcommand> -h."
+                                            % ', '.join(subcommands))
     parser.add_argument('agri_l1_file_path',
                         type=str,
                         help="input FY4A L1 HDF file.")
@@ -128,10 +282,13 @@ def main():
     parser.add_argument('agri_clm_tif_path',
                         type=str,
                         help="output FY4A CLM HDF file.")
-    args = parser.parse_args()
+    add_ensemble_arguments(parser)
+    args = parser.parse_args(argv)
     detect_cloud_mask(args.agri_l1_file_path, 
                       args.agri_geo_file_path,
-                      args.agri_clm_tif_path)
+                      args.agri_clm_tif_path,
+                      ensemble=get_ensemble(args),
+                      block_rows=args.block_rows, compact=args.compact)
     return 0
 
 
@@ -0,0 +1,238 @@
+"""Training of the naive Bayes classifier LUTs, all surface types in one sweep over the scenes."""
+import os
+import csv
+from collections import namedtuple
+
+import numpy as np
+import xarray as xr
+
+from CloudMask_NB.FY4A.Scene import Scene
+from CloudMask_NB.FY4A.Ensemble import get_classifier_class
+
+# an L1 file, its GEO file and the CLM file labelling the scene
+TrainFiles = namedtuple('TrainFiles', ['l1', 'geo', 'clm'])
+
+# CLM values of the two classes, in the order of the histogram's label axis
+labels = (('cloudy', 0), ('clear', 3))
+
+
+def read_train_list(csv_path: str, start: int = None, stop: int = None) -> list:
+    """Scenes of a training list, a CSV with 'l1', 'geo' and 'clm' columns, rows ``start:stop``."""
+    with open(csv_path, 'r', newline='') as f:
+        rows = list(csv.DictReader(f))
+    return [TrainFiles(row['l1'], row['geo'], row['clm']) for row in rows[start:stop]]
+
+
+def get_labels(clm: np.ma.masked_array) -> np.ndarray:
+    """Label index of the pixels, 0 cloudy and 1 clear, -1 for the other classes and no data."""
+    clm = np.ma.getdata(clm)
+    label = np.full(clm.shape, -1, np.int8)
+    for idx, (_, value) in enumerate(labels):
+        label[clm == value] = idx
+    return label
+
+
+class FeatureHistogram(object):
+    """Histograms of a 1-D classifier's feature, per surface type and class.
+
+    Each surface type has ``nbins`` equal bins between its range's ends,
+    binned as ``np.histogram`` does with the edges ``np.linspace(lo, hi,
+    nbins + 1)``: right open but the last one, values out of range are not
+    counted. The counts of all surface types and both classes are one table
+    updated by a single ``np.bincount`` on the (sft, label, bin) index.
+    """
+
+    def __init__(self, classifier, ranges=None):
+        super(FeatureHistogram, self).__init__()
+        self.classifier = classifier
+        lut_ds = classifier.lut_ds
+        self.n_sft = lut_ds['bin_start'].shape[0]
+        self.nbins = classifier.nbins
+        if ranges is None:
+            # the bins of the current LUT, the ones infer looks up
+            ranges = np.stack([lut_ds['bin_start'].data, lut_ds['bin_end'].data], axis=-1)
+        ranges = np.array(np.broadcast_to(np.asarray(ranges, np.float64), (self.n_sft, 2)))
+        # a single value gets a range of 1 around it, like np.histogram
+        point = ranges[:, 0] == ranges[:, 1]
+        ranges[point] += [-0.5, 0.5]
+        if np.any(ranges[:, 1] < ranges[:, 0]):
+            raise ValueError('empty feature range of %s: %s' % (classifier.short_name, ranges.tolist()))
+        self.edges = np.stack([np.linspace(lo, hi, self.nbins + 1) for lo, hi in ranges])
+        self.scale = self.nbins / (ranges[:, 1] - ranges[:, 0])
+        self.counts = np.zeros((self.n_sft, len(labels), self.nbins), np.int64)
+        # feature range of the labelled pixels, in or out of the bins, see observed_ranges
+        self.v_min = np.full(self.n_sft, np.inf)
+        self.v_max = np.full(self.n_sft, -np.inf)
+
+    def update(self, x: np.ma.masked_array, sft: np.ndarray, valid_mask: np.ndarray, label: np.ndarray):
+        """Count the valid, labelled pixels of a scene."""
+        sft = np.ma.getdata(sft).reshape(-1)
+        index = np.flatnonzero(np.logical_and(np.ma.getdata(valid_mask).reshape(-1), label.reshape(-1) >= 0)
+                               & (sft > 0))
+        if index.size == 0:
+            return self
+        s = sft[index].astype(np.intp) - 1  # sft start from 1
+        c = label.reshape(-1)[index].astype(np.intp)
+        # the feature value of a masked pixel, as infer bins it
+        v = np.ma.getdata(x).reshape(-1)[index].astype(np.float64)
+        self._update_range(s, v)
+        keep = np.flatnonzero((v >= self.edges[:, 0][s]) & (v <= self.edges[:, -1][s]))
+        s, c, v = s[keep], c[keep], v[keep]
+        b = ((v - self.edges[:, 0][s]) * self.scale[s]).astype(np.intp)
+        np.minimum(b, self.nbins - 1, out=b)
+        # the computed bin can be one off at an edge, compare to the edges like np.histogram;
+        # indexes in the flattened edges, (nbins + 1) per surface type
+        e = s * (self.nbins + 1) + b
+        flat_edges = self.edges.reshape(-1)
+        b[v < flat_edges[e]] -= 1
+        b[(v >= flat_edges[e + 1]) & (b != self.nbins - 1)] += 1
+        self.counts += np.bincount((s * len(labels) + c) * self.nbins + b,
+                                   minlength=self.counts.size).reshape(self.counts.shape)
+        return self
+
+    def _update_range(self, s: np.ndarray, v: np.ndarray):
+        # grouped by surface type with a stable (radix) sort of the small integer sft
+        order = np.argsort(s.astype(np.uint8), kind='stable')
+        n = np.bincount(s, minlength=self.n_sft)
+        present = np.flatnonzero(n)
+        starts = (np.cumsum(n) - n)[present]
+        v = v[order]
+        # fmin and fmax skip NaN
+        np.fmin.at(self.v_min, present, np.fmin.reduceat(v, starts))
+        np.fmax.at(self.v_max, present, np.fmax.reduceat(v, starts))
+
+    def observed_ranges(self) -> np.ndarray:
+        """(min, max) feature value of the labelled pixels per surface type, NaN where none was seen.
+
+        The training scripts bin each surface type between these, pass them as
+        ``ranges`` to a second sweep to get the same bins.
+        """
+        ranges = np.stack([self.v_min, self.v_max], axis=-1)
+        ranges[~np.isfinite(ranges).all(axis=-1)] = np.nan
+        return ranges
+
+    def to_lut(self):
+        """LUT of the classifier from the counts, surface types with an empty class keep the current LUT.
+
+        Returns:
+            lut_ds (xarray.Dataset): a copy of the classifier's LUT with new
+                prior_yes, bin_start, bin_end, delta_bin, bins and class_cond_ratio_reg.
+        """
+        lut_ds = self.classifier.lut_ds.copy(deep=True)
+        cloudy = self.counts[:, 0].astype(np.float64)
+        clear = self.counts[:, 1].astype(np.float64)
+        cloudy_sum = cloudy.sum(axis=-1)
+        clear_sum = clear.sum(axis=-1)
+        trained = np.flatnonzero((cloudy_sum > 0) & (clear_sum > 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            prior_yes = cloudy_sum / (cloudy_sum + clear_sum)
+            condition_no = clear / clear_sum[:, None]
+            condition_yea = cloudy / cloudy_sum[:, None]
+        ratio = condition_no / (condition_yea + 1e-5)
+        edges = self.edges
+        for name, value in (('prior_yes', prior_yes), ('bin_start', edges[:, 0]), ('bin_end', edges[:, -1]),
+                            ('delta_bin', edges[:, 1] - edges[:, 0]), ('bins', edges[:, 1:]),
+                            (self.classifier.ratio_name, ratio)):
+            lut_ds[name].data[trained] = value[trained]
+        return lut_ds
+
+
+class NBTrainer(object):
+    """Histograms of the features of naive Bayes classifiers over labelled scenes, and their LUTs.
+
+    A scene is read once for all the classifiers: their inputs are read
+    together, each feature and valid mask is prepared once, and the
+    histograms of all the surface types and both classes (CLM cloudy and
+    clear) are updated at once, see FeatureHistogram.
+
+    The bins have to be known before the first scene: by default they are the
+    ones of the classifier's current LUT, ``ranges`` (a (lo, hi) pair or one
+    per surface type, by short name) sets others.
+
+    Examples:
+        >>> trainer = NBTrainer(['T_11', 'Btd_11_85'], disk_cache=DiskArrayCache('/data/cache'))
+        >>> trainer.fit(read_train_list('train.csv', 40, 100))
+        >>> trainer.to_lut('T_11').to_netcdf('T_11_60.nc')
+    """
+
+    def __init__(self, classifiers: list, month: int = None, ranges: dict = None, disk_cache=None, **kwargs):
+        super(NBTrainer, self).__init__()
+        self.classifiers = list(classifiers)
+        # month of the NetCDF LUTs the classifiers start from, that of the first scene by default
+        self.month = month
+        self.ranges = ranges or {}
+        self.disk_cache = disk_cache
+        self.scene_kwargs = kwargs  # passed on to Scene, e.g. dtype
+        self.histograms = None
+        self.lut_month = None  # month of the LUTs trained
+        self.n_scenes = 0
+
+    def _init_histograms(self, month: int):
+        self.lut_month = month if self.month is None else self.month
+        classifiers = []
+        for classifier in self.classifiers:
+            if isinstance(classifier, str):
+                classifier = get_classifier_class(classifier)
+            if isinstance(classifier, type) or not isinstance(classifier.lut_ds, xr.Dataset):
+                # from the NetCDF LUT, the form trained LUTs are written in, not a compiled
+                # bundle's table (see LUTBundle) the LUT registry would hand out
+                cls = classifier if isinstance(classifier, type) else type(classifier)
+                classifier = cls(lut_file_path=cls.get_lut_path(self.lut_month))
+            if 'bin_start' not in classifier.lut_ds:
+                raise ValueError('%s is not a 1-D classifier, it can not be trained' % classifier.short_name)
+            classifiers.append(classifier)
+        self.histograms = {classifier.short_name: FeatureHistogram(classifier, self.ranges.get(
+            classifier.short_name, None)) for classifier in classifiers}
+
+    @property
+    def names(self) -> list:
+        return list(self.histograms or ())
+
+    def update(self, scene: Scene):
+        """Add the labelled pixels of a scene, a Scene with a CLM file."""
+        if self.histograms is None:
+            self._init_histograms(scene.month)
+        names = ['sft', 'clm']
+        for histogram in self.histograms.values():
+            names.extend(name for name in histogram.classifier.required_inputs() if name not in names)
+        scene.prefetch(names)
+        sft = scene.sft
+        label = get_labels(scene.clm)
+        for histogram in self.histograms.values():
+            x, valid_mask = histogram.classifier.prepare(scene)
+            histogram.update(x, sft, valid_mask, label)
+        self.n_scenes += 1
+        return self
+
+    def fit(self, scenes: list, callback=None):
+        """Add the scenes, TrainFiles (or Scene instances), each read once.
+
+        Args:
+            scenes (list): the labelled scenes, see read_train_list.
+            callback: called with the files of each scene once added, e.g. to report progress.
+        """
+        for files in scenes:
+            if isinstance(files, Scene):
+                scene = files
+            else:
+                scene = Scene(files.l1, files.geo, files.clm, disk_cache=self.disk_cache, **self.scene_kwargs)
+            self.update(scene)
+            scene.clear()
+            if callback is not None:
+                callback(files)
+        return self
+
+    def observed_ranges(self) -> dict:
+        """Short name -> feature range per surface type of the scenes so far, see FeatureHistogram."""
+        return {name: histogram.observed_ranges() for name, histogram in self.histograms.items()}
+
+    def to_lut(self, name: str):
+        """LUT of classifier ``name`` trained on the scenes so far, see FeatureHistogram.to_lut."""
+        return self.histograms[name].to_lut()
+
+    def get_lut_file_name(self, name: str) -> str:
+        return self.histograms[name].classifier.lut_file_name % self.lut_month
+
+
+def print_scene(files: TrainFiles):
+    print('%s added' % os.path.basename(files.l1))
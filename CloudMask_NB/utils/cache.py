@@ -0,0 +1,126 @@
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from .conv import cal_nxn_indices
+from .filters import get_filter_name
+
+
+def array_nbytes(array) -> int:
+    """Memory held by an array, including the mask of a masked array."""
+    nbytes = np.ma.getdata(array).nbytes
+    mask = np.ma.getmask(array)
+    if mask is not np.ma.nomask:
+        nbytes += mask.nbytes
+    return nbytes
+
+
+class NeighborhoodCache(object):
+    """Per scene cache of (2n+1)x(2n+1) window statistics.
+
+    Entries are keyed by ``(band, n, statistic)`` and remember the array they
+    were computed from, so a different array passed under the same band name
+    is recomputed instead of served stale. The least recently used entries are
+    evicted once ``max_bytes`` is exceeded.
+
+    The cache lives as long as the scene it serves: use it as a context
+    manager or call :meth:`clear` once the scene is done.
+
+    Examples:
+        >>> with NeighborhoodCache() as cache:
+        ...     x = tstd.prepare_feature(bt_1080, cache=cache)
+        ...     valid_mask = ref_ratio_day.prepare_valid_mask(..., cache=cache)
+    """
+
+    def __init__(self, max_bytes: int = 2 * 1024 ** 3):
+        super(NeighborhoodCache, self).__init__()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (source weakref, statistic array)
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    @staticmethod
+    def make_key(band: str, n: int, func) -> tuple:
+        name = get_filter_name(func)
+        if name is None:
+            name = getattr(func, '__name__', repr(func))
+        return band, int(n), name
+
+    def get(self, band: str, array: np.ndarray, n: int = 1, func=np.max) -> np.ma.masked_array:
+        """Window statistic of ``array``, computed with ``cal_nxn_indices`` on first use.
+
+        Args:
+            band (str): name of the band ``array`` holds, e.g. 'bt_1080'.
+            array (numpy.ndarray): the band data.
+            n (int): half size of the window.
+            func: statistic function or name, see ``cal_nxn_indices``.
+
+        Returns:
+            array_indices (numpy.ma.masked_array): statistic array.
+        """
+        key = self.make_key(band, n, func)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # one lock per key: concurrent callers of the same statistic wait for a
+        # single computation, different statistics are computed in parallel
+        with key_lock:
+            with self._lock:
+                value = self._lookup(key, array)
+                if value is not None:
+                    self.hits += 1
+                    return value
+                self.misses += 1
+            value = cal_nxn_indices(array, n, func)
+            with self._lock:
+                self._store(key, array, value)
+            return value
+
+    def _lookup(self, key, array):
+        entry = self._entries.get(key, None)
+        if entry is None:
+            return None
+        source, value = entry
+        if source() is not array:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key, array, value):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (weakref.ref(array), value)
+        self._nbytes += array_nbytes(value)
+        while self._nbytes > self.max_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        _, value = self._entries.pop(key)
+        self._nbytes -= array_nbytes(value)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._key_locks.clear()
+            self._nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.clear()
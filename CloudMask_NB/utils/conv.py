@@ -1,6 +1,8 @@
 import numpy
 import six
 
+from .filters import get_filter_name, nxn_filter
+
 
 def get_conv_outsize(size, k, s, p, cover_all=False, d=1):
     """Calculates output size of convolution.
@@ -97,8 +99,16 @@ def cal_nxn_indices(array: numpy.ndarray, n: int = 1, func=numpy.max) -> numpy.n
 
     Returns:
         array_indices (numpy.ndarray): 统计指数数组.
+
+    min/max/mean/std 使用 :mod:`CloudMask_NB.utils.filters` 中的滑动窗口算法,
+    其余统计函数仍使用 im2col 展开计算.
     """
+    if get_filter_name(func) is not None:
+        return nxn_filter(array, n, func)
+    array = numpy.ma.asarray(array)
+    mask = numpy.ma.getmaskarray(array)
     array = array[numpy.newaxis, numpy.newaxis]
+    mask = mask[numpy.newaxis, numpy.newaxis]
     k_h = 2 * n + 1
     k_w = 2 * n + 1
     p_h = n
@@ -107,7 +117,7 @@ def cal_nxn_indices(array: numpy.ndarray, n: int = 1, func=numpy.max) -> numpy.n
     s_w = 1
 
     col = im2col_cpu(array, k_h, k_w, s_h, s_w, p_h, p_w, pval=65535)
-    col_m = im2col_cpu(array.mask, k_h, k_w, s_h, s_w, p_h, p_w, pval=True)
+    col_m = im2col_cpu(mask, k_h, k_w, s_h, s_w, p_h, p_w, pval=True)
 
     array_indices = numpy.ma.masked_array(col, col_m)
     array_indices = func(array_indices, (0, 1, 2, 3))
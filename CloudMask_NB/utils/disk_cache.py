@@ -0,0 +1,213 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+import numpy as np
+
+meta_name = 'source.json'
+
+
+class DiskArrayCache(object):
+    """On disk cache of the arrays decoded from source files, served memory mapped.
+
+    The arrays of a source file (the calibrated bands of an L1 file, the
+    angles of a GEO file, the labels of a CLM file) are saved as uncompressed
+    .npy files in a directory of their own, the mask of a masked array next to
+    its data, the first time they are decoded. Afterwards they are mapped
+    read-only from the disk, no copy is made and nothing is decoded again.
+
+    The directory of a source is dropped when the source's mtime or size
+    changed. Once the cache holds more than ``max_bytes`` the least recently
+    used sources are evicted whole. The bytes held are counted as arrays are
+    saved, the directories are scanned again only when the count is over
+    ``max_bytes``.
+
+    Examples:
+        >>> disk_cache = DiskArrayCache('/data/cache/scenes', max_bytes=100 * 1024 ** 3)
+        >>> scene = Scene(l1_file_path, geo_file_path, clm_file_path, disk_cache=disk_cache)
+        >>> scene.bt_1080  # decoded on the first run, mapped from the cache on the next ones
+    """
+
+    def __init__(self, root: str, max_bytes: int = 32 * 1024 ** 3):
+        super(DiskArrayCache, self).__init__()
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # running total of the bytes held, seeded by the first put; what other processes save
+        # is not counted, the scan of evict sets it right
+        self._nbytes = None
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def _stat(source_path: str) -> dict:
+        st = os.stat(source_path)
+        return {'source': os.path.abspath(source_path), 'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+    def entry_dir(self, source_path: str) -> str:
+        """Directory of the arrays of a source file."""
+        path = os.path.abspath(source_path)
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.root, '%s-%s' % (os.path.basename(path), digest))
+
+    def _open_entry(self, source_path: str) -> str:
+        # the directory of a source, emptied when the source changed
+        entry_dir = self.entry_dir(source_path)
+        meta_path = os.path.join(entry_dir, meta_name)
+        stat = self._stat(source_path)
+        with self._lock:
+            try:
+                with open(meta_path, 'r') as f:
+                    meta = json.load(f)
+            except (IOError, ValueError):
+                meta = None
+            if meta != stat:
+                nbytes = -self._dir_bytes(entry_dir)
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.makedirs(entry_dir, exist_ok=True)
+                tmp_path = meta_path + '.%d.tmp' % os.getpid()
+                with open(tmp_path, 'w') as f:
+                    json.dump(stat, f)
+                    nbytes += f.tell()
+                os.replace(tmp_path, meta_path)
+                if self._nbytes is not None:
+                    self._nbytes += nbytes
+            else:
+                os.utime(meta_path)  # recently used, see evict
+        return entry_dir
+
+    @staticmethod
+    def _dir_bytes(entry_dir: str) -> int:
+        try:
+            return sum(f.stat().st_size for f in os.scandir(entry_dir))
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def _paths(entry_dir: str, key: str) -> tuple:
+        return os.path.join(entry_dir, key + '.npy'), os.path.join(entry_dir, key + '.mask.npy')
+
+    def _load(self, entry_dir: str, key: str):
+        data_path, mask_path = self._paths(entry_dir, key)
+        if not os.path.exists(data_path):
+            return None
+        data = np.load(data_path, mmap_mode='r')
+        if data.ndim == 0:
+            return data[()]  # a numpy scalar
+        if not os.path.exists(mask_path):
+            return data
+        return np.ma.masked_array(data, np.load(mask_path, mmap_mode='r'))
+
+    @staticmethod
+    def _save(path: str, array: np.ndarray) -> int:
+        # written aside and renamed, a reader never maps a partial file; returns the bytes written
+        tmp_path = path + '.%d.%d.tmp' % (os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+            nbytes = f.tell()
+        os.replace(tmp_path, path)
+        return nbytes
+
+    @staticmethod
+    def _size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def contains(self, source_path: str, key: str) -> bool:
+        """Whether ``key`` of a source is cached and up to date."""
+        return os.path.exists(self._paths(self._open_entry(source_path), key)[0])
+
+    def put(self, source_path: str, key: str, value):
+        """Save an array (or numpy scalar) of a source, other values are not cached; returns ``value``."""
+        if not isinstance(value, (np.ndarray, np.generic)):
+            return value
+        if np.ndim(value) == 0 and np.ma.getmask(value) is not np.ma.nomask:
+            return value  # the masked constant
+        entry_dir = self._open_entry(source_path)
+        data_path, mask_path = self._paths(entry_dir, key)
+        # the files replaced are no longer held
+        nbytes = -self._size(data_path) - self._size(mask_path)
+        mask = np.ma.getmask(value)
+        if mask is not np.ma.nomask:
+            nbytes += self._save(mask_path, mask)
+        elif os.path.exists(mask_path):
+            os.remove(mask_path)
+        # the data last, it marks the entry as complete
+        nbytes += self._save(data_path, np.asarray(np.ma.getdata(value)))
+        with self._lock:
+            if self._nbytes is None:
+                self._nbytes = sum(entry_bytes for _, entry_bytes, _ in self._entries())
+            else:
+                self._nbytes += nbytes
+            over = self._nbytes > self.max_bytes
+        if over:
+            self.evict(keep=entry_dir)
+        return value
+
+    def get(self, source_path: str, key: str, loader):
+        """Array ``key`` of a source, memory mapped from the cache or made by ``loader`` and saved.
+
+        Args:
+            source_path (str): the file the array is decoded from.
+            key (str): name of the array in the source, e.g. 'bt_1080.float32'.
+            loader: called without arguments to decode the array on a miss.
+
+        Returns:
+            value (numpy.ndarray): read-only memory map (a masked array of maps
+                for a masked array) on a hit, the value of ``loader`` on a miss.
+        """
+        value = self._load(self._open_entry(source_path), key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        return self.put(source_path, key, loader())
+
+    def _entries(self) -> list:
+        # (last use, bytes, directory) of the cached sources
+        entries = []
+        for entry in os.scandir(self.root):
+            if not entry.is_dir():
+                continue
+            nbytes = 0
+            last_use = 0
+            try:
+                for f in os.scandir(entry.path):
+                    st = f.stat()
+                    nbytes += st.st_size
+                    if f.name == meta_name:
+                        last_use = st.st_mtime
+            except FileNotFoundError:
+                continue  # evicted meanwhile by another process
+            entries.append((last_use, nbytes, entry.path))
+        return entries
+
+    @property
+    def nbytes(self) -> int:
+        return sum(nbytes for _, nbytes, _ in self._entries())
+
+    def evict(self, keep: str = None):
+        """Drop the least recently used sources until the cache holds at most ``max_bytes``."""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(nbytes for _, nbytes, _ in entries)
+            for _, nbytes, entry_dir in entries:
+                if total <= self.max_bytes:
+                    break
+                if entry_dir == keep:
+                    continue
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total -= nbytes
+            self._nbytes = total
+
+    def clear(self):
+        with self._lock:
+            for entry in os.scandir(self.root):
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            self._nbytes = 0
@@ -0,0 +1,33 @@
+import os
+import contextlib
+
+import numpy as np
+
+# float type of the decoded bands, features and classifier ratios, the fused
+# product and posterior are always accumulated in float64
+_float_dtype = np.dtype(os.getenv('CLOUDMASK_NB_DTYPE', 'float32'))
+
+
+def get_float_dtype() -> np.dtype:
+    return _float_dtype
+
+
+def set_float_dtype(dtype) -> np.dtype:
+    """Set the process wide float type, returns the previous one."""
+    global _float_dtype
+    previous = _float_dtype
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.floating):
+        raise ValueError('float dtype expected, got %s' % dtype)
+    _float_dtype = dtype
+    return previous
+
+
+@contextlib.contextmanager
+def float_dtype(dtype):
+    """Temporarily switch the float type, e.g. ``with float_dtype(np.float64): ...``."""
+    previous = set_float_dtype(dtype)
+    try:
+        yield get_float_dtype()
+    finally:
+        set_float_dtype(previous)
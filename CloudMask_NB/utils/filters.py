@@ -0,0 +1,176 @@
+import numpy as np
+
+
+def _as_data_and_valid(array: np.ndarray):
+    """Split a (masked) array into its raw data and a boolean valid mask."""
+    data = np.ma.getdata(array)
+    valid = ~np.ma.getmaskarray(array)
+    return data, valid
+
+
+def _sliding_pass(src: np.ndarray, n: int, ufunc, out: np.ndarray) -> np.ndarray:
+    """Reduce ``src`` over the 2n+1 neighbours along axis 0 into ``out``."""
+    if n == 0 or src.shape[0] < 2:
+        out[...] = src
+        return out
+    # first neighbour pair written straight into the output, no copy pass
+    ufunc(src[1:], src[:-1], out=out[1:])
+    out[0] = src[0]
+    ufunc(out[:-1], src[1:], out=out[:-1])
+    for s in range(2, min(n, src.shape[0] - 1) + 1):
+        ufunc(out[s:], src[:-s], out=out[s:])
+        ufunc(out[:-s], src[s:], out=out[:-s])
+    return out
+
+
+def _sliding_reduce(array: np.ndarray, n: int, ufunc) -> np.ndarray:
+    """Apply ``ufunc`` over a (2n+1)x(2n+1) window as two separable 1-D passes.
+
+    Out of bound neighbours are skipped, so no padded copy of the input is made
+    and only two frames are allocated whatever the window size.
+    """
+    rows = _sliding_pass(array.T, n, ufunc, np.empty_like(array).T).T
+    return _sliding_pass(rows, n, ufunc, np.empty_like(array))
+
+
+def _extreme_value(dtype: np.dtype, largest: bool):
+    if np.issubdtype(dtype, np.floating):
+        return np.inf if largest else -np.inf
+    if np.issubdtype(dtype, np.bool_):
+        return largest
+    info = np.iinfo(dtype)
+    return info.max if largest else info.min
+
+
+def nxn_count(array: np.ndarray, n: int = 1) -> np.ndarray:
+    """Number of valid (unmasked) pixels in the (2n+1)x(2n+1) window of each pixel.
+
+    Args:
+        array (numpy.ndarray): 2-D array, masked or not.
+        n (int): half size of the window.
+
+    Returns:
+        count (numpy.ndarray): unsigned integer array with the same shape as ``array``.
+    """
+    _, valid = _as_data_and_valid(array)
+    return _valid_count(valid, n)
+
+
+def _valid_count(valid: np.ndarray, n: int) -> np.ndarray:
+    # the smallest integer type holding (2n+1)^2 keeps the count passes cheap
+    dtype = np.min_scalar_type((2 * n + 1) ** 2)
+    return _sliding_reduce(valid.astype(dtype), n, np.add)
+
+
+def nxn_min(array: np.ndarray, n: int = 1) -> np.ma.masked_array:
+    """Minimum of the valid pixels in the (2n+1)x(2n+1) window of each pixel.
+
+    Pixels without any valid neighbour are masked.
+    """
+    data, valid = _as_data_and_valid(array)
+    big = _extreme_value(data.dtype, largest=True)
+    out = _sliding_reduce(np.where(valid, data, big), n, np.minimum)
+    return np.ma.masked_array(out, _valid_count(valid, n) == 0)
+
+
+def nxn_max(array: np.ndarray, n: int = 1) -> np.ma.masked_array:
+    """Maximum of the valid pixels in the (2n+1)x(2n+1) window of each pixel.
+
+    Pixels without any valid neighbour are masked.
+    """
+    data, valid = _as_data_and_valid(array)
+    small = _extreme_value(data.dtype, largest=False)
+    out = _sliding_reduce(np.where(valid, data, small), n, np.maximum)
+    return np.ma.masked_array(out, _valid_count(valid, n) == 0)
+
+
+def _nxn_moments(array: np.ndarray, n: int, second: bool):
+    data, valid = _as_data_and_valid(array)
+    # shift by (roughly) the mean of the valid pixels to keep the window sums small,
+    # which avoids cancellation in E[x^2] - E[x]^2 for brightness temperatures
+    step = max(1, min(data.shape) // 64)
+    sample = data[::step, ::step][valid[::step, ::step]]
+    if sample.size == 0:
+        sample = data[valid]
+    offset = float(sample.mean(dtype=np.float64)) if sample.size else 0.0
+    x = np.subtract(data, offset, dtype=np.float64)
+    np.copyto(x, 0, where=~valid)
+    count = _valid_count(valid, n)
+    empty = count == 0
+    count[empty] = 1
+    s1 = _sliding_reduce(x, n, np.add)
+    s1 /= count
+    s2 = None
+    if second:
+        np.multiply(x, x, out=x)
+        s2 = _sliding_reduce(x, n, np.add)
+        s2 /= count
+    return s1, s2, offset, empty
+
+
+def nxn_mean(array: np.ndarray, n: int = 1) -> np.ma.masked_array:
+    """Mean of the valid pixels in the (2n+1)x(2n+1) window of each pixel.
+
+    Computed in float64 like ``numpy.ma.mean``. Pixels without any valid
+    neighbour are masked.
+    """
+    mean, _, offset, empty = _nxn_moments(array, n, second=False)
+    mean += offset
+    return np.ma.masked_array(mean, empty)
+
+
+def nxn_std(array: np.ndarray, n: int = 1) -> np.ma.masked_array:
+    """Population standard deviation of the valid pixels in the (2n+1)x(2n+1) window.
+
+    Same as ``numpy.ma.std`` (ddof=0) over the window, computed in float64.
+    Pixels without any valid neighbour are masked.
+    """
+    mean, var, _, empty = _nxn_moments(array, n, second=True)
+    np.multiply(mean, mean, out=mean)
+    var -= mean
+    np.maximum(var, 0, out=var)
+    np.sqrt(var, out=var)
+    return np.ma.masked_array(var, empty)
+
+
+nxn_filters = {
+    'min': nxn_min,
+    'max': nxn_max,
+    'mean': nxn_mean,
+    'std': nxn_std,
+}
+
+_func_names = {
+    np.min: 'min', np.amin: 'min', np.ma.min: 'min',
+    np.max: 'max', np.amax: 'max', np.ma.max: 'max',
+    np.mean: 'mean', np.ma.mean: 'mean',
+    np.std: 'std', np.ma.std: 'std',
+}
+
+
+def get_filter_name(func) -> str:
+    """Name of the fast window filter matching a numpy reduction, None if unsupported."""
+    if isinstance(func, str):
+        return func if func in nxn_filters else None
+    try:
+        return _func_names.get(func, None)
+    except TypeError:  # unhashable callable
+        return None
+
+
+def nxn_filter(array: np.ndarray, n: int = 1, func='max') -> np.ma.masked_array:
+    """Mask-aware (2n+1)x(2n+1) window statistic of each pixel.
+
+    Args:
+        array (numpy.ndarray): 2-D array, masked pixels are ignored.
+        n (int): half size of the window.
+        func: one of 'min', 'max', 'mean', 'std' or the matching numpy function.
+
+    Returns:
+        array_indices (numpy.ma.masked_array): statistic array, masked where the
+            window holds no valid pixel.
+    """
+    name = get_filter_name(func)
+    if name is None:
+        raise ValueError('unsupported window statistic: %r' % (func,))
+    return nxn_filters[name](array, n)
@@ -0,0 +1,129 @@
+import os
+import threading
+import contextlib
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # optional, the NumPy code is used without it
+    numba = None
+
+backends = ('auto', 'numpy', 'numba')
+# 'auto' uses numba when it can be imported, the NumPy code otherwise
+_backend = os.getenv('CLOUDMASK_NB_BACKEND', 'auto')
+# a parallel kernel already runs on all cores, and numba's workqueue threading
+# layer must not be entered from two threads at once
+_launch_lock = threading.Lock()
+_threading_layer_checked = False
+
+
+def _check_threading_layer():
+    """Prefer the workqueue threading layer, before the first kernel launch and only if no layer was chosen.
+
+    Kernels are launched from worker threads (scenes, classifiers) and in
+    forked backfill processes: TBB can hang at exit after the former and GNU
+    OpenMP in the latter, the workqueue layer does neither. A layer set with
+    NUMBA_THREADING_LAYER or numba.config, or already started by other numba
+    code of the process, is left alone.
+    """
+    global _threading_layer_checked
+    if _threading_layer_checked:
+        return
+    _threading_layer_checked = True
+    from numba.np.ufunc import parallel
+    if numba.config.THREADING_LAYER == 'default' and not parallel._is_initialized:
+        numba.config.THREADING_LAYER = 'workqueue'
+
+
+def numba_available() -> bool:
+    return numba is not None
+
+
+def get_backend() -> str:
+    """Backend in effect, 'numba' or 'numpy'; numba falls back to NumPy when not importable."""
+    if _backend in ('auto', 'numba') and numba_available():
+        return 'numba'
+    return 'numpy'
+
+
+def set_backend(name: str) -> str:
+    """Set the process wide backend, 'auto', 'numpy' or 'numba', returns the previous one."""
+    global _backend
+    if name not in backends:
+        raise ValueError('unknown backend %s, available: %s' % (name, ', '.join(backends)))
+    previous = _backend
+    _backend = name
+    return previous
+
+
+@contextlib.contextmanager
+def backend(name: str):
+    """Temporarily switch the backend, e.g. ``with backend('numpy'): ...``."""
+    previous = set_backend(name)
+    try:
+        yield get_backend()
+    finally:
+        set_backend(previous)
+
+
+if numba is not None:
+    @numba.njit(parallel=True, error_model='numpy')
+    def _infer_ratio(x, x_mask, has_mask, sft, valid, bin_start, delta_bin, zero, flat_ratio, nbins,
+                     out, prior_yes, one, p, product):
+        # one pass over the pixels: binning, ratio lookup, posterior and product;
+        # every operation and its float type is the one of the NumPy code
+        for i in numba.prange(x.shape[0]):
+            if not valid[i]:
+                out[i] = 1
+                continue
+            s = np.intp(sft[i]) - 1  # sft start from 1
+            if has_mask and x_mask[i]:
+                # masked arithmetic keeps the feature value of a masked pixel
+                v = zero + x[i]
+            else:
+                v = (x[i] - bin_start[s]) / delta_bin[s]
+            # float to int64 as NumPy on x86, NaN and out of range become INT64_MIN
+            if v >= -9223372036854775808.0 and v < 9223372036854775808.0:
+                b = np.int64(v)
+            else:
+                b = np.int64(-9223372036854775807 - 1)
+            b = min(max(b, 1), nbins)  # bin_idx start from 1
+            r = flat_ratio[s * nbins + b - 1]
+            out[i] = r
+            if p.shape[0]:
+                p[i] = one / (one + r / prior_yes[s] - r)
+            if product.shape[0]:
+                product[i] *= r
+        return out
+
+
+def infer_ratio(x: np.ma.masked_array, sft: np.ndarray, valid_mask: np.ndarray, bin_start: np.ndarray,
+                delta_bin: np.ndarray, flat_ratio: np.ndarray, out: np.ndarray, prior_yes: np.ndarray = None,
+                p: np.ndarray = None, product: np.ndarray = None) -> np.ndarray:
+    """Ratio of a 1-D classifier written to ``out`` in one parallel loop, see NBClassifier.infer.
+
+    The probability is written to ``p`` and the ratio multiplied into
+    ``product`` in the same loop when given. All arrays but the tables have
+    the shape of x; out, p and product must be C contiguous.
+    """
+    nbins = flat_ratio.shape[0] // bin_start.shape[0]
+    x_mask = np.ma.getmask(x)
+    has_mask = x_mask is not np.ma.nomask
+    x_mask = np.ascontiguousarray(x_mask).reshape(-1) if has_mask else np.zeros(1, bool)
+    # the float type of the bin index, the one of x - bin_start / delta_bin
+    zero = np.result_type(x.dtype, bin_start.dtype, delta_bin.dtype).type(0)
+    if p is not None:
+        # 1.0 takes the float type of the ratio over prior like the NumPy scalar would
+        one = np.result_type(flat_ratio.dtype, prior_yes.dtype, 1.0).type(1.0)
+    else:
+        prior_yes, one = np.empty(1), 1.0
+    with _launch_lock:
+        _check_threading_layer()
+        _infer_ratio(np.ascontiguousarray(np.ma.getdata(x)).reshape(-1), x_mask, has_mask,
+                     np.ascontiguousarray(np.ma.getdata(sft)).reshape(-1),
+                     np.ascontiguousarray(np.ma.getdata(valid_mask)).reshape(-1),
+                     bin_start, delta_bin, zero, flat_ratio, nbins, out.reshape(-1), prior_yes, one,
+                     np.empty(0, out.dtype) if p is None else p.reshape(-1),
+                     np.empty(0) if product is None else product.reshape(-1))
+    return out
@@ -0,0 +1,239 @@
+import os
+import errno
+import shutil
+import asyncio
+import datetime
+import threading
+from queue import LifoQueue, Empty
+from contextlib import contextmanager
+
+# remote directory and file name of the FY4A products, formatted with the
+# scene start time and '{st}', '{et}' its start and end time stamps
+fy4a_remote_layout = {
+    'l1': ('/FY4/FY4A/AGRI/L1/FDI/DISK/%Y/%Y%m%d',
+           'FY4A-_AGRI--_N_DISK_1047E_L1-_FDI-_MULT_NOM_{st}_{et}_4000M_V0001.HDF'),
+    'geo': ('/FY4/FY4A/AGRI/L1/FDI/DISK/%Y/%Y%m%d',
+            'FY4A-_AGRI--_N_DISK_1047E_L1-_GEO-_MULT_NOM_{st}_{et}_4000M_V0001.HDF'),
+    'clm': ('/FY4/FY4A/AGRI/L2/CLM/DISK/NOM/%Y/%Y%m%d',
+            'FY4A-_AGRI--_N_DISK_1047E_L2-_CLM-_MULT_NOM_{st}_{et}_4000M_V0001.NC'),
+}
+
+
+def get_remote_path(product: str, start_time: datetime.datetime, layout: dict = None) -> str:
+    """Remote path of a product ('l1', 'geo' or 'clm') of the scene starting at ``start_time``."""
+    dir_format, name_format = (layout or fy4a_remote_layout)[product]
+    end_time = start_time + datetime.timedelta(minutes=14, seconds=59)
+    name = name_format.format(st=start_time.strftime('%Y%m%d%H%M%S'), et=end_time.strftime('%Y%m%d%H%M%S'))
+    return start_time.strftime(dir_format) + '/' + name
+
+
+def is_file_error(e: BaseException) -> bool:
+    """Whether an error is about the remote file (it does not exist) rather than the connection."""
+    return isinstance(e, FileNotFoundError) or getattr(e, 'errno', None) == errno.ENOENT
+
+
+class LocalBackend(object):
+    """Files of a local directory tree served like a remote server, for tests and mounted archives."""
+
+    def __init__(self, root: str = '/'):
+        super(LocalBackend, self).__init__()
+        self.root = root
+
+    def _local(self, remote_path: str) -> str:
+        return os.path.join(self.root, remote_path.lstrip('/'))
+
+    def size(self, remote_path: str) -> int:
+        return os.path.getsize(self._local(remote_path))
+
+    def open(self, remote_path: str, offset: int = 0):
+        f = open(self._local(remote_path), 'rb')
+        f.seek(offset)
+        return f
+
+    def close(self):
+        pass
+
+
+class SFTPBackend(object):
+    """One SFTP connection, made on first use (needs pysftp)."""
+
+    def __init__(self, host: str, username: str, password: str = None, port: int = 22, check_hostkeys: bool = False):
+        super(SFTPBackend, self).__init__()
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = port
+        self.check_hostkeys = check_hostkeys
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            import pysftp
+            cnopts = pysftp.CnOpts()
+            if not self.check_hostkeys:
+                cnopts.hostkeys = None
+            self._connection = pysftp.Connection(self.host, username=self.username, password=self.password,
+                                                 port=self.port, cnopts=cnopts)
+        return self._connection
+
+    def size(self, remote_path: str) -> int:
+        return self.connection.stat(remote_path).st_size
+
+    def open(self, remote_path: str, offset: int = 0):
+        f = self.connection.open(remote_path, 'rb')
+        f.seek(offset)
+        f.prefetch()  # pipelined reads from offset on, much faster than a request per chunk
+        return f
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class ConnectionPool(object):
+    """Thread safe pool of at most ``max_size`` reusable backend connections.
+
+    A connection is made by ``factory`` when none is idle and returned to the
+    pool after use, also after a file error (see is_file_error); a connection
+    that failed otherwise is closed and dropped, the next user gets a fresh one.
+
+    Examples:
+        >>> pool = ConnectionPool(lambda: SFTPBackend(host, username, password), max_size=4)
+        >>> with pool.connection() as backend:
+        ...     backend.size(remote_path)
+    """
+
+    def __init__(self, factory, max_size: int = 4):
+        super(ConnectionPool, self).__init__()
+        self.factory = factory
+        self.max_size = max_size
+        self.created = 0
+        self._idle = LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                backend = self._idle.get_nowait()
+            except Empty:
+                backend = self.factory()
+                self.created += 1
+            try:
+                yield backend
+            except BaseException as e:
+                if is_file_error(e):
+                    self._idle.put(backend)  # a missing file, the connection is fine
+                else:
+                    backend.close()
+                raise
+            self._idle.put(backend)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Fetcher(object):
+    """Concurrent, resumable downloads over a connection pool.
+
+    Downloads run as asyncio tasks, at most ``max_concurrency`` at a time, the
+    blocking transfers themselves in threads with a pooled connection each, so
+    connections are reused between files instead of one handshake per file.
+    A file is written to '<local path>.part' and renamed once complete; an
+    interrupted download continues from the size of its '.part' file, a file
+    already there with the remote size is not downloaded again.
+
+    Examples:
+        >>> fetcher = Fetcher(ConnectionPool(lambda: SFTPBackend(host, username, password)))
+        >>> results = fetcher.fetch_all([(get_remote_path('l1', start_time), local_path), ...])
+    """
+
+    def __init__(self, pool: ConnectionPool, max_concurrency: int = None, chunk_size: int = 1024 ** 2,
+                 retries: int = 2):
+        super(Fetcher, self).__init__()
+        self.pool = pool
+        self.max_concurrency = max_concurrency or pool.max_size
+        self.chunk_size = chunk_size
+        self.retries = retries
+
+    def _fetch(self, remote_path: str, local_path: str) -> str:
+        part_path = local_path + '.part'
+        with self.pool.connection() as backend:
+            size = backend.size(remote_path)
+            if os.path.exists(local_path) and os.path.getsize(local_path) == size:
+                return local_path
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if offset > size:
+                offset = 0  # not a part of this file
+            if offset < size:
+                with backend.open(remote_path, offset) as src, open(part_path, 'ab' if offset else 'wb') as dst:
+                    shutil.copyfileobj(src, dst, self.chunk_size)
+        if os.path.getsize(part_path) != size:
+            raise IOError('%s: got %d of %d bytes' % (remote_path, os.path.getsize(part_path), size))
+        os.replace(part_path, local_path)
+        return local_path
+
+    def fetch(self, remote_path: str, local_path: str) -> str:
+        """Download a file in the calling thread, retried ``retries`` times on connection errors.
+
+        A missing remote file raises FileNotFoundError at once, it is not retried.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+        for retry in range(self.retries):
+            try:
+                return self._fetch(remote_path, local_path)
+            except Exception as e:
+                if is_file_error(e):
+                    raise
+                # the connection was dropped, the next attempt resumes
+                print('%s: %r, retry %d of %d' % (remote_path, e, retry + 1, self.retries))
+        return self._fetch(remote_path, local_path)
+
+    async def afetch(self, remote_path: str, local_path: str, semaphore: asyncio.Semaphore = None) -> str:
+        if semaphore is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.fetch, remote_path, local_path)
+        async with semaphore:
+            return await asyncio.get_running_loop().run_in_executor(None, self.fetch, remote_path, local_path)
+
+    async def afetch_all(self, pairs: list) -> list:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return await asyncio.gather(*[self.afetch(remote_path, local_path, semaphore)
+                                      for remote_path, local_path in pairs], return_exceptions=True)
+
+    def fetch_all(self, pairs: list) -> list:
+        """Download (remote path, local path) pairs concurrently.
+
+        Returns:
+            results (list): local path of each pair, or the exception of a
+                failed download; one failure does not stop the others.
+        """
+        return asyncio.run(self.afetch_all(pairs))
+
+
+def get_scene_pairs(start_times: list, out_dir: str, products: tuple = ('l1', 'geo', 'clm'),
+                    layout: dict = None) -> list:
+    """(remote path, local path) pairs of the products of scenes.
+
+    ``out_dir`` is formatted with the start time of a scene, e.g. '/data/%Y%m%d'.
+    """
+    pairs = []
+    for start_time in start_times:
+        for product in products:
+            remote_path = get_remote_path(product, start_time, layout)
+            pairs.append((remote_path, os.path.join(start_time.strftime(out_dir), remote_path.split('/')[-1])))
+    return pairs
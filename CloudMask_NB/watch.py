@@ -0,0 +1,130 @@
+"""Near real time cloud masks of the scenes arriving in a directory."""
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from CloudMask_NB.FY4A.Ensemble import NBEnsemble
+from CloudMask_NB.batch import SceneFiles, get_time_key, get_start_time, get_output_path, \
+    is_l1_file, is_geo_file, warm_up, process_scene
+
+
+class SceneWatcher(object):
+    """Watch a directory for FY4A L1 and GEO files and classify each scene once both are there.
+
+    Files are recognised by the ``file_name_pattern`` of FY4AAGRIL1FDIDISK4KM
+    and FY4AAGRIL1GEODISK4KM and paired by the time fields of their names. A
+    file is taken as complete when it was not modified for ``settle`` seconds.
+    The ensemble, its LUTs and the NAV fields stay loaded between scenes, the
+    month's are loaded as soon as its first file is seen, so a scene only
+    costs its own compute time. The latency of a scene is the time from the
+    arrival of its last file (its mtime) to its written cloud mask.
+
+    Examples:
+        >>> watcher = SceneWatcher('/data/FY4A/incoming', '/data/NBCLM', NBEnsemble())
+        >>> watcher.run_forever()
+    """
+
+    def __init__(self, in_dir: str, out_dir: str, ensemble: NBEnsemble = None, poll_interval: float = 2.0,
+                 settle: float = 1.0, scene_workers: int = 1, callback=None, **kwargs):
+        super(SceneWatcher, self).__init__()
+        self.in_dir = in_dir
+        self.out_dir = out_dir
+        self.ensemble = NBEnsemble() if ensemble is None else ensemble
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.scene_workers = max(int(scene_workers), 1)
+        # called with the SceneResult and the latency in seconds of each scene
+        self.callback = callback
+        # passed on to detect_cloud_mask, e.g. block_rows or compact
+        self.kwargs = kwargs
+        self.pending = {}  # time key -> {'l1': path, 'geo': path}
+        self.done = set()  # time keys of the submitted scenes
+        self.warm_months = set()
+        self.latencies = deque(maxlen=1000)  # of the latest scenes
+        self._stop = threading.Event()
+
+    def scan(self) -> list:
+        """Scenes whose L1 and GEO files both arrived and settled, each returned once."""
+        for root, _, names in os.walk(self.in_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                kind = 'l1' if is_l1_file(path) else 'geo' if is_geo_file(path) else None
+                if kind is None:
+                    continue
+                key = get_time_key(path)
+                if key in self.done:
+                    continue
+                if kind == 'l1' and os.path.exists(get_output_path(path, self.out_dir)):
+                    self.done.add(key)  # classified before a restart
+                    self.pending.pop(key, None)
+                    continue
+                self.pending.setdefault(key, {})[kind] = path
+        now = time.time()
+        ready = []
+        for key in sorted(self.pending):
+            files = self.pending[key]
+            if 'l1' not in files or 'geo' not in files:
+                continue
+            try:
+                arrival = max(os.path.getmtime(files['l1']), os.path.getmtime(files['geo']))
+            except OSError:
+                continue  # moved away meanwhile
+            if now - arrival < self.settle:
+                continue
+            del self.pending[key]
+            self.done.add(key)
+            ready.append((SceneFiles(files['l1'], files['geo'], get_start_time(files['l1'])), arrival))
+        return ready
+
+    def warm_up(self, ready: list):
+        # a month is loaded as soon as one file of its first scene is seen, once
+        months = [get_start_time(list(files.values())[0]).month for files in self.pending.values()]
+        for month in [scene.start_time.month for scene, _ in ready] + months:
+            if month not in self.warm_months:
+                self.warm_months.add(month)
+                try:
+                    warm_up(self.ensemble, month)
+                except Exception as e:
+                    print(e, 'month %d' % month)
+
+    def process(self, scene: SceneFiles, arrival: float):
+        result = process_scene(scene, self.out_dir, self.ensemble, **self.kwargs)
+        latency = time.time() - arrival
+        self.latencies.append(latency)
+        if self.callback is not None:
+            self.callback(result, latency)
+        return result
+
+    def poll(self, executor: ThreadPoolExecutor = None) -> list:
+        """One scan, the ready scenes are classified, on ``executor`` if given.
+
+        Returns:
+            results (list): SceneResult of the scenes processed in the calling
+                thread, futures of those submitted to ``executor``.
+        """
+        os.makedirs(self.out_dir, exist_ok=True)
+        ready = self.scan()
+        self.warm_up(ready)
+        if executor is None:
+            return [self.process(scene, arrival) for scene, arrival in ready]
+        return [executor.submit(self.process, scene, arrival) for scene, arrival in ready]
+
+    def run_forever(self):
+        """Poll every ``poll_interval`` seconds until stop is called."""
+        with ThreadPoolExecutor(max_workers=self.scene_workers, thread_name_prefix='nb-watch') as executor:
+            while not self._stop.is_set():
+                self.poll(executor)
+                self._stop.wait(self.poll_interval)
+
+    def stop(self):
+        self._stop.set()
+
+
+def print_latency(result, latency: float):
+    if result.ok:
+        print('%s done, compute %.1fs, latency %.1fs -> %s'
+              % (os.path.basename(result.scene.l1), result.seconds, latency, result.out))
+    else:
+        print('%s failed after %.1fs\n%s' % (os.path.basename(result.scene.l1), latency, result.error))
@@ -0,0 +1,69 @@
+"""Time the table driven NBClassifier.infer against the per classifier bodies it replaced,
+with the NumPy backend and, if installed, the numba one.
+
+    python benchmarks/bench_infer.py --size 2748 --repeat 5
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from CloudMask_NB.FY4A.LUTBundle import get_classifier_classes  # noqa: E402
+from CloudMask_NB.FY4A.NavieBayes import GeoColorRGB  # noqa: E402
+from CloudMask_NB.utils import kernels  # noqa: E402
+from tests.synthetic import make_luts, reference_infer  # noqa: E402
+
+
+def best_of(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=2748, help="rows and columns of the disk.")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per timing, the best is kept.")
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    shape = (args.size, args.size)
+    sft = rng.integers(0, 8, shape).astype(np.uint8)
+    space_mask = rng.random(shape) < 0.2
+    valid_mask = (sft > 0) & ~space_mask
+    with tempfile.TemporaryDirectory() as root:
+        make_luts(root)
+        os.environ['METEPY_DATA_PATH'] = root
+        print('%-18s %10s %10s %8s %10s %8s' % ('classifier', 'legacy ms', 'kernel ms', 'speedup', 'numba ms', 'speedup'))
+        for cls in get_classifier_classes():
+            if cls is GeoColorRGB:
+                continue
+            classifier = cls(lut_file_path=cls.get_lut_path(1))
+            bin_start = classifier.lut_ds['bin_start'].data[0]
+            bin_end = classifier.lut_ds['bin_end'].data[0]
+            x = np.ma.masked_array(rng.uniform(bin_start, bin_end, shape), space_mask).astype(np.float32)
+            out = np.empty(shape, classifier.dtype)
+            r = classifier.infer(x, sft, valid_mask, space_mask, out=out)
+            np.testing.assert_array_equal(r, reference_infer(classifier, x, sft, valid_mask, space_mask.copy()))
+            legacy = best_of(lambda: reference_infer(classifier, x, sft, valid_mask, space_mask.copy()), args.repeat)
+            with kernels.backend('numpy'):
+                kernel = best_of(lambda: classifier.infer(x, sft, valid_mask, space_mask, out=out), args.repeat)
+            line = '%-18s %10.1f %10.1f %7.1fx' % (cls.short_name, legacy * 1e3, kernel * 1e3, legacy / kernel)
+            if kernels.numba_available():
+                with kernels.backend('numba'):
+                    classifier.infer(x, sft, valid_mask, space_mask, out=out)  # compiled on first call
+                    compiled = best_of(lambda: classifier.infer(x, sft, valid_mask, space_mask, out=out), args.repeat)
+                line += ' %10.1f %7.1fx' % (compiled * 1e3, legacy / compiled)
+            print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
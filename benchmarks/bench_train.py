@@ -0,0 +1,67 @@
+"""Time the single sweep NBTrainer against the training scripts' loop, one sweep over the
+scenes per surface type, on synthetic labelled scenes.
+
+    python benchmarks/bench_train.py --size 1000 --scenes 3
+"""
+import os
+import sys
+import time
+import argparse
+import datetime
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from CloudMask_NB.FY4A.Scene import Scene  # noqa: E402
+from CloudMask_NB.train import NBTrainer, TrainFiles, labels  # noqa: E402
+from tests.synthetic import make_scene  # noqa: E402
+
+
+def per_sft_counts(histogram, scenes: list) -> np.ndarray:
+    # the loop of scripts/nb_model_train_*.py: every scene read and prepared once per surface type
+    counts = np.zeros_like(histogram.counts)
+    for sft_idx in range(counts.shape[0]):
+        for files in scenes:
+            scene = Scene(files.l1, files.geo, files.clm)
+            x, valid_mask = histogram.classifier.prepare(scene)
+            sft_valid_mask = np.logical_and(valid_mask, scene.sft == sft_idx + 1)
+            fea = np.ma.getdata(x)[sft_valid_mask]
+            label = np.ma.getdata(scene.clm)[sft_valid_mask]
+            for label_idx, (_, value) in enumerate(labels):
+                counts[sft_idx, label_idx] += np.histogram(fea[label == value], bins=histogram.edges[sft_idx])[0]
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1000, help="rows and columns of the disk.")
+    parser.add_argument('--scenes', type=int, default=3, help="labelled scenes trained on.")
+    parser.add_argument('--classifiers', type=str, nargs='+', default=['T_11', 'Btd_11_85', 'TStd'])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as root:
+        scenes = [make_scene(root, (args.size, args.size), datetime.datetime(2020, 1, 1, hour), seed=hour)
+                  for hour in range(args.scenes)]
+        os.environ['METEPY_DATA_PATH'] = root
+        scenes = [TrainFiles(paths['l1'], paths['geo'], paths['clm']) for paths in scenes]
+        print('%-12s %10s %10s %8s' % ('classifier', 'loop s', 'sweep s', 'speedup'))
+        with np.errstate(all='ignore'):
+            NBTrainer(args.classifiers).fit(scenes[:1])  # NAV fields and LUTs loaded once
+            for name in args.classifiers:
+                t0 = time.perf_counter()
+                trainer = NBTrainer([name]).fit(scenes)
+                sweep = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                counts = per_sft_counts(trainer.histograms[name], scenes)
+                loop = time.perf_counter() - t0
+                np.testing.assert_array_equal(trainer.histograms[name].counts, counts)
+                print('%-12s %10.2f %10.2f %7.1fx' % (name, loop, sweep, loop / sweep))
+            t0 = time.perf_counter()
+            NBTrainer(args.classifiers).fit(scenes)
+            print('%-12s %10s %10.2f' % ('all at once', '', time.perf_counter() - t0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
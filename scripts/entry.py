@@ -22,10 +22,7 @@ def detect_cloud_mask(agri_l1_file_path, agri_geo_file_path, agri_clm_tif_path):
 
     fy4_nav = FY4NavFile(fy4_nav_file_path)
 
-    snow_mask = fy4_nav.get_snow_mask()
-    snow_mask = snow_mask == 3
-    pix_lat = fy4_nav.get_latitude()
-    pix_lon = fy4_nav.get_longitude()
+    # only the NAV fields the classifiers below use are read
     dem = fy4_nav.get_dem()
     sft = fy4_nav.prepare_surface_type_to_cspp()
     coastal = fy4_nav.get_coastal()
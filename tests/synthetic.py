@@ -0,0 +1,222 @@
+"""Small synthetic FY4A AGRI scene (L1, GEO, NAV, LUT) for tests without the real data."""
+import os
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+import h5py
+import numpy as np
+import xarray as xr
+import tifffile as tiff
+
+l1_file_name = 'FY4A-_AGRI--_N_DISK_1047E_L1-_FDI-_MULT_NOM_{st}_{et}_4000M_V0001.HDF'
+geo_file_name = 'FY4A-_AGRI--_N_DISK_1047E_L1-_GEO-_MULT_NOM_{st}_{et}_4000M_V0001.HDF'
+clm_file_name = 'FY4A-_AGRI--_N_DISK_1047E_L2-_CLM-_MULT_NOM_{st}_{et}_4000M_V0001.NC'
+nav_file_name = 'fygatNAV.FengYun-4A.xxxxxxx.4km_M%.2d.h5'
+
+cspp_sft = ['Deep_Ocean', 'Shallow_Ocean', 'Unfrozen_Land', 'Snow_Covered_Land',
+            'Arctic', 'Antarctic', 'Desert']
+
+# feature range of each 1-D classifier LUT
+lut_ranges = {
+    'Ref_063_Min_3x3_Day': (0, 20),
+    'T_Std': (0, 5),
+    'Btd_11_85': (-5, 15),
+    'Ref_Ratio_Day': (0, 2),
+    'Ref_138_Day': (0, 20),
+    'Ndsi_Day': (-1, 1),
+    'Ref_063_Day': (-20, 60),
+    'T_11': (180, 320),
+    'Tmax_T': (0, 10),
+    'Btd_375_11_Night': (-10, 30),
+    'Ref_Std': (0, 10),
+    'Emiss_375_Day': (0, 3),
+    'Emiss_375_Night': (0, 3),
+}
+
+
+def scene_times(start_time: datetime.datetime):
+    end_time = start_time + datetime.timedelta(minutes=14, seconds=59)
+    return start_time.strftime('%Y%m%d%H%M%S'), end_time.strftime('%Y%m%d%H%M%S')
+
+
+def write_nav(path, shape, rng):
+    h, w = shape
+    yy, xx = np.mgrid[0:h, 0:w]
+    r = np.hypot((yy - (h - 1) / 2) / (h / 2), (xx - (w - 1) / 2) / (w / 2))
+    space = (r > 0.98).astype(np.uint8)
+    lat = (90 - 180 * (yy + 0.5) / h).astype(np.float32)
+    lon = (104.7 - 80 + 160 * (xx + 0.5) / w).astype(np.float32)
+    lat[space == 1] = -999.0
+    lon[space == 1] = -999.0
+    land = rng.integers(0, 8, shape).astype(np.int8)
+    land[space == 1] = -1
+    snow = rng.choice([1, 1, 1, 2, 3], shape).astype(np.int8)
+    snow[space == 1] = -1
+    desert = rng.choice([0, 0, 0, 0, 1, 2], shape).astype(np.int8)
+    desert[space == 1] = 0
+    with h5py.File(path, 'w') as f:
+        f['pixel_latitude'] = lat
+        f['pixel_longitude'] = lon
+        f['pixel_land_mask'] = land
+        f['pixel_snow_mask'] = snow
+        f['pixel_desert_mask'] = desert
+        f['pixel_surface_elevation'] = rng.integers(-10, 4000, shape).astype(np.int16)
+        f['pixel_coast_mask'] = (rng.random(shape) < 0.1).astype(np.int8)
+        f['pixel_space_mask'] = space
+        f['pixel_ecosystem_type'] = rng.integers(0, 20, shape).astype(np.int8)
+    return space.astype(bool)
+
+
+def write_l1(path, shape, space, rng):
+    with h5py.File(path, 'w') as f:
+        for c in range(1, 15):
+            dn = rng.integers(0, 4096, shape).astype(np.uint16)
+            # smooth, spatially correlated DN so that window statistics are meaningful
+            dn = ((dn.astype(np.int32) + np.roll(dn, 1, 0) + np.roll(dn, 1, 1)) // 3).astype(np.uint16)
+            dn[space] = 65535
+            dn[rng.random(shape) < 0.005] = 65534  # out of table, filtered as > 60000
+            ds = f.create_dataset('NOMChannel%.2d' % c, data=dn)
+            ds.attrs['Slope'] = np.float32(1.0)
+            ds.attrs['Intercept'] = np.float32(0.0)
+            ds.attrs['FillValue'] = np.uint16(65535)
+            if c <= 6:
+                table = np.linspace(0.0, 1.2, 4096, dtype=np.float32)
+            else:
+                table = np.linspace(350.0, 180.0, 4096, dtype=np.float32)
+            cal = f.create_dataset('CALChannel%.2d' % c, data=table)
+            cal.attrs['Slope'] = np.float32(1.0)
+            cal.attrs['Intercept'] = np.float32(0.0)
+
+
+def write_geo(path, shape, space, rng):
+    h, w = shape
+    yy, xx = np.mgrid[0:h, 0:w]
+    fields = {
+        'NOMSunZenith': 180.0 * xx / (w - 1),  # day on the west half, night on the east
+        'NOMSunGlintAngle': rng.random(shape) * 90,
+        'NOMSunAzimuth': rng.random(shape) * 360,
+        'NOMSatelliteZenith': 80.0 * np.hypot(yy - h / 2, xx - w / 2) / np.hypot(h / 2, w / 2),
+        'NOMSatelliteAzimuth': rng.random(shape) * 360,
+    }
+    with h5py.File(path, 'w') as f:
+        for name, data in fields.items():
+            data = data.astype(np.float32)
+            data[space] = 65535
+            ds = f.create_dataset(name, data=data)
+            ds.attrs['Slope'] = np.float32(1.0)
+            ds.attrs['Intercept'] = np.float32(0.0)
+            ds.attrs['FillValue'] = np.float32(65535)
+
+
+def write_clm(path, shape, space, rng):
+    # cloudy 0, probably cloudy 1, probably clear 2, clear 3, space 126 and no data 127
+    clm = rng.choice(np.array([0, 1, 2, 3, 127], np.uint8), shape, p=[0.4, 0.1, 0.1, 0.35, 0.05])
+    clm[space] = 126
+    with h5py.File(path, 'w') as f:
+        f['CLM'] = clm
+
+
+def write_lut(path, value_range, rng, nbins=100):
+    v_min, v_max = value_range
+    bins = np.linspace(v_min, v_max, nbins + 1)
+    ratio = np.exp(rng.normal(0, 1.5, (len(cspp_sft), nbins)))
+    ds = xr.Dataset({
+        'prior_yes': xr.DataArray(rng.uniform(0.3, 0.7, len(cspp_sft)), dims=['cspp_sft']),
+        'bin_start': xr.DataArray(np.full(len(cspp_sft), bins[0]), dims=['cspp_sft']),
+        'bin_end': xr.DataArray(np.full(len(cspp_sft), bins[-1]), dims=['cspp_sft']),
+        'delta_bin': xr.DataArray(np.full(len(cspp_sft), bins[1] - bins[0]), dims=['cspp_sft']),
+        'bins': xr.DataArray(np.tile(bins[1:], (len(cspp_sft), 1)), dims=['cspp_sft', 'cspp_bds']),
+        'class_cond_ratio_reg': xr.DataArray(ratio, dims=['cspp_sft', 'cspp_bds']),
+    }, coords={'cspp_sft': cspp_sft, 'cspp_bds': np.arange(nbins)})
+    ds.to_netcdf(path)
+
+
+def write_geo_color_lut(path, rng, nbins=8):
+    bins = np.linspace(0, 256, nbins + 1)[1:-1]
+    ds = xr.Dataset({
+        'prior_yes': xr.DataArray(rng.uniform(0.3, 0.7, len(cspp_sft)), dims=['cspp_sft']),
+        'bins': xr.DataArray(np.tile(bins, (len(cspp_sft), 1, 1, 1)), dims=['cspp_sft', 'r', 'g', 'bds']),
+        'ratio': xr.DataArray(np.exp(rng.normal(0, 1.5, (len(cspp_sft), nbins, nbins, nbins))),
+                              dims=['cspp_sft', 'rr', 'gg', 'bb']),
+    }, coords={'cspp_sft': cspp_sft})
+    ds.to_netcdf(path)
+
+
+def make_luts(root, month=1, seed=0):
+    rng = np.random.default_rng(seed)
+    lut_dir = os.path.join(root, 'LUT')
+    os.makedirs(lut_dir, exist_ok=True)
+    for name, value_range in lut_ranges.items():
+        write_lut(os.path.join(lut_dir, '%s_M%.2d_handfix.nc' % (name, month)), value_range, rng)
+    write_geo_color_lut(os.path.join(lut_dir, 'GeoColorRGB_M%.2d_handfix.nc' % month), rng)
+    return lut_dir
+
+
+def make_scene(root, shape=(48, 56), start_time=datetime.datetime(2020, 1, 1, 12), seed=0, luts=True):
+    """Write a complete synthetic scene under ``root`` laid out like ``METEPY_DATA_PATH``.
+
+    Returns:
+        paths (dict): 'l1', 'geo', 'clm', 'nav', 'geo_color' file paths and the 'root'.
+    """
+    rng = np.random.default_rng(seed)
+    month = start_time.month
+    st, et = scene_times(start_time)
+    scene_dir = os.path.join(root, start_time.strftime('%Y%m%d'))
+    nav_dir = os.path.join(root, 'NAV')
+    os.makedirs(scene_dir, exist_ok=True)
+    os.makedirs(nav_dir, exist_ok=True)
+    paths = {
+        'root': root,
+        'l1': os.path.join(scene_dir, l1_file_name.format(st=st, et=et)),
+        'geo': os.path.join(scene_dir, geo_file_name.format(st=st, et=et)),
+        'clm': os.path.join(scene_dir, clm_file_name.format(st=st, et=et)),
+        'nav': os.path.join(nav_dir, nav_file_name % month),
+    }
+    paths['geo_color'] = paths['l1'].replace('FDI', 'CLR').replace('V0001.HDF', 'GeoColor.tif')
+    if os.path.exists(paths['nav']):
+        with h5py.File(paths['nav'], 'r') as f:
+            space = f['pixel_space_mask'][...].astype(bool)
+    else:
+        space = write_nav(paths['nav'], shape, np.random.default_rng(month))
+    write_l1(paths['l1'], shape, space, rng)
+    write_geo(paths['geo'], shape, space, rng)
+    tiff.imwrite(paths['geo_color'], rng.integers(0, 256, shape + (3,)).astype(np.uint8))
+    write_clm(paths['clm'], shape, space, rng)
+    if luts and not os.path.exists(os.path.join(root, 'LUT', 'T_11_M%.2d_handfix.nc' % month)):
+        make_luts(root, month, seed)
+    return paths
+
+
+class SyntheticDataTestCase(unittest.TestCase):
+    """A temporary directory as ``METEPY_DATA_PATH`` of each test, write the scenes or LUTs in ``tmp_dir``."""
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {'METEPY_DATA_PATH': self.tmp_dir.name})
+        self.env.start()
+
+    def tearDown(self) -> None:
+        self.env.stop()
+        self.tmp_dir.cleanup()
+
+
+def reference_infer(classifier, x, sft, valid_mask, space_mask=None, prob=False):
+    """The infer body once copied in each 1-D classifier, the reference of NBClassifier.infer."""
+    bin_start = classifier.lut_ds['bin_start'].data[sft[valid_mask] - 1]
+    delta_bin = classifier.lut_ds['delta_bin'].data[sft[valid_mask] - 1]
+    bin_idx = (x[valid_mask] - bin_start) / delta_bin
+    bin_idx_i = bin_idx.astype(np.int_)
+    bin_idx_i = np.clip(bin_idx_i.data, 1, 100)
+    r_v = classifier.lut_ds['class_cond_ratio_reg'].data[sft[valid_mask] - 1, bin_idx_i - 1]
+    if space_mask is None:
+        space_mask = x.mask
+    r = np.ma.masked_array(np.ones(x.shape, classifier.dtype), space_mask)
+    r[valid_mask] = r_v
+    if prob:
+        prior_yes = classifier.lut_ds['prior_yes'].data[sft[valid_mask] - 1]
+        p = np.ma.masked_array(np.zeros(x.shape, classifier.dtype), space_mask)
+        p[valid_mask] = 1.0 / (1.0 + r[valid_mask] / prior_yes - r[valid_mask])
+        return r, p
+    return r
@@ -1,6 +1,8 @@
 import unittest
 
 import os
+import sys
+import subprocess
 
 from CloudMask_NB.FY4A.NavFKM import FY4NavFile
 from CloudMask_NB.FY4A.GEOFKM import FY4AAGRIL1GEODISK4KM
@@ -9,7 +11,11 @@ from CloudMask_NB.FY4A.CLMFKM import FY4AAGRICLM4KM
 from CloudMask_NB.FY4A.NavieBayes import Ref063Min3x3Day, TStd, RefRatioDay, Ref138Day, NdsiDay, Ref063Day, Bt1185, \
     T11, Btd37511Night, RefStd, TmaxT, Emiss375Day, Emiss375Night, GeoColorRGB
 
+from CloudMask_NB.FY4A.LUTBundle import get_classifier_classes
 from CloudMask_NB.utils.cspp import infer_airmass, infer_scat_angle_short
+from CloudMask_NB.utils import kernels
+
+from .synthetic import SyntheticDataTestCase, make_luts, reference_infer
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -624,5 +630,105 @@ class TestCLMClassifiers(unittest.TestCase):
         fig.savefig(lut_file_name.replace('nc', 'png'), dpi=300)
 
 
+class TestInferKernel(SyntheticDataTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        make_luts(self.tmp_dir.name)
+        rng = np.random.default_rng(0)
+        shape = (61, 47)
+        self.sft = rng.integers(0, 8, shape).astype(np.uint8)
+        self.space_mask = rng.random(shape) < 0.2
+        self.valid_mask = (self.sft > 0) & ~self.space_mask & (rng.random(shape) < 0.8)
+        self.rng = rng
+
+    def test_same_as_reference(self) -> None:
+        classes = [cls for cls in get_classifier_classes() if cls is not GeoColorRGB]
+        self.assertEqual(len(classes), 13)
+        for cls in classes:
+            classifier = cls(lut_file_path=cls.get_lut_path(1))
+            bin_start = classifier.lut_ds['bin_start'].data[0]
+            bin_end = classifier.lut_ds['bin_end'].data[0]
+            margin = (bin_end - bin_start) * 0.2
+            # out of range values are clipped, masked but valid pixels keep their bin
+            x = np.ma.masked_array(self.rng.uniform(bin_start - margin, bin_end + margin, self.sft.shape),
+                                   self.rng.random(self.sft.shape) < 0.1).astype(np.float32)
+            r, p = classifier.infer(x, self.sft, self.valid_mask, self.space_mask, prob=True)
+            r_ref, p_ref = reference_infer(classifier, x, self.sft, self.valid_mask, self.space_mask.copy(), True)
+            for a, b in [(r, r_ref), (p, p_ref)]:
+                self.assertEqual(a.dtype, b.dtype)
+                np.testing.assert_array_equal(a.data, b.data)
+                np.testing.assert_array_equal(np.ma.getmaskarray(a), np.ma.getmaskarray(b))
+
+    def test_out(self) -> None:
+        t11 = T11(lut_file_path=T11.get_lut_path(1))
+        x = np.ma.masked_array(self.rng.uniform(180, 330, self.sft.shape), self.space_mask).astype(np.float32)
+        out = np.zeros(self.sft.shape, t11.dtype)
+        r = t11.infer(x, self.sft, self.valid_mask, self.space_mask, out=out)
+        self.assertTrue(np.shares_memory(r.data, out))
+        np.testing.assert_array_equal(r, t11.infer(x, self.sft, self.valid_mask, self.space_mask))
+        np.testing.assert_array_equal(out[~self.valid_mask], 1)
+        # valid pixels are never masked
+        self.assertEqual(r.mask.sum(), np.logical_and(self.space_mask, ~self.valid_mask).sum())
+
+    def test_product(self) -> None:
+        t11 = T11(lut_file_path=T11.get_lut_path(1))
+        x = np.ma.masked_array(self.rng.uniform(180, 330, self.sft.shape), self.space_mask).astype(np.float32)
+        product = self.rng.random(self.sft.shape)
+        expected = product * t11.infer(x, self.sft, self.valid_mask, self.space_mask).data
+        t11.infer(x, self.sft, self.valid_mask, self.space_mask, product=product)
+        np.testing.assert_array_equal(product, expected)
+
+    def test_backend(self) -> None:
+        with kernels.backend('numpy') as name:
+            self.assertEqual(name, 'numpy')
+        with kernels.backend('numba') as name:
+            # falls back to NumPy without numba
+            self.assertEqual(name, 'numba' if kernels.numba_available() else 'numpy')
+        with self.assertRaises(ValueError):
+            kernels.set_backend('cuda')
+
+    @unittest.skipUnless(kernels.numba_available(), 'numba not installed')
+    def test_numba_same_as_numpy(self) -> None:
+        for cls in [cls for cls in get_classifier_classes() if cls is not GeoColorRGB]:
+            for dtype in (np.float32, np.float64):
+                classifier = cls(lut_file_path=cls.get_lut_path(1), dtype=dtype)
+                bin_start = classifier.lut_ds['bin_start'].data[0]
+                bin_end = classifier.lut_ds['bin_end'].data[0]
+                margin = (bin_end - bin_start) * 0.2
+                x = np.ma.masked_array(self.rng.uniform(bin_start - margin, bin_end + margin, self.sft.shape),
+                                       self.rng.random(self.sft.shape) < 0.1).astype(np.float32)
+                x.data[self.rng.random(self.sft.shape) < 0.05] = np.nan
+                results = []
+                for name in ('numpy', 'numba'):
+                    product = np.random.default_rng(1).random(self.sft.shape)
+                    with kernels.backend(name):
+                        r, p = classifier.infer(x, self.sft, self.valid_mask, self.space_mask, prob=True,
+                                                product=product)
+                    results.append((r, p, product))
+                for a, b in zip(*results):
+                    self.assertEqual(a.dtype, b.dtype)
+                    np.testing.assert_array_equal(np.ma.getdata(a), np.ma.getdata(b))
+                    np.testing.assert_array_equal(np.ma.getmaskarray(a), np.ma.getmaskarray(b))
+
+    @unittest.skipUnless(kernels.numba_available(), 'numba not installed')
+    def test_threading_layer(self) -> None:
+        # importing the kernels does not change numba's threading layer, a launch only changes the default
+        code = ('import numba, numpy as np\n'
+                'from CloudMask_NB.utils import kernels\n'
+                'layer = numba.config.THREADING_LAYER\n'
+                'kernels.infer_ratio(np.ma.masked_array(np.ones(4)), np.ones(4, np.uint8), np.ones(4, bool), '
+                'np.zeros(1), np.ones(1), np.ones(100), np.empty(4))\n'
+                'print(layer, numba.config.THREADING_LAYER)\n')
+        env = {key: value for key, value in os.environ.items() if key != 'NUMBA_THREADING_LAYER'}
+        out = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.split(), ['default', 'workqueue'])
+        # a layer chosen by the application is kept
+        env['NUMBA_THREADING_LAYER'] = 'omp'
+        code = code.replace(code.splitlines()[3], 'kernels._check_threading_layer()')
+        out = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.split(), ['omp', 'omp'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,291 @@
+from unittest import mock
+
+import os
+import datetime
+
+import numpy as np
+import tifffile as tiff
+
+from CloudMask_NB.cli import detect_cloud_mask, main
+from CloudMask_NB.batch import find_scenes, process_scene, process_scenes, get_output_path
+from CloudMask_NB.backfill import Backfill, read_manifest, shard_by_month
+from CloudMask_NB.watch import SceneWatcher
+from CloudMask_NB.train import NBTrainer, TrainFiles, read_train_list, labels
+from CloudMask_NB.FY4A.Scene import Scene
+from CloudMask_NB.FY4A.FDIFKM import FY4AAGRIL1FDIDISK4KM
+from CloudMask_NB.FY4A.Ensemble import NBEnsemble
+from CloudMask_NB.FY4A.NavieBayes import T11, Bt1185
+from CloudMask_NB.FY4A.LUTBundle import LUTBundle
+from CloudMask_NB.FY4A.LUTRegistry import lut_registry
+from CloudMask_NB.utils.dtype import float_dtype
+
+from .synthetic import SyntheticDataTestCase, make_scene
+
+
+class TestDetectCloudMask(SyntheticDataTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.paths = make_scene(self.tmp_dir.name)
+
+    def detect(self, out_name: str, **kwargs) -> np.ndarray:
+        out_path = os.path.join(self.tmp_dir.name, out_name)
+        with np.errstate(all='ignore'):
+            detect_cloud_mask(self.paths['l1'], self.paths['geo'], out_path, **kwargs)
+        return tiff.imread(out_path)
+
+    def test_float32_same_mask_as_float64(self) -> None:
+        with float_dtype(np.float64):
+            clm_64 = self.detect('clm_64.tif')
+        with float_dtype(np.float32):
+            clm_32 = self.detect('clm_32.tif')
+        self.assertEqual(set(np.unique(clm_64)), {0, 1, 2, 3, 126})
+        np.testing.assert_array_equal(clm_32, clm_64)
+
+    def test_log_fusion_same_mask(self) -> None:
+        clm = self.detect('clm.tif')
+        clm_log = self.detect('clm_log.tif', fusion_engine='log')
+        np.testing.assert_array_equal(clm_log, clm)
+
+    def test_lut_bundle_same_mask(self) -> None:
+        clm = self.detect('clm.tif')
+        LUTBundle.compile(1)
+        clm_bundle = self.detect('clm_bundle.tif')
+        np.testing.assert_array_equal(clm_bundle, clm)
+
+    def test_block_rows_same_mask(self) -> None:
+        clm = self.detect('clm.tif')
+        for block_rows in [1, 7, 100]:
+            clm_blocks = self.detect('clm_blocks.tif', block_rows=block_rows)
+            np.testing.assert_array_equal(clm_blocks, clm)
+
+    def test_float32_default(self) -> None:
+        l1 = FY4AAGRIL1FDIDISK4KM(self.paths['l1'])
+        self.assertEqual(l1.get_band_by_channel('bt_1080').dtype, np.float32)
+        self.assertEqual(l1.get_band_by_channel('ems_372').dtype, np.float32)
+        l1 = FY4AAGRIL1FDIDISK4KM(self.paths['l1'], dtype=np.float64)
+        self.assertEqual(l1.get_band_by_channel('bt_1080').dtype, np.float64)
+        self.assertEqual(T11(lut_file_path=T11.get_lut_path(1)).dtype, np.float32)
+
+
+class TestBatch(SyntheticDataTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.paths = [make_scene(self.tmp_dir.name, start_time=datetime.datetime(2020, 1, 1, hour), seed=hour)
+                      for hour in [12, 13]]
+        self.out_dir = os.path.join(self.tmp_dir.name, 'out')
+
+    def test_find_scenes(self) -> None:
+        scene_dir = os.path.dirname(self.paths[0]['l1'])
+        scenes = find_scenes([scene_dir])
+        self.assertEqual([(scene.l1, scene.geo) for scene in scenes],
+                         [(paths['l1'], paths['geo']) for paths in self.paths])
+        # the GEO file is found next to a listed L1 file
+        list_path = os.path.join(self.tmp_dir.name, 'scenes.txt')
+        with open(list_path, 'w') as f:
+            f.write(self.paths[1]['l1'] + '\n')
+        self.assertEqual(find_scenes([list_path])[0].geo, self.paths[1]['geo'])
+        scenes = find_scenes([os.path.join(scene_dir, '*.HDF')],
+                             start=datetime.datetime(2020, 1, 1, 13), end=datetime.datetime(2020, 1, 1, 14))
+        self.assertEqual([scene.l1 for scene in scenes], [self.paths[1]['l1']])
+
+    def test_same_mask_and_failed_scene(self) -> None:
+        # a scene without its GEO file and a broken one fail alone
+        scene_dir = os.path.dirname(self.paths[0]['l1'])
+        os.remove(self.paths[1]['geo'])
+        broken = make_scene(self.tmp_dir.name, start_time=datetime.datetime(2020, 1, 1, 14), seed=14)
+        with open(broken['l1'], 'wb') as f:
+            f.write(b'not hdf')
+        with np.errstate(all='ignore'):
+            results = process_scenes(find_scenes([scene_dir]), self.out_dir, scene_workers=2)
+            self.assertEqual([result.ok for result in results], [True, False, False])
+            self.assertFalse(os.path.exists(results[2].out))
+            clm_path = os.path.join(self.tmp_dir.name, 'clm.tif')
+            detect_cloud_mask(self.paths[0]['l1'], self.paths[0]['geo'], clm_path)
+        np.testing.assert_array_equal(tiff.imread(results[0].out), tiff.imread(clm_path))
+
+    def test_failed_rerun_keeps_product(self) -> None:
+        scene = find_scenes([self.paths[0]['l1'], self.paths[0]['geo']])[0]
+        os.makedirs(self.out_dir)
+        with np.errstate(all='ignore'):
+            result = process_scene(scene, self.out_dir, NBEnsemble())
+        self.assertTrue(result.ok)
+        clm = tiff.imread(result.out)
+
+        def fail(l1, geo, out, **kwargs):
+            with open(out, 'wb') as f:
+                f.write(b'partial')
+            raise IOError('disk full')
+
+        with mock.patch('CloudMask_NB.batch.detect_cloud_mask', side_effect=fail):
+            result = process_scene(scene, self.out_dir, NBEnsemble())
+        self.assertFalse(result.ok)
+        np.testing.assert_array_equal(tiff.imread(result.out), clm)
+        self.assertEqual(os.listdir(self.out_dir), [os.path.basename(result.out)])
+
+    def test_main(self) -> None:
+        scene_dir = os.path.dirname(self.paths[0]['l1'])
+        with np.errstate(all='ignore'):
+            code = main(['batch', scene_dir, '-o', self.out_dir, '--start', '20200101_1300', '--compact'])
+        self.assertEqual(code, 0)
+        self.assertEqual(os.listdir(self.out_dir), [os.path.basename(get_output_path(self.paths[1]['l1'], ''))])
+
+
+class TestBackfill(SyntheticDataTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        start_times = [datetime.datetime(2020, 1, 1, 12), datetime.datetime(2020, 1, 2, 12),
+                       datetime.datetime(2020, 2, 1, 12)]
+        self.paths = [make_scene(self.tmp_dir.name, start_time=start_time, seed=i)
+                      for i, start_time in enumerate(start_times)]
+        self.out_dir = os.path.join(self.tmp_dir.name, 'out')
+        self.scenes = find_scenes([self.tmp_dir.name])
+
+    def test_shard_by_month(self) -> None:
+        self.assertEqual([len(shard) for shard in shard_by_month(self.scenes)], [2, 1])
+        self.assertEqual([len(shard) for shard in shard_by_month(self.scenes, 1)], [1, 1, 1])
+
+    def test_resume(self) -> None:
+        backfill = Backfill(self.out_dir, processes=2)
+        with np.errstate(all='ignore'):
+            summary = backfill.run(self.scenes)
+            self.assertEqual((summary['done'], summary['failed'], summary['skipped']), (3, 0, 0))
+            self.assertGreater(summary['scenes_per_minute'], 0)
+            self.assertEqual(len(read_manifest(backfill.manifest_path)), 3)
+            # done scenes are skipped, a scene whose tif is gone is done again
+            os.remove(get_output_path(self.paths[2]['l1'], self.out_dir))
+            summary = backfill.run(self.scenes)
+            self.assertEqual((summary['done'], summary['skipped']), (1, 2))
+            clm_path = os.path.join(self.tmp_dir.name, 'clm.tif')
+            detect_cloud_mask(self.paths[2]['l1'], self.paths[2]['geo'], clm_path)
+        np.testing.assert_array_equal(tiff.imread(get_output_path(self.paths[2]['l1'], self.out_dir)),
+                                      tiff.imread(clm_path))
+
+
+class TestSceneWatcher(SyntheticDataTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.paths = make_scene(self.tmp_dir.name)
+        self.in_dir = os.path.dirname(self.paths['l1'])
+        self.out_dir = os.path.join(self.tmp_dir.name, 'out')
+
+    def test_pair_and_process(self) -> None:
+        geo_path = os.path.join(self.tmp_dir.name, 'geo.part')
+        os.rename(self.paths['geo'], geo_path)
+        latencies = []
+        watcher = SceneWatcher(self.in_dir, self.out_dir, settle=0,
+                               callback=lambda result, latency: latencies.append(latency))
+        with np.errstate(all='ignore'):
+            self.assertEqual(watcher.poll(), [])
+            self.assertEqual(list(watcher.pending.values()), [{'l1': self.paths['l1']}])
+            # the month is loaded before the scene is complete
+            self.assertEqual(watcher.warm_months, {1})
+            os.rename(geo_path, self.paths['geo'])
+            results = watcher.poll()
+            self.assertEqual([result.ok for result in results], [True])
+            self.assertEqual(len(latencies), 1)
+            self.assertGreaterEqual(latencies[0], results[0].seconds)
+            self.assertEqual(watcher.poll(), [])
+            clm_path = os.path.join(self.tmp_dir.name, 'clm.tif')
+            detect_cloud_mask(self.paths['l1'], self.paths['geo'], clm_path)
+        np.testing.assert_array_equal(tiff.imread(results[0].out), tiff.imread(clm_path))
+        # a restarted watcher skips the scenes already classified
+        self.assertEqual(SceneWatcher(self.in_dir, self.out_dir, settle=0).poll(), [])
+
+    def test_settle(self) -> None:
+        watcher = SceneWatcher(self.in_dir, self.out_dir, settle=3600)
+        self.assertEqual(watcher.poll(), [])
+        self.assertEqual(len(watcher.pending), 1)
+
+
+class TestTrain(SyntheticDataTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.paths = [make_scene(self.tmp_dir.name, start_time=datetime.datetime(2020, 1, 1, hour), seed=hour)
+                      for hour in [12, 13]]
+        self.train_csv = os.path.join(self.tmp_dir.name, 'train.csv')
+        with open(self.train_csv, 'w') as f:
+            f.write('dt,l1,geo,clm\n')
+            for paths in self.paths:
+                f.write('x,%s,%s,%s\n' % (paths['l1'], paths['geo'], paths['clm']))
+
+    def per_sft_counts(self, histogram) -> np.ndarray:
+        # the training scripts: one sweep over the scenes per surface type and class
+        counts = np.zeros_like(histogram.counts)
+        for sft_idx in range(counts.shape[0]):
+            for paths in self.paths:
+                scene = Scene(paths['l1'], paths['geo'], paths['clm'])
+                x, valid_mask = histogram.classifier.prepare(scene)
+                sft_valid_mask = np.logical_and(valid_mask, scene.sft == sft_idx + 1)
+                fea = np.ma.getdata(x)[sft_valid_mask]
+                label = np.ma.getdata(scene.clm)[sft_valid_mask]
+                for label_idx, (_, value) in enumerate(labels):
+                    counts[sft_idx, label_idx] += np.histogram(fea[label == value],
+                                                               bins=histogram.edges[sft_idx])[0]
+        return counts
+
+    def test_same_counts_as_per_sft(self) -> None:
+        scenes = read_train_list(self.train_csv)
+        self.assertEqual(scenes, [TrainFiles(paths['l1'], paths['geo'], paths['clm']) for paths in self.paths])
+        with np.errstate(all='ignore'):
+            trainer = NBTrainer(['T_11', Bt1185]).fit(scenes)
+            self.assertEqual(trainer.names, ['T_11', 'Btd_11_85'])
+            self.assertEqual(trainer.n_scenes, 2)
+            for name in trainer.names:
+                histogram = trainer.histograms[name]
+                self.assertGreater(histogram.counts.sum(), 0)
+                np.testing.assert_array_equal(histogram.counts, self.per_sft_counts(histogram))
+            # bins between the extremes of the data, as the training scripts do
+            ranges = trainer.observed_ranges()
+            trainer = NBTrainer(['T_11'], ranges=ranges).fit(scenes)
+            histogram = trainer.histograms['T_11']
+            np.testing.assert_array_equal(histogram.counts, self.per_sft_counts(histogram))
+        seen = np.isfinite(ranges['T_11'][:, 0])
+        self.assertGreater(histogram.counts[seen].sum(axis=(1, 2)).min(), 0)
+        np.testing.assert_array_equal(histogram.edges[seen, 0], ranges['T_11'][seen, 0])
+        np.testing.assert_array_equal(histogram.edges[seen, -1], ranges['T_11'][seen, 1])
+
+    def test_lut(self) -> None:
+        with np.errstate(all='ignore'):
+            trainer = NBTrainer(['T_11']).fit(read_train_list(self.train_csv, 0, 1))
+        lut_ds = trainer.to_lut('T_11')
+        counts = trainer.histograms['T_11'].counts
+        trained = np.flatnonzero(counts.sum(axis=-1).min(axis=-1) > 0)
+        self.assertGreater(len(trained), 0)
+        for sft_idx in range(counts.shape[0]):
+            cloudy, clear = counts[sft_idx]
+            if sft_idx not in trained:
+                # an untrained surface type keeps its current LUT
+                np.testing.assert_array_equal(lut_ds['class_cond_ratio_reg'].data[sft_idx],
+                                              trainer.histograms['T_11'].classifier.lut_ds[
+                                                  'class_cond_ratio_reg'].data[sft_idx])
+                continue
+            self.assertEqual(lut_ds['prior_yes'].data[sft_idx], cloudy.sum() / (cloudy.sum() + clear.sum()))
+            np.testing.assert_array_equal(lut_ds['class_cond_ratio_reg'].data[sft_idx],
+                                          (clear / clear.sum()) / (cloudy / cloudy.sum() + 1e-5))
+
+    def test_lut_bundle(self) -> None:
+        scenes = read_train_list(self.train_csv)
+        with np.errstate(all='ignore'):
+            lut_ds = NBTrainer(['T_11']).fit(scenes).to_lut('T_11')
+            LUTBundle.compile(1)
+            lut_registry.clear()
+            # the compiled bundle is not a Dataset, the trainer starts from the NetCDF LUT
+            t11 = lut_registry.get(T11, 1)
+            self.assertNotIsInstance(t11.lut_ds, type(lut_ds))
+            for classifier in ['T_11', t11]:
+                bundle_lut_ds = NBTrainer([classifier]).fit(scenes).to_lut('T_11')
+                for name in ['prior_yes', 'bins', 'class_cond_ratio_reg']:
+                    np.testing.assert_array_equal(bundle_lut_ds[name].data, lut_ds[name].data)
+
+    def test_main(self) -> None:
+        out_dir = os.path.join(self.tmp_dir.name, 'LUT_trained')
+        with np.errstate(all='ignore'):
+            self.assertEqual(main(['train', self.train_csv, '-o', out_dir, '--classifiers', 'T_11',
+                                   '--data_ranges', '--rows', '0', '1']), 0)
+        t11 = T11(lut_file_path=os.path.join(out_dir, 'T_11_M01_handfix.nc'))
+        self.assertEqual(t11.nbins, 100)
@@ -0,0 +1,106 @@
+
+import os
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from CloudMask_NB.FY4A.Ensemble import NBEnsemble, default_classifiers, day_classifiers, \
+    get_classifier_class, get_classifier_registry
+from CloudMask_NB.FY4A.NavieBayes import T11, Ref063Day
+from CloudMask_NB.FY4A.Scene import Scene
+from CloudMask_NB.cli import add_ensemble_arguments, get_ensemble
+
+from .synthetic import SyntheticDataTestCase, make_scene
+
+
+class TestNBEnsemble(SyntheticDataTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.paths = make_scene(self.tmp_dir.name)
+
+    def test_registry(self) -> None:
+        registry = get_classifier_registry()
+        self.assertEqual(len(registry), 14)
+        self.assertIs(get_classifier_class('T_11'), T11)
+        self.assertIs(get_classifier_class('T11'), T11)
+        with self.assertRaises(KeyError):
+            get_classifier_class('T_12')
+        for cls in registry.values():
+            # every declared input is a scene field
+            Scene.requires(cls.required_inputs())
+            self.assertTrue(cls.feature_inputs)
+
+    def test_required_inputs(self) -> None:
+        inputs = NBEnsemble().required_inputs()
+        self.assertIn('bt_1080', inputs)
+        self.assertEqual(len(inputs), len(set(inputs)))
+        for name in ['pix_lat', 'pix_lon', 'snow_mask', 'ref_065', 'sat_zen']:
+            self.assertNotIn(name, inputs)
+        with self.assertRaises(ValueError):
+            NBEnsemble(['T_11', 'T11'])
+        with self.assertRaises(ValueError):
+            NBEnsemble(fusion_engine='sum')
+
+    def test_from_config(self) -> None:
+        config_path = os.path.join(self.tmp_dir.name, 'ensemble.json')
+        with open(config_path, 'w') as f:
+            json.dump({'classifiers': ['T_11', 'TStd'], 'day': True, 'fusion': 'log'}, f)
+        ensemble = NBEnsemble.from_config(config_path)
+        self.assertEqual(ensemble.names, ['T_11', 'TStd'] + day_classifiers)
+        self.assertEqual(ensemble.fusion_engine, 'log')
+        self.assertIn(Ref063Day, ensemble.classifier_classes)
+        self.assertEqual(ensemble.workers, 1)
+
+    def test_config_workers(self) -> None:
+        config_path = os.path.join(self.tmp_dir.name, 'ensemble.json')
+        with open(config_path, 'w') as f:
+            json.dump({'classifiers': ['T_11'], 'workers': 8}, f)
+        parser = argparse.ArgumentParser()
+        add_ensemble_arguments(parser)
+        self.assertEqual(get_ensemble(parser.parse_args(['--config', config_path])).workers, 8)
+        # the flag overrides the configuration
+        self.assertEqual(get_ensemble(parser.parse_args(['--config', config_path, '--workers', '2'])).workers, 2)
+        self.assertEqual(get_ensemble(parser.parse_args([])).workers, 1)
+
+    def test_day_classifiers(self) -> None:
+        # Ref063Day needs the clear sky composite, not part of the synthetic scene
+        names = default_classifiers + [name for name in day_classifiers if name != 'Ref063Day']
+        scene = Scene(self.paths['l1'], self.paths['geo'])
+        with np.errstate(all='ignore'):
+            fusion = NBEnsemble(names).run(scene)
+        self.assertEqual(fusion.names, names)
+        self.assertIn('scat_ang', scene)
+        dig_p = fusion.classify(T11(lut_file_path=T11.get_lut_path(1)).lut_ds['prior_yes'].data, scene.sft)
+        self.assertTrue(set(np.unique(dig_p)) <= {0, 1, 2, 3, 4, 126})
+
+    def test_subset(self) -> None:
+        scene = Scene(self.paths['l1'], self.paths['geo'])
+        with np.errstate(all='ignore'):
+            NBEnsemble(['T_11', 'Btd_11_85']).classify(scene)
+        self.assertEqual(set(scene.computed), {'bt_1080', 'bt_850', 'sft', 'space_mask'})
+
+    def test_workers_same_fusion(self) -> None:
+        names = default_classifiers + ['RefRatioDay', 'NdsiDay']
+        with np.errstate(all='ignore'):
+            product = NBEnsemble(names).run(Scene(self.paths['l1'], self.paths['geo'])).product
+            fusion = NBEnsemble(names, workers=4).run(Scene(self.paths['l1'], self.paths['geo']))
+            np.testing.assert_array_equal(fusion.product, product)
+            self.assertEqual(fusion.names, names)
+            log_sum = NBEnsemble(names, 'log').run(Scene(self.paths['l1'], self.paths['geo'])).log_sum
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                for _ in range(2):
+                    fusion = NBEnsemble(names, 'log').run(Scene(self.paths['l1'], self.paths['geo']),
+                                                          executor=executor)
+                    np.testing.assert_array_equal(fusion.log_sum, log_sum)
+
+    def test_compact_same_mask(self) -> None:
+        names = default_classifiers + [name for name in day_classifiers if name != 'Ref063Day']
+        with np.errstate(all='ignore'):
+            for fusion_engine in ['product', 'log']:
+                ensemble = NBEnsemble(names, fusion_engine)
+                dig_p = ensemble.classify(Scene(self.paths['l1'], self.paths['geo']))
+                compact = ensemble.classify(Scene(self.paths['l1'], self.paths['geo'], compact=True))
+                np.testing.assert_array_equal(compact, dig_p)
@@ -0,0 +1,103 @@
+import unittest
+
+import gc
+import weakref
+
+import numpy as np
+
+from CloudMask_NB.FY4A.Fusion import NBFusion, NBLogFusion
+
+
+class TestNBFusion(unittest.TestCase):
+
+    def setUp(self) -> None:
+        rng = np.random.default_rng(0)
+        self.shape = (32, 40)
+        self.space_mask = rng.random(self.shape) < 0.1
+        self.sft = rng.integers(1, 8, self.shape)
+        self.sft[self.space_mask] = 0
+        self.prior_yes = rng.uniform(0.3, 0.7, 7)
+        self.ratios = [np.ma.masked_array(np.exp(rng.normal(0, 1.5, self.shape)).astype(np.float32),
+                                          self.space_mask) for _ in range(8)]
+
+    def test_same_as_stacked_product(self) -> None:
+        fusion = NBFusion(self.shape, self.space_mask)
+        for i, ratio in enumerate(self.ratios):
+            fusion.add(ratio, 'c%d' % i)
+        expected = np.prod(np.stack([r.data for r in self.ratios]), 0, dtype=np.float64)
+        np.testing.assert_array_equal(fusion.product, expected)
+
+        valid = self.sft > 0
+        p = fusion.posterior(self.prior_yes, self.sft)
+        p_expected = 1.0 / (1.0 + expected[valid] / self.prior_yes[self.sft[valid] - 1] - expected[valid])
+        np.testing.assert_array_equal(p[valid], p_expected)
+        self.assertTrue(p.mask[self.space_mask].all())
+
+        dig_p = fusion.digitize(p, self.space_mask)
+        self.assertTrue((dig_p[self.space_mask] == 126).all())
+        self.assertTrue((dig_p[valid][p_expected >= 0.9] == 0).all())
+        self.assertTrue((dig_p[valid][p_expected <= 0.1] == 3).all())
+
+    def test_ratios_not_kept(self) -> None:
+        fusion = NBFusion(self.shape, self.space_mask)
+        ratio = self.ratios.pop()
+        ref = weakref.ref(ratio)
+        fusion.add(ratio, 'T11')
+        del ratio
+        gc.collect()
+        self.assertIsNone(ref())
+        with self.assertRaises(KeyError):
+            fusion.contribution('T11')
+        with self.assertRaises(ValueError):
+            fusion.add(self.ratios[0], 'T11')
+
+    def test_contributions(self) -> None:
+        fusion = NBFusion(self.shape, self.space_mask, keep_ratios=True)
+        fusion.add(self.ratios[0], 'T11').add(self.ratios[1], 'TStd')
+        self.assertEqual(list(fusion.contributions), ['T11', 'TStd'])
+        self.assertIs(fusion.contribution('TStd'), self.ratios[1])
+        self.assertEqual(len(fusion), 2)
+
+
+class TestNBLogFusion(unittest.TestCase):
+
+    def setUp(self) -> None:
+        rng = np.random.default_rng(1)
+        self.shape = (64, 80)
+        self.space_mask = rng.random(self.shape) < 0.1
+        self.sft = rng.integers(0, 8, self.shape)
+        self.sft[self.space_mask] = 0
+        self.prior_yes = rng.uniform(0.3, 0.7, 7)
+        self.ratios = [np.exp(rng.normal(0, 2, self.shape)) for _ in range(8)]
+
+    def test_same_as_product(self) -> None:
+        fusion = NBFusion(self.shape, self.space_mask)
+        log_fusion = NBLogFusion(self.shape, self.space_mask)
+        valid = ~self.space_mask
+        for i, ratio in enumerate(self.ratios):
+            fusion.add(ratio, 'c%d' % i)
+            log_fusion.add_log(np.log(ratio[valid]), 'c%d' % i, valid)
+        p = fusion.posterior(self.prior_yes, self.sft)
+        p_log = log_fusion.posterior(self.prior_yes, self.sft)
+        np.testing.assert_allclose(p_log.filled(-1), p.filled(-1), rtol=1e-12, atol=1e-15)
+        np.testing.assert_array_equal(log_fusion.classify(self.prior_yes, self.sft),
+                                      fusion.classify(self.prior_yes, self.sft))
+
+    def test_no_overflow(self) -> None:
+        log_fusion = NBLogFusion(self.shape, self.space_mask)
+        for i in range(8):
+            log_fusion.add(np.full(self.shape, 1e5), 'c%d' % i)
+        # the product 1e40 overflows float32, in the log domain p is a tiny positive number
+        p = log_fusion.posterior(self.prior_yes, self.sft)
+        self.assertTrue((p[self.sft > 0] < 1e-30).all())
+        dig_p = log_fusion.classify(self.prior_yes, self.sft)
+        self.assertTrue((dig_p[self.sft > 0] == 3).all())
+        self.assertTrue((dig_p[self.space_mask] == 126).all())
+
+    def test_contributions(self) -> None:
+        log_fusion = NBLogFusion(self.shape, self.space_mask, keep_ratios=True)
+        valid = ~self.space_mask
+        log_fusion.add_log(np.log(self.ratios[0][valid]), 'T11', valid)
+        ratio = log_fusion.contribution('T11')
+        np.testing.assert_allclose(ratio[valid], self.ratios[0][valid])
+        self.assertTrue((ratio[self.space_mask] == 1).all())
@@ -1,14 +1,20 @@
 import unittest
+from unittest import mock
 
 import os
+import tempfile
 
+import h5py
+import numpy as np
 import matplotlib.pyplot as plt
 
-from CloudMask_NB.FY4A.NavFKM import FY4NavFile
+from CloudMask_NB.FY4A.NavFKM import FY4NavFile, get_nav_file
 from CloudMask_NB.FY4A.GEOFKM import FY4AAGRIL1GEODISK4KM
 from CloudMask_NB.FY4A.FDIFKM import FY4AAGRIL1FDIDISK4KM
 from CloudMask_NB.FY4A.CLMFKM import FY4AAGRICLM4KM
 
+from .synthetic import make_scene
+
 data_root_dir = os.getenv('METEPY_DATA_PATH', 'data')
 
 
@@ -50,6 +56,52 @@ class TestFY4AAGRI(unittest.TestCase):
         pass
 
 
+class TestFY4AAGRIBands(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.paths = make_scene(self.tmp_dir.name, luts=False)
+
+    def test_get_bands_single_open(self) -> None:
+        l1 = FY4AAGRIL1FDIDISK4KM(self.paths['l1'])
+        names = ['bt_372_low', 'ems_372', 'bt_850', 'bt_1080']
+        with mock.patch.object(h5py, 'File', wraps=h5py.File) as h5_file:
+            bands = l1.get_bands(names)
+        self.assertEqual(h5_file.call_count, 1)
+        self.assertIsNone(l1._h5)
+        self.assertEqual(list(bands), names)
+        for name in names:
+            expected = l1.get_band_by_channel(name)
+            np.testing.assert_array_equal(bands[name].data, expected.data)
+            np.testing.assert_array_equal(np.ma.getmaskarray(bands[name]), np.ma.getmaskarray(expected))
+
+    def test_calibration_same_as_masked_lookup(self) -> None:
+        l1 = FY4AAGRIL1FDIDISK4KM(self.paths['l1'])
+        with h5py.File(self.paths['l1'], 'r') as f:
+            for c in range(1, 15):
+                idx_data = l1._decorate_ds_data(f['NOMChannel%.2d' % c])
+                idx_data.mask[idx_data.data > 60000] = True
+                cal_data = l1._decorate_ds_data(f['CALChannel%.2d' % c])
+                idx_data[~idx_data.mask] = cal_data[idx_data[~idx_data.mask].astype(int)]
+                band = l1._calibrate_ds_data(f['NOMChannel%.2d' % c], f['CALChannel%.2d' % c])
+                self.assertEqual(band.dtype, np.float32)
+                np.testing.assert_array_equal(band.data.astype(np.float64), idx_data.data)
+                np.testing.assert_array_equal(band.mask, idx_data.mask)
+
+    def test_context_manager(self) -> None:
+        l1 = FY4AAGRIL1FDIDISK4KM(self.paths['l1'])
+        with mock.patch.object(h5py, 'File', wraps=h5py.File) as h5_file:
+            with l1:
+                l1.get_band_by_channel('bt_1080')
+                l1.get_band_by_channel('ems_372')
+                self.assertIsNotNone(l1._h5)
+        self.assertEqual(h5_file.call_count, 1)
+        self.assertIsNone(l1._h5)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+
 class TestFY4AGEO(unittest.TestCase):
 
     def setUp(self) -> None:
@@ -95,6 +147,78 @@ class TestFY4ANav(unittest.TestCase):
         plt.show()
 
 
+class TestFY4ANavCache(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.paths = make_scene(self.tmp_dir.name, luts=False)
+
+    def test_fields_read_once(self) -> None:
+        fy4_nav = FY4NavFile(self.paths['nav'])
+        with mock.patch.object(h5py, 'File', wraps=h5py.File) as h5_file:
+            sft = fy4_nav.prepare_surface_type_to_cspp()
+            self.assertIs(fy4_nav.prepare_surface_type_to_cspp(), sft)
+            self.assertIs(fy4_nav.get_space_mask(b=True), fy4_nav.get_space_mask(b=True))
+            fy4_nav.get_latitude()
+            fy4_nav.get_coastal_mask()
+            fy4_nav.get_coastal_mask()
+        # sft fields with one open, then the space mask and the coast mask
+        self.assertEqual(h5_file.call_count, 3)
+        sft_masked = fy4_nav.prepare_surface_type_to_cspp(space_mask=True)
+        sft_masked[fy4_nav.get_space_mask(b=True)] = 1
+        self.assertTrue(fy4_nav.get_space_mask(b=True).any())
+
+    def test_sidecar(self) -> None:
+        sidecar_dir = os.path.join(self.tmp_dir.name, 'nav_cache')
+        sft = FY4NavFile(self.paths['nav'], sidecar_dir=sidecar_dir).prepare_surface_type_to_cspp()
+        fy4_nav = FY4NavFile(self.paths['nav'], sidecar_dir=sidecar_dir)
+        with mock.patch.object(h5py, 'File', wraps=h5py.File) as h5_file:
+            sft_mapped = fy4_nav.prepare_surface_type_to_cspp()
+        self.assertEqual(h5_file.call_count, 0)
+        self.assertIsInstance(sft_mapped, np.memmap)
+        np.testing.assert_array_equal(sft_mapped, sft)
+        # a changed NAV file invalidates the sidecar
+        with h5py.File(self.paths['nav'], 'a') as f:
+            f['pixel_land_mask'][...] = 7
+        stat = os.stat(self.paths['nav'])
+        os.utime(self.paths['nav'], (stat.st_atime, stat.st_mtime + 10))
+        sft_new = FY4NavFile(self.paths['nav'], sidecar_dir=sidecar_dir).prepare_surface_type_to_cspp()
+        self.assertNotIsInstance(sft_new, np.memmap)
+        self.assertFalse(np.array_equal(sft_new, sft))
+
+    def test_get_nav_file(self) -> None:
+        with mock.patch.dict(os.environ, {'METEPY_DATA_PATH': self.tmp_dir.name}):
+            fy4_nav = get_nav_file(1)
+            self.assertIs(get_nav_file(1), fy4_nav)
+            self.assertEqual(fy4_nav.fy4_nav_file_path, self.paths['nav'])
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+
+class TestFY4ANavSurfaceType(unittest.TestCase):
+
+    def test_lookup_same_as_masks(self) -> None:
+        fy4_nav = FY4NavFile('fygatNAV.FengYun-4A.xxxxxxx.4km_M01.h5')
+        rng = np.random.default_rng(0)
+        shape = (120, 130)
+        land = rng.integers(-1, 10, shape).astype(np.int8)
+        snow = rng.integers(-1, 5, shape).astype(np.int8)
+        desert = rng.integers(-1, 4, shape).astype(np.int8)
+        lat = rng.uniform(-90, 90, shape).astype(np.float32)
+        for value in (-60, 0, np.nan, -999):
+            lat[rng.random(shape) < 0.05] = value
+        expected = fy4_nav.classify_surface_type_by_masks(lat, land, snow, desert)
+        sft = fy4_nav.classify_surface_type(lat, land, snow, desert)
+        self.assertEqual(sft.dtype, np.uint8)
+        np.testing.assert_array_equal(sft, expected)
+        # wider integer codes and float64 latitude
+        sft = fy4_nav.classify_surface_type(lat.astype(np.float64), land.astype(np.int16),
+                                            snow.astype(np.int32), desert.astype(np.int16) + 512)
+        expected = fy4_nav.classify_surface_type_by_masks(lat, land, snow, desert.astype(np.int16) + 512)
+        np.testing.assert_array_equal(sft, expected)
+
+
 class TestFY4ACLM(unittest.TestCase):
 
     def setUp(self) -> None:
@@ -0,0 +1,140 @@
+import unittest
+
+import os
+import tempfile
+import threading
+from unittest import mock
+
+import numpy as np
+import xarray as xr
+
+from CloudMask_NB.FY4A.LUTBundle import LUTBundle, load_lut_bundle, get_classifier_classes
+from CloudMask_NB.FY4A.LUTRegistry import LUTRegistry
+from CloudMask_NB.FY4A.NavieBayes import T11, TStd, GeoColorRGB
+
+from .synthetic import SyntheticDataTestCase, make_luts
+
+
+class TestLUTBundle(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.lut_dir = make_luts(self.tmp_dir.name, month=3)
+        self.bundle_path = LUTBundle.compile(3, lut_dir=self.lut_dir)
+
+    def test_same_as_netcdf(self) -> None:
+        bundle = LUTBundle(self.bundle_path)
+        self.assertEqual(bundle.month, 3)
+        self.assertEqual(len(bundle), len(get_classifier_classes()))
+        for cls in get_classifier_classes():
+            with xr.open_dataset(os.path.join(self.lut_dir, cls.lut_file_name % 3)) as ds:
+                table = bundle[cls.short_name]
+                for key in ds.variables:
+                    np.testing.assert_array_equal(table[key].data, ds[key].data)
+                    self.assertFalse(table[key].data.flags.writeable)
+
+    def test_classifier_from_bundle(self) -> None:
+        bundle = load_lut_bundle(3, self.bundle_path)
+        rng = np.random.default_rng(0)
+        sft = rng.integers(1, 8, (20, 30))
+        valid_mask = rng.random((20, 30)) < 0.8
+        space_mask = np.zeros((20, 30), bool)
+        x = np.ma.masked_array(rng.uniform(170, 330, (20, 30)))
+        t11 = T11(lut_bundle=bundle)
+        t11_nc = T11(lut_file_path=os.path.join(self.lut_dir, T11.lut_file_name % 3))
+        np.testing.assert_array_equal(t11.infer(x, sft, valid_mask, space_mask),
+                                      t11_nc.infer(x, sft, valid_mask, space_mask))
+        rgb = rng.integers(0, 256, (20, 30, 3))
+        geo_color = GeoColorRGB(lut_bundle=bundle)
+        geo_color_nc = GeoColorRGB(lut_file_path=os.path.join(self.lut_dir, GeoColorRGB.lut_file_name % 3))
+        np.testing.assert_array_equal(geo_color.infer(rgb, sft, valid_mask, space_mask),
+                                      geo_color_nc.infer(rgb, sft, valid_mask, space_mask))
+
+    def test_stale(self) -> None:
+        bundle = load_lut_bundle(3, self.bundle_path)
+        self.assertEqual(bundle.stale_names(), [])
+        # a retrained T_11 LUT
+        t11_path = os.path.join(self.lut_dir, T11.lut_file_name % 3)
+        with xr.open_dataset(t11_path) as ds:
+            ds = ds.load()
+        ds['prior_yes'].data[:] = 0.5
+        ds.to_netcdf(t11_path)
+        self.assertEqual(bundle.stale_names(), ['T_11'])
+        with mock.patch('builtins.print'):
+            self.assertIsNone(load_lut_bundle(3, self.bundle_path))
+        t11 = T11(lut_bundle=bundle, lut_file_path=t11_path)
+        self.assertIsInstance(t11.lut_ds, xr.Dataset)
+        np.testing.assert_array_equal(t11.lut_ds['prior_yes'].data, 0.5)
+        self.assertNotIsInstance(TStd(lut_bundle=bundle).lut_ds, xr.Dataset)
+        LUTBundle.compile(3, lut_dir=self.lut_dir)
+        bundle = load_lut_bundle(3, self.bundle_path)
+        np.testing.assert_array_equal(T11(lut_bundle=bundle).lut_ds['prior_yes'].data, 0.5)
+        # a LUT added since the bundle was compiled
+        os.rename(t11_path, t11_path + '.bak')
+        LUTBundle.compile(3, lut_dir=self.lut_dir)
+        os.rename(t11_path + '.bak', t11_path)
+        self.assertEqual(LUTBundle(self.bundle_path).stale_names(), ['T_11'])
+
+    def test_missing_bundle(self) -> None:
+        self.assertIsNone(load_lut_bundle(4, os.path.join(self.lut_dir, 'missing.bundle')))
+        with open(os.path.join(self.lut_dir, 'bad.bundle'), 'wb') as f:
+            f.write(b'not a bundle' * 4)
+        with self.assertRaises(ValueError):
+            LUTBundle(os.path.join(self.lut_dir, 'bad.bundle'))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+
+class TestLUTRegistry(SyntheticDataTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        for month in (1, 2, 3):
+            make_luts(self.tmp_dir.name, month=month)
+
+    def test_reuse(self) -> None:
+        registry = LUTRegistry()
+        t11 = registry.get(T11, 1)
+        self.assertIs(registry.get(T11, 1), t11)
+        self.assertIsNot(registry.get(T11, 2), t11)
+        self.assertIsNot(registry.get(T11, 1, dtype=np.float64), t11)
+        self.assertEqual((registry.hits, registry.misses), (1, 3))
+
+    def test_from_bundle(self) -> None:
+        LUTBundle.compile(1)
+        registry = LUTRegistry()
+        t11 = registry.get(T11, 1)
+        self.assertNotIsInstance(t11.lut_ds, xr.Dataset)
+
+    def test_lru_bound(self) -> None:
+        registry = LUTRegistry(max_months=2)
+        t11 = registry.get(T11, 1)
+        registry.get(T11, 2)
+        registry.get(T11, 1)
+        registry.get(T11, 3)
+        self.assertIn(1, registry)
+        self.assertNotIn(2, registry)
+        self.assertIs(registry.get(T11, 1), t11)
+        self.assertEqual(len(registry), 2)
+
+    def test_preload(self) -> None:
+        registry = LUTRegistry()
+        thread = registry.preload(2, wait=False)
+        thread.join()
+        misses = registry.misses
+        self.assertEqual(misses, len(get_classifier_classes()))
+        registry.get(TStd, 2)
+        registry.get(GeoColorRGB, 2)
+        self.assertEqual(registry.misses, misses)
+
+    def test_threads_share_one_instance(self) -> None:
+        registry = LUTRegistry()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get(T11, 3))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(map(id, results))), 1)
+        self.assertEqual(registry.misses, 1)
@@ -0,0 +1,161 @@
+from unittest import mock
+
+import os
+
+import numpy as np
+
+from CloudMask_NB.FY4A.Scene import Scene
+from CloudMask_NB.FY4A.NavieBayes import NBClassifier
+from CloudMask_NB.FY4A.FDIFKM import FY4AAGRIL1FDIDISK4KM
+from CloudMask_NB.FY4A.GEOFKM import FY4AAGRIL1GEODISK4KM
+from CloudMask_NB.FY4A.NavFKM import FY4NavFile
+from CloudMask_NB.FY4A.LUTBundle import get_classifier_classes
+from CloudMask_NB.FY4A.MaskPlanes import mask_bits, word_dtype
+from CloudMask_NB.utils.disk_cache import DiskArrayCache
+from CloudMask_NB.utils.cspp import infer_airmass, infer_scat_angle_short
+
+from .synthetic import SyntheticDataTestCase, make_scene
+
+
+class TestScene(SyntheticDataTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.paths = make_scene(self.tmp_dir.name, luts=False)
+        self.scene = Scene(self.paths['l1'], self.paths['geo'], nav_file=FY4NavFile(self.paths['nav']))
+
+    def test_lazy(self) -> None:
+        self.assertEqual(self.scene.month, 1)
+        self.assertEqual(self.scene.computed, [])
+        bt_1080 = self.scene.bt_1080
+        self.assertEqual(self.scene.computed, ['bt_1080'])
+        # memoized, the same array is served again
+        self.assertIs(self.scene['bt_1080'], bt_1080)
+        self.assertEqual(self.scene.computed, ['bt_1080'])
+
+    def test_requires(self) -> None:
+        self.assertEqual(Scene.requires(['air_mass']), ['sat_zen', 'sun_zen', 'air_mass'])
+        self.assertEqual(Scene.depends('bt_1080_std3x3'), ('bt_1080',))
+        self.assertEqual(Scene.depends('ref_065_pct'), ('ref_065',))
+        self.assertEqual(Scene.source('bt_1080'), 'l1')
+        self.assertEqual(Scene.source('sft'), 'nav')
+        self.assertIsNone(Scene.source('scat_ang'))
+        with self.assertRaises(KeyError):
+            Scene.depends('bt_9999')
+        with self.assertRaises(AttributeError):
+            getattr(self.scene, 'bt_9999')
+
+    def test_prefetch_reads_only_required(self) -> None:
+        with mock.patch.object(FY4AAGRIL1FDIDISK4KM, 'get_bands',
+                               autospec=True, side_effect=FY4AAGRIL1FDIDISK4KM.get_bands) as get_bands:
+            self.scene.prefetch(['ems_372', 'bt_850', 'sft', 'space_mask', 'sun_zen'])
+        get_bands.assert_called_once()
+        self.assertEqual(set(self.scene.computed), {'ems_372', 'bt_850', 'sft', 'space_mask', 'sun_zen'})
+        for name in ['pix_lat', 'pix_lon', 'snow_mask', 'sat_zen']:
+            self.assertNotIn(name, self.scene)
+
+    def test_derived(self) -> None:
+        geo = FY4AAGRIL1GEODISK4KM(self.paths['geo'])
+        nav = FY4NavFile(self.paths['nav'])
+        sun_zen = geo.get_sun_zenith()
+        sat_zen = geo.get_satellite_zenith()
+        with np.errstate(all='ignore'):
+            np.testing.assert_array_equal(self.scene.air_mass, infer_airmass(sat_zen, sun_zen))
+            scat_ang = infer_scat_angle_short(nav.get_latitude(), nav.get_longitude(), 0, 104.7, sun_zen, sat_zen)
+            np.testing.assert_array_equal(self.scene.scat_ang, scat_ang)
+
+    def test_glint_mask(self) -> None:
+        l1 = FY4AAGRIL1FDIDISK4KM(self.paths['l1'])
+        geo = FY4AAGRIL1GEODISK4KM(self.paths['geo'])
+        bt_1080 = l1.get_band_by_channel('bt_1080')
+        ref_063 = l1.get_band_by_channel('ref_065') * 100
+        glint_mask = NBClassifier.glint_mask(geo.get_sun_glint(), bt_1080, NBClassifier.nxn('bt_1080', bt_1080, 1, np.std),
+                                             ref_063, NBClassifier.nxn('ref_063', ref_063, 1, np.std))
+        np.testing.assert_array_equal(self.scene.glint_mask, glint_mask)
+        # the window statistics are kept in the scene's neighborhood cache
+        self.assertIn(('bt_1080', 1, 'std'), self.scene.cache)
+        self.scene.clear()
+        self.assertEqual(len(self.scene.cache), 0)
+        self.assertNotIn('glint_mask', self.scene)
+
+    def test_rows(self) -> None:
+        rows = slice(10, 21)
+        scene = Scene(self.paths['l1'], self.paths['geo'], nav_file=FY4NavFile(self.paths['nav']), rows=rows)
+        names = ['ems_372', 'sun_zen', 'sft', 'scat_ang', 'air_mass']
+        scene.prefetch(names)
+        with np.errstate(all='ignore'):
+            for name in names:
+                self.assertEqual(scene[name].shape[0], 11)
+                np.testing.assert_array_equal(scene[name], self.scene[name][rows])
+        self.assertEqual(Scene.halo(['bt_1080', 'air_mass']), 0)
+        self.assertEqual(Scene.halo(['glint_mask']), 1)
+
+    def test_compact(self) -> None:
+        nav = FY4NavFile(self.paths['nav'])
+        earth_index = nav.get_earth_index()
+        self.assertEqual(earth_index.dtype, np.int32)
+        np.testing.assert_array_equal(earth_index, np.flatnonzero(~nav.get_space_mask(b=True)))
+        scene = Scene(self.paths['l1'], self.paths['geo'], nav_file=nav, compact=True)
+        names = ['bt_1080', 'sft', 'air_mass', 'bt_1080_std3x3', 'glint_mask']
+        scene.prefetch(names)
+        with np.errstate(all='ignore'):
+            for name in names:
+                self.assertEqual(scene[name].shape, earth_index.shape)
+                np.testing.assert_array_equal(scene[name], self.scene[name].reshape(-1)[earth_index])
+                np.testing.assert_array_equal(scene.expand(scene[name]), np.where(
+                    nav.get_space_mask(b=True), 0, np.ma.getdata(self.scene[name])))
+        # classifiers asking for a window of a vector get the disk statistic
+        np.testing.assert_array_equal(scene.cache.get('bt_1080', scene.bt_1080, 1, np.std), scene.bt_1080_std3x3)
+        with self.assertRaises(ValueError):
+            scene.cache.get('bt_1080', scene.bt_1080, 2, np.std)
+        with self.assertRaises(ValueError):
+            Scene(self.paths['l1'], compact=True, rows=slice(0, 10))
+
+    def test_mask_planes(self) -> None:
+        self.assertLessEqual(len(mask_bits), np.iinfo(word_dtype).bits)
+        # a fake clear sky composite, reading it needs pyresample
+        shape = self.scene.space_mask.shape
+        self.scene._store('ref_065_clear_pct', np.ma.masked_array(np.full(shape, 10.0), np.eye(*shape, dtype=bool)))
+        for cls in get_classifier_classes():
+            if not cls.required_bits:
+                continue
+            classifier = cls.__new__(cls)  # no LUT needed for the valid mask
+            with np.errstate(all='ignore'):
+                valid_mask = classifier.prepare_valid_mask(*[
+                    self.scene.cache if name == 'cache' else self.scene.get(name) for name in cls.valid_mask_inputs])
+                planes_mask = self.scene.masks.test(cls.required_bits, cls.forbidden_bits)
+            self.assertEqual(planes_mask.dtype, bool)
+            np.testing.assert_array_equal(planes_mask, np.ma.getdata(valid_mask), cls.short_name)
+        # each primitive mask is computed once, whatever the classifiers using it
+        with mock.patch.dict(mask_bits['mount'].__dict__, func=mock.Mock(side_effect=AssertionError)):
+            self.scene.masks.test(('surface_type',), ('mount',))
+        np.testing.assert_array_equal(self.scene.masks.get('space'), self.scene.space_mask)
+        with self.assertRaises(KeyError):
+            self.scene.masks.test(('bt_9999_obs',))
+        self.scene.clear()
+        self.assertIsNone(self.scene.masks.words)
+
+    def test_disk_cache(self) -> None:
+        disk_cache = DiskArrayCache(os.path.join(self.tmp_dir.name, 'cache'))
+        names = ['bt_1080', 'ref_065_pct', 'sun_zen', 'air_mass', 'scat_ang']
+        scene = Scene(self.paths['l1'], self.paths['geo'], nav_file=FY4NavFile(self.paths['nav']),
+                      disk_cache=disk_cache)
+        scene.prefetch(names)
+        # the next scene of the same files decodes nothing
+        scene = Scene(self.paths['l1'], self.paths['geo'], nav_file=FY4NavFile(self.paths['nav']),
+                      disk_cache=disk_cache)
+        with mock.patch.object(FY4AAGRIL1FDIDISK4KM, 'get_bands', side_effect=AssertionError), \
+                mock.patch.object(FY4AAGRIL1GEODISK4KM, 'get_sun_zenith', side_effect=AssertionError):
+            scene.prefetch(names)
+        self.assertIsInstance(np.ma.getdata(scene.bt_1080), np.memmap)
+        with np.errstate(all='ignore'):
+            for name in names:
+                np.testing.assert_array_equal(scene[name], self.scene[name])
+                np.testing.assert_array_equal(np.ma.getmaskarray(scene[name]), np.ma.getmaskarray(self.scene[name]))
+
+    def test_missing_file(self) -> None:
+        scene = Scene(self.paths['l1'])
+        with self.assertRaises(ValueError):
+            scene.get('sun_zen')
+        with self.assertRaises(ValueError):
+            scene.get('clm')
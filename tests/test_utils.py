@@ -1,11 +1,20 @@
 import unittest
+from unittest import mock
 import os
+import datetime
+import tempfile
 
+import numpy as np
 import xarray as xr
 
 data_root_dir = os.getenv('METEPY_DATA_PATH', 'data')
 
 from CloudMask_NB.utils.cspp import extract_from_cspp_nc
+from CloudMask_NB.utils.conv import im2col_cpu, cal_nxn_indices
+from CloudMask_NB.utils.filters import nxn_filter
+from CloudMask_NB.utils.cache import NeighborhoodCache
+from CloudMask_NB.utils.disk_cache import DiskArrayCache
+from CloudMask_NB.utils.sftp import LocalBackend, ConnectionPool, Fetcher, get_remote_path, get_scene_pairs
 
 
 class TestUtils(unittest.TestCase):
@@ -30,5 +39,225 @@ class TestUtils(unittest.TestCase):
             ds_c.to_netcdf("%s.nc" % i)
 
 
+class TestFilters(unittest.TestCase):
+    @staticmethod
+    def im2col_nxn(array, n, func):
+        k = 2 * n + 1
+        col = im2col_cpu(array.data[np.newaxis, np.newaxis], k, k, 1, 1, n, n, pval=65535)
+        col_m = im2col_cpu(np.ma.getmaskarray(array)[np.newaxis, np.newaxis], k, k, 1, 1, n, n, pval=True)
+        return func(np.ma.masked_array(col, col_m), (0, 1, 2, 3))
+
+    def test_nxn_filter_same_as_im2col(self):
+        rng = np.random.default_rng(0)
+        for shape, n in [((40, 50), 1), ((33, 21), 2), ((5, 4), 3)]:
+            data = rng.normal(280, 5, shape)
+            mask = rng.random(shape) < 0.3
+            mask[:3, :3] = True
+            array = np.ma.masked_array(data, mask)
+            for func in (np.min, np.max, np.mean, np.std):
+                expected = self.im2col_nxn(array, n, func)
+                result = nxn_filter(array, n, func)
+                np.testing.assert_array_equal(np.ma.getmaskarray(result), np.ma.getmaskarray(expected))
+                valid = ~np.ma.getmaskarray(expected)
+                np.testing.assert_allclose(result.data[valid], expected.data[valid], rtol=0, atol=1e-9)
+
+    def test_cal_nxn_indices_fallback(self):
+        array = np.ma.masked_array(np.arange(30.0).reshape(5, 6), np.zeros((5, 6), bool))
+        array[0, 0] = np.ma.masked
+        result = cal_nxn_indices(array, 1, np.ma.median)
+        expected = self.im2col_nxn(array, 1, np.ma.median)
+        np.testing.assert_array_equal(result, expected)
+
+
+class TestNeighborhoodCache(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(1)
+        self.bt_1080 = np.ma.masked_array(rng.normal(280, 5, (30, 30)), rng.random((30, 30)) < 0.1)
+        self.ref_063 = np.ma.masked_array(rng.random((30, 30)) * 100, rng.random((30, 30)) < 0.1)
+
+    def test_hit_and_miss(self):
+        with NeighborhoodCache() as cache:
+            a = cache.get('bt_1080', self.bt_1080, 1, np.std)
+            b = cache.get('bt_1080', self.bt_1080, 1, 'std')
+            self.assertIs(a, b)
+            cache.get('bt_1080', self.bt_1080, 1, np.max)
+            self.assertEqual((cache.hits, cache.misses), (1, 2))
+            # same band name, different array: recomputed
+            other = self.bt_1080 + 1
+            c = cache.get('bt_1080', other, 1, np.std)
+            self.assertIsNot(a, c)
+            self.assertEqual(cache.misses, 3)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_eviction(self):
+        cache = NeighborhoodCache(max_bytes=1)
+        cache.get('bt_1080', self.bt_1080, 1, np.std)
+        cache.get('ref_063', self.ref_063, 1, np.std)
+        self.assertEqual(len(cache), 1)
+        self.assertIn(('ref_063', 1, 'std'), cache)
+
+
+class TestDiskArrayCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.sources = []
+        for i in range(3):
+            path = os.path.join(self.tmp_dir.name, 'source_%d.HDF' % i)
+            with open(path, 'wb') as f:
+                f.write(b'x')
+            self.sources.append(path)
+        rng = np.random.default_rng(2)
+        self.band = np.ma.masked_array(rng.random((20, 30)).astype(np.float32), rng.random((20, 30)) < 0.1)
+        self.cache = DiskArrayCache(os.path.join(self.tmp_dir.name, 'cache'))
+
+    def test_hit_and_miss(self):
+        loader = mock.Mock(return_value=self.band)
+        self.assertIs(self.cache.get(self.sources[0], 'bt_1080.float32', loader), self.band)
+        value = self.cache.get(self.sources[0], 'bt_1080.float32', loader)
+        loader.assert_called_once()
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        # served from a read-only map of the file, not a copy
+        self.assertIsInstance(value.data, np.memmap)
+        self.assertFalse(value.data.flags.writeable)
+        np.testing.assert_array_equal(value.data, self.band.data)
+        np.testing.assert_array_equal(value.mask, self.band.mask)
+        plain = self.cache.get(self.sources[0], 'sun_zen.float32', lambda: self.band.data)
+        self.assertNotIsInstance(self.cache.get(self.sources[0], 'sun_zen.float32', None), np.ma.MaskedArray)
+        np.testing.assert_array_equal(plain, self.band.data)
+        self.assertEqual(self.cache.get(self.sources[0], 'center.float32', lambda: np.float32(3)), 3)
+        self.assertEqual(self.cache.get(self.sources[0], 'center.float32', None), 3)
+
+    def test_source_changed(self):
+        self.cache.get(self.sources[0], 'bt_1080.float32', lambda: self.band)
+        self.assertTrue(self.cache.contains(self.sources[0], 'bt_1080.float32'))
+        mtime = os.path.getmtime(self.sources[0])
+        os.utime(self.sources[0], (mtime + 10, mtime + 10))
+        self.assertFalse(self.cache.contains(self.sources[0], 'bt_1080.float32'))
+        value = self.cache.get(self.sources[0], 'bt_1080.float32', lambda: self.band + 1)
+        np.testing.assert_array_equal(value, self.band + 1)
+
+    def test_eviction(self):
+        nbytes = self.band.data.nbytes + self.band.mask.nbytes
+        self.cache.max_bytes = 2 * nbytes + 1024
+        for i, source in enumerate(self.sources):
+            mtime = os.path.getmtime(source)
+            self.cache.get(source, 'bt_1080.float32', lambda: self.band)
+            # least recently used first, the first source is used again last
+            os.utime(os.path.join(self.cache.entry_dir(self.sources[0]), 'source.json'), (mtime + 100, mtime + 100))
+        self.assertLessEqual(self.cache.nbytes, self.cache.max_bytes)
+        self.assertTrue(self.cache.contains(self.sources[0], 'bt_1080.float32'))
+        self.assertTrue(self.cache.contains(self.sources[2], 'bt_1080.float32'))
+        self.assertFalse(os.path.exists(self.cache.entry_dir(self.sources[1])))
+
+    def test_running_total(self):
+        with mock.patch.object(self.cache, '_entries', wraps=self.cache._entries) as entries:
+            for source in self.sources:
+                self.cache.get(source, 'bt_1080.float32', lambda: self.band)
+                self.cache.put(source, 'bt_1080.float32', self.band.data)  # the mask file is removed
+            # scanned once to seed the total, under max_bytes
+            self.assertEqual(entries.call_count, 1)
+        self.assertEqual(self.cache._nbytes, self.cache.nbytes)
+        self.cache.max_bytes = self.cache._nbytes - 1
+        with mock.patch.object(self.cache, '_entries', wraps=self.cache._entries) as entries:
+            self.cache.get(self.sources[0], 'sun_zen.float32', lambda: self.band.data)
+            entries.assert_called_once()  # over max_bytes, evict scans
+        self.assertEqual(self.cache._nbytes, self.cache.nbytes)
+        self.assertLessEqual(self.cache.nbytes, self.cache.max_bytes)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+
+class TestFetcher(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.remote_root = os.path.join(self.tmp_dir.name, 'remote')
+        self.out_dir = os.path.join(self.tmp_dir.name, 'local', '%Y%m%d')
+        self.start_times = [datetime.datetime(2020, 1, 1, 12) + datetime.timedelta(minutes=15 * i) for i in range(3)]
+        self.pairs = get_scene_pairs(self.start_times, self.out_dir)
+        rng = np.random.default_rng(0)
+        for remote_path, _ in self.pairs:
+            path = os.path.join(self.remote_root, remote_path.lstrip('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(rng.bytes(int(rng.integers(1, 5000))))
+        self.pool = ConnectionPool(lambda: LocalBackend(self.remote_root), max_size=2)
+
+    def read_remote(self, remote_path):
+        with open(os.path.join(self.remote_root, remote_path.lstrip('/')), 'rb') as f:
+            return f.read()
+
+    def test_remote_path(self):
+        self.assertEqual(get_remote_path('l1', datetime.datetime(2019, 10, 10, 14, 45)),
+                         '/FY4/FY4A/AGRI/L1/FDI/DISK/2019/20191010/'
+                         'FY4A-_AGRI--_N_DISK_1047E_L1-_FDI-_MULT_NOM_20191010144500_20191010145959_4000M_V0001.HDF')
+        self.assertEqual(len(self.pairs), 9)
+        self.assertTrue(self.pairs[0][1].startswith(os.path.join(self.tmp_dir.name, 'local', '20200101')))
+
+    def test_fetch_all(self):
+        fetcher = Fetcher(self.pool, chunk_size=100)
+        missing = ('/FY4/missing.HDF', os.path.join(self.tmp_dir.name, 'missing.HDF'))
+        results = fetcher.fetch_all(self.pairs + [missing])
+        for (remote_path, local_path), result in zip(self.pairs, results):
+            self.assertEqual(result, local_path)
+            with open(local_path, 'rb') as f:
+                self.assertEqual(f.read(), self.read_remote(remote_path))
+        # one failure does not stop the others
+        self.assertIsInstance(results[-1], FileNotFoundError)
+        # connections are reused, at most max_size at a time, the missing file drops none
+        self.assertLessEqual(self.pool.created, 2)
+
+    def test_missing_not_retried(self):
+        fetcher = Fetcher(self.pool)
+        missing = ('/FY4/missing.HDF', os.path.join(self.tmp_dir.name, 'missing.HDF'))
+        with mock.patch.object(LocalBackend, 'size', autospec=True, side_effect=LocalBackend.size) as size:
+            with self.assertRaises(FileNotFoundError):
+                fetcher.fetch(*missing)
+        self.assertEqual(size.call_count, 1)
+        self.assertEqual(fetcher.fetch(*self.pairs[0]), self.pairs[0][1])
+        self.assertEqual(self.pool.created, 1)
+
+    def test_connection_error_retried(self):
+        fetcher = Fetcher(self.pool)
+        remote_path, local_path = self.pairs[0]
+        errors = [EOFError('connection lost')]
+
+        def open_remote(backend, path, offset=0):
+            if errors:
+                raise errors.pop()
+            return open(backend._local(path), 'rb')
+
+        with mock.patch.object(LocalBackend, 'open', autospec=True, side_effect=open_remote), \
+                mock.patch('builtins.print') as print_:
+            self.assertEqual(fetcher.fetch(remote_path, local_path), local_path)
+        print_.assert_called_once()
+        # the failed connection was closed and a new one made
+        self.assertEqual(self.pool.created, 2)
+        with open(local_path, 'rb') as f:
+            self.assertEqual(f.read(), self.read_remote(remote_path))
+
+    def test_resume(self):
+        remote_path, local_path = self.pairs[0]
+        data = self.read_remote(remote_path)
+        os.makedirs(os.path.dirname(local_path))
+        with open(local_path + '.part', 'wb') as f:
+            f.write(data[:len(data) // 2])
+        fetcher = Fetcher(self.pool)
+        self.assertEqual(fetcher.fetch(remote_path, local_path), local_path)
+        self.assertFalse(os.path.exists(local_path + '.part'))
+        with open(local_path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        # a complete file is not downloaded again
+        mtime = os.path.getmtime(local_path)
+        os.utime(local_path, (mtime - 100, mtime - 100))
+        fetcher.fetch(remote_path, local_path)
+        self.assertEqual(os.path.getmtime(local_path), mtime - 100)
+
+    def tearDown(self) -> None:
+        self.pool.close()
+        self.tmp_dir.cleanup()
+
+
 if __name__ == '__main__':
     unittest.main()